@@ -73,20 +73,27 @@ class Sign(UserFunction):
 
 # A different implementation of sign with the straight through estimator for backprop. Has identical outputs but uses numpy instead
 # of CNTK intrinsics. This makes it much easier to write but slower for training since data has to be copied between CPU and GPU.
+# On the CPU, zero_copy avoids most of these copies: the inputs are passed as views of CNTK's buffers and the results are written
+# in place into buffers that CNTK preallocated.
 class pySign(UserFunction):
     def __init__ (self, arg, name='pySign'):
-        super(pySign, self).__init__([arg], name=name)
+        super(pySign, self).__init__([arg], zero_copy=True, name=name)
 
-    def forward(self, argument, device=None, outputs_to_retain=None):
-        sign = np.sign(argument)
+    def forward(self, argument, outputs, device=None, outputs_to_retain=None):
+        sign = outputs[self.output]
+        if sign is None:
+            sign = outputs[self.output] = np.empty_like(argument)
+        np.sign(argument, out=sign)
         np.place(sign, sign==0, -1)
-        return argument, sign
+        # the argument is only valid during this call, so keep a copy of what backward needs
+        return np.less_equal(np.abs(argument), 1)
 
-    def backward(self, state, root_gradients):
-        input = state
-        grad = np.abs(input)
-        grad = np.less_equal(grad, 1)
-        return grad*root_gradients
+    def backward(self, state, root_gradients, variables):
+        grad = variables[self.inputs[0]]
+        if grad is None:
+            variables[self.inputs[0]] = state*root_gradients
+        else:
+            np.multiply(state, root_gradients, out=grad)
 
     def infer_outputs(self):
         return [output_variable(self.inputs[0].shape, self.inputs[0].dtype,
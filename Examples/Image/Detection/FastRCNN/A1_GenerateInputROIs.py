@@ -8,13 +8,14 @@ from __future__ import print_function
 from builtins import input
 import os, sys, datetime
 import numpy as np
-import shutil, time
+import shutil, time, hashlib, functools, multiprocessing
+import cv2
 import PARAMETERS
 
 from cntk_helpers import makeDirectory, getFilesInDirectory, imread, imWidth, imHeight, imWidthHeight,\
                          getSelectiveSearchRois, imArrayWidthHeight, getGridRois, filterRois, imArrayWidth,\
                          imArrayHeight, getCntkInputPaths, getCntkRoiCoordsLine, getCntkRoiLabelsLine, roiTransformPadScaleParams,\
-                         roiTransformPadScale, cntkPadInputs
+                         roiTransformPadScale, cntkPadInputs, imresizeMaxDim
 
 ####################################
 # Parameters
@@ -22,68 +23,136 @@ from cntk_helpers import makeDirectory, getFilesInDirectory, imread, imWidth, im
 boSaveDebugImg = True
 subDirs = ['positive', 'testImages', 'negative']
 image_sets = ["train", "test"]
+nrWorkers = None     # number of processes used to compute the ROIs. None uses one process per core.
+boUseRoiCache = True # re-use the selective search ROIs of previous runs (keyed by image content and parameters)
 
 # no need to change these parameters
 boAddSelectiveSearchROIs = True
 boAddRoisOnGrid = True
 
+def getRoiCachePath(roiCacheDir, imgPath, roiParams):
+    # the cache key is the hash of the image file content and of all roi parameters and flags, including
+    # the grid and filter parameters which are applied to the cached rois, such that any change to how
+    # the rois of an image are computed invalidates its cached rois
+    hasher = hashlib.sha1()
+    with open(imgPath, 'rb') as f:
+        hasher.update(f.read())
+    hasher.update(repr(sorted(roiParams.items())).encode('utf-8'))
+    return os.path.join(roiCacheDir, hasher.hexdigest() + ".npz")
+
+def getSelectiveSearchRoisCached(imgPath, roiParams, roiCacheDir):
+    # returns the selective search rois, the image scale used for roi generation, and the width and height
+    # of the original and of the scaled image. Loads them from roiCacheDir if they were computed before.
+    cachePath = getRoiCachePath(roiCacheDir, imgPath, roiParams) if roiCacheDir else None
+    if cachePath and os.path.exists(cachePath):
+        with np.load(cachePath) as cached:
+            return cached['rects'], float(cached['scale']), tuple(cached['imgOrigSize']), tuple(cached['imgSize']), True
+
+    imgOrig = imread(imgPath)
+    if roiParams['boAddSelectiveSearchROIs']:
+        rects, img, scale = getSelectiveSearchRois(imgOrig, roiParams['ss_scale'], roiParams['ss_sigma'],
+                                                   roiParams['ss_minSize'], roiParams['roi_maxImgDim']) #interpolation=cv2.INTER_AREA
+    else:
+        rects = np.zeros((0, 4), np.int32)
+        img, scale = imresizeMaxDim(imgOrig, roiParams['roi_maxImgDim'], boUpscale=True, interpolation=cv2.INTER_AREA)
+    imgOrigSize = imArrayWidthHeight(imgOrig)
+    imgSize = imArrayWidthHeight(img)
+
+    if cachePath:
+        # write to a temporary file first, such that a partially written file is never loaded
+        tmpPath = "{}.{}.tmp".format(cachePath, os.getpid())
+        with open(tmpPath, 'wb') as f:
+            np.savez(f, rects=rects, scale=scale, imgOrigSize=imgOrigSize, imgSize=imgSize)
+        try:
+            os.rename(tmpPath, cachePath)
+        except OSError: # written concurrently for an image with the same content
+            os.remove(tmpPath)
+    return rects, scale, imgOrigSize, imgSize, False
+
+def computeImageRois(imgPath, roiParams, roiCacheDir=None):
+    # computes the rois of a single image in original image coordinates. Defined at module
+    # level such that it can be called in the worker processes of generate_input_rois().
+    tstart = datetime.datetime.now()
+    rects, scale, imgOrigSize, imgSize, boCached = getSelectiveSearchRoisCached(imgPath, roiParams, roiCacheDir)
+    imgWidth, imgHeight = imgSize
+    nrSsRois = len(rects)
+
+    # add grid rois
+    nrGridRois = 0
+    if roiParams['boAddRoisOnGrid']:
+        rectsGrid = getGridRois(imgWidth, imgHeight, roiParams['grid_nrScales'], roiParams['grid_aspectRatios'])
+        nrGridRois = len(rectsGrid)
+        rects = np.vstack((rects, np.array(rectsGrid, np.float64).reshape((-1, 4))))
+
+    # run filter
+    rois = filterRois(rects, imgWidth, imgHeight, roiParams['roi_minNrPixels'], roiParams['roi_maxNrPixels'],
+                      roiParams['roi_minDim'], roiParams['roi_maxDim'], roiParams['roi_maxAspectRatio'])
+    if len(rois) == 0: #make sure at least one roi returned per image
+        rois = [[5, 5, imgWidth-5, imgHeight-5]]
+
+    # scale up to original size
+    # note: each rectangle is in original image format with [x,y,x2,y2]
+    rois = np.int32(np.array(rois) / scale)
+    assert (np.min(rois) >= 0)
+    assert (np.max(rois[:, [0,2]]) < imgOrigSize[0])
+    assert (np.max(rois[:, [1,3]]) < imgOrigSize[1])
+    stats = {'nrSsRois': nrSsRois, 'nrGridRois': nrGridRois, 'nrRects': len(rects), 'boCached': boCached,
+             'timeMs': (datetime.datetime.now() - tstart).total_seconds() * 1000}
+    return rois, stats
+
 def generate_input_rois(testing=False):
     p = PARAMETERS.get_parameters_for_dataset()
     if not p.datasetName.startswith("pascalVoc"):
         # init
         makeDirectory(p.roiDir)
-        roi_minDim = p.roi_minDimRel * p.roi_maxImgDim
-        roi_maxDim = p.roi_maxDimRel * p.roi_maxImgDim
-        roi_minNrPixels = p.roi_minNrPixelsRel * p.roi_maxImgDim*p.roi_maxImgDim
-        roi_maxNrPixels = p.roi_maxNrPixelsRel * p.roi_maxImgDim*p.roi_maxImgDim
-
-        for subdir in subDirs:
-            makeDirectory(os.path.join(p.roiDir, subdir))
-            imgFilenames = getFilesInDirectory(os.path.join(p.imgDir, subdir), ".jpg")
-
-            # loop over all images
-            for imgIndex,imgFilename in enumerate(imgFilenames):
-                roiPath = "{}/{}/{}.roi.txt".format(p.roiDir, subdir, imgFilename[:-4])
-
-                # load image
-                print (imgIndex, len(imgFilenames), subdir, imgFilename)
+        roiCacheDir = os.path.join(p.roiDir, "cache") if boUseRoiCache else None
+        if roiCacheDir:
+            makeDirectory(roiCacheDir)
+        roiParams = {
+            'boAddSelectiveSearchROIs': boAddSelectiveSearchROIs,
+            'boAddRoisOnGrid': boAddRoisOnGrid,
+            'ss_scale': p.ss_scale,
+            'ss_sigma': p.ss_sigma,
+            'ss_minSize': p.ss_minSize,
+            'roi_maxImgDim': p.roi_maxImgDim,
+            'grid_nrScales': p.grid_nrScales,
+            'grid_aspectRatios': p.grid_aspectRatios,
+            'roi_minDim': p.roi_minDimRel * p.roi_maxImgDim,
+            'roi_maxDim': p.roi_maxDimRel * p.roi_maxImgDim,
+            'roi_minNrPixels': p.roi_minNrPixelsRel * p.roi_maxImgDim*p.roi_maxImgDim,
+            'roi_maxNrPixels': p.roi_maxNrPixelsRel * p.roi_maxImgDim*p.roi_maxImgDim,
+            'roi_maxAspectRatio': p.roi_maxAspectRatio}
+        computeRois = functools.partial(computeImageRois, roiParams=roiParams, roiCacheDir=roiCacheDir)
+
+        # the images are distributed across the worker processes, results are returned in order
+        nrProcesses = nrWorkers or multiprocessing.cpu_count()
+        pool = multiprocessing.Pool(nrProcesses) if nrProcesses > 1 else None
+        try:
+            for subdir in subDirs:
+                makeDirectory(os.path.join(p.roiDir, subdir))
+                imgFilenames = getFilesInDirectory(os.path.join(p.imgDir, subdir), ".jpg")
+                imgPaths = [os.path.join(p.imgDir, subdir, imgFilename) for imgFilename in imgFilenames]
+                results = pool.imap(computeRois, imgPaths) if pool else map(computeRois, imgPaths)
+
+                # loop over all images
                 tstart = datetime.datetime.now()
-                imgPath = os.path.join(p.imgDir, subdir, imgFilename)
-                imgOrig = imread(imgPath)
-                if imWidth(imgPath) > imHeight(imgPath):
-                    print (imWidth(imgPath) , imHeight(imgPath))
-
-                # get rois
-                if boAddSelectiveSearchROIs:
-                    print ("Calling selective search..")
-                    rects, img, scale = getSelectiveSearchRois(imgOrig, p.ss_scale, p.ss_sigma, p.ss_minSize, p.roi_maxImgDim) #interpolation=cv2.INTER_AREA
-                    print ("   Number of rois detected using selective search: " + str(len(rects)))
-                else:
-                    rects = []
-                    img, scale = imresizeMaxDim(imgOrig, p.roi_maxImgDim, boUpscale=True, interpolation=cv2.INTER_AREA)
-                imgWidth, imgHeight = imArrayWidthHeight(img)
-
-                # add grid rois
-                if boAddRoisOnGrid:
-                    rectsGrid = getGridRois(imgWidth, imgHeight, p.grid_nrScales, p.grid_aspectRatios)
-                    print ("   Number of rois on grid added: " + str(len(rectsGrid)))
-                    rects += rectsGrid
-
-                # run filter
-                print ("   Number of rectangles before filtering  = " + str(len(rects)))
-                rois = filterRois(rects, imgWidth, imgHeight, roi_minNrPixels, roi_maxNrPixels, roi_minDim, roi_maxDim, p.roi_maxAspectRatio)
-                if len(rois) == 0: #make sure at least one roi returned per image
-                    rois = [[5, 5, imgWidth-5, imgHeight-5]]
-                print ("   Number of rectangles after filtering  = " + str(len(rois)))
-
-                # scale up to original size and save to disk
-                # note: each rectangle is in original image format with [x,y,x2,y2]
-                rois = np.int32(np.array(rois) / scale)
-                assert (np.min(rois) >= 0)
-                assert (np.max(rois[:, [0,2]]) < imArrayWidth(imgOrig))
-                assert (np.max(rois[:, [1,3]]) < imArrayHeight(imgOrig))
-                np.savetxt(roiPath, rois, fmt='%d')
-                print ("   Time [ms]: " + str((datetime.datetime.now() - tstart).total_seconds() * 1000))
+                for imgIndex, (imgFilename, (rois, stats)) in enumerate(zip(imgFilenames, results)):
+                    print (imgIndex, len(imgFilenames), subdir, imgFilename)
+                    print ("   Number of rois detected using selective search: {}{}".format(stats['nrSsRois'], " (cached)" if stats['boCached'] else ""))
+                    print ("   Number of rois on grid added: " + str(stats['nrGridRois']))
+                    print ("   Number of rectangles before filtering  = " + str(stats['nrRects']))
+                    print ("   Number of rectangles after filtering  = " + str(len(rois)))
+                    print ("   Time [ms]: " + str(stats['timeMs']))
+
+                    # save to disk
+                    roiPath = "{}/{}/{}.roi.txt".format(p.roiDir, subdir, imgFilename[:-4])
+                    np.savetxt(roiPath, rois, fmt='%d')
+                totalSeconds = (datetime.datetime.now() - tstart).total_seconds()
+                print ("Computed rois of {} images in {:.1f} s using {} processes.".format(len(imgFilenames), totalSeconds, nrProcesses))
+        finally:
+            if pool:
+                pool.close()
+                pool.join()
 
     # clear imdb cache and other files
     if os.path.exists(p.cntkFilesDir):
@@ -8,9 +8,10 @@ from __future__ import print_function
 from builtins import str
 import pdb, sys, os, time
 import numpy as np
+import scipy.sparse
 import selectivesearch
 from easydict import EasyDict
-from fastRCNN.nms import nms as nmsPython
+from fastRCNN.nms import nms_greedy as nmsPython, nms_per_group
 from builtins import range
 
 import cv2, copy, textwrap
@@ -54,10 +55,9 @@ def getSelectiveSearchRois(img, ssScale, ssSigma, ssMinSize, maxDim):
     # inter_area seems to give much better results esp when upscaling image
     img, scale = imresizeMaxDim(img, maxDim, boUpscale=True, interpolation = cv2.INTER_AREA)
     _, ssRois = selectivesearch.selective_search(img, scale=ssScale, sigma=ssSigma, min_size=ssMinSize)
-    rects = []
-    for ssRoi in ssRois:
-        x, y, w, h = ssRoi['rect']
-        rects.append([x,y,x+w,y+h])
+    # convert from [x,y,w,h] to [x,y,x2,y2]
+    rects = np.array([ssRoi['rect'] for ssRoi in ssRois], np.int32).reshape((-1, 4))
+    rects[:, 2:] += rects[:, :2]
     return rects, img, scale
 
 
@@ -88,27 +88,31 @@ def getGridRois(imgWidth, imgHeight, nrGridScales, aspectRatios = [1.0]):
 
 def filterRois(rects, maxWidth, maxHeight, roi_minNrPixels, roi_maxNrPixels,
                roi_minDim, roi_maxDim, roi_maxAspectRatio):
-    filteredRects = []
-    filteredRectsSet = set()
-    for rect in rects:
-        if tuple(rect) in filteredRectsSet: # excluding rectangles with same co-ordinates
-            continue
-
-        x, y, x2, y2 = rect
-        w = x2 - x
-        h = y2 - y
-        assert(w>=0 and h>=0)
-
-        # apply filters
-        if h == 0 or w == 0 or \
-           x2 > maxWidth or y2 > maxHeight or \
-           w < roi_minDim or h < roi_minDim or \
-           w > roi_maxDim or h > roi_maxDim or \
-           w * h < roi_minNrPixels or w * h > roi_maxNrPixels or \
-           w / h > roi_maxAspectRatio or h / w > roi_maxAspectRatio:
-               continue
-        filteredRects.append(rect)
-        filteredRectsSet.add(tuple(rect))
+    # rects can be a list or an array of [x,y,x2,y2] rectangles. All filters are evaluated at
+    # once on the array of rectangles, and the kept rectangles are returned as array of shape (n, 4).
+    rects = np.array(rects, np.float64).reshape((-1, 4))
+    x, y, x2, y2 = rects.T
+    w = x2 - x
+    h = y2 - y
+    assert(np.all(w >= 0) and np.all(h >= 0))
+
+    # apply filters
+    with np.errstate(divide='ignore', invalid='ignore'):
+        keep = (h != 0) & (w != 0) & \
+               (x2 <= maxWidth) & (y2 <= maxHeight) & \
+               (w >= roi_minDim) & (h >= roi_minDim) & \
+               (w <= roi_maxDim) & (h <= roi_maxDim) & \
+               (w * h >= roi_minNrPixels) & (w * h <= roi_maxNrPixels) & \
+               (w / h <= roi_maxAspectRatio) & (h / w <= roi_maxAspectRatio)
+    filteredRects = rects[keep]
+
+    # excluding rectangles with same co-ordinates: the stable lexsort places the first
+    # occurrence of each rectangle before its duplicates
+    order = np.lexsort(filteredRects.T[::-1])
+    sortedRects = filteredRects[order]
+    isFirst = np.ones(len(order), np.bool_)
+    isFirst[1:] = np.any(sortedRects[1:] != sortedRects[:-1], axis=1)
+    filteredRects = filteredRects[np.sort(order[isFirst])]
 
     # could combine rectangles using non-maxima surpression or with similar co-ordinates
     # groupedRectangles, weights = cv2.groupRectangles(np.asanyarray(rectsInput, np.float).tolist(), 1, 0.3)
@@ -330,61 +334,63 @@ def saveSvm(svmDir, experimentName, svmWeights, svmBias, featureScale):
     np.savetxt(svmBiasPath, svmBias)
     np.savetxt(svmFeatScalePath, featureScale)
 
-def svmPredict(imgIndex, cntkOutputIndividualFilesDir, svmWeights, svmBias, svmFeatScale, roiSize, roiDim, decisionThreshold = 0):
-    cntkOutputPath = os.path.join(cntkOutputIndividualFilesDir,  str(imgIndex) + ".dat.npz")
+def loadCntkOutput(imgIndex, cntkOutputDir, roiSize):
+    cntkOutputPath = os.path.join(cntkOutputDir,  str(imgIndex) + ".dat.npz")
     data = np.load(cntkOutputPath)['arr_0']
     assert(len(data) == roiSize)
+    return data
 
-    # get prediction for each roi
-    labels = []
-    maxScores = []
-    for roiIndex in range(roiSize):
-        feat = data[roiIndex]
-        scores = np.dot(svmWeights, feat * 1.0 / svmFeatScale) + svmBias.ravel()
-        assert (len(scores) == roiDim)
-        maxArg = np.argmax(scores[1:]) + 1
-        maxScore = scores[maxArg]
-        if maxScore < decisionThreshold:
-            maxArg = 0
-        labels.append(maxArg)
-        maxScores.append(maxScore)
-    return labels, maxScores
+def svmScores(feats, svmWeights, svmBias, svmFeatScale):
+    # scores of all rois (rows of feats) for all classes in a single matrix product
+    return np.dot(feats * 1.0 / svmFeatScale, svmWeights.T) + svmBias.ravel()
 
-def nnPredict(imgIndex, cntkParsedOutputDir, roiSize, roiDim, decisionThreshold = None):
-    cntkOutputPath = os.path.join(cntkParsedOutputDir,  str(imgIndex) + ".dat.npz")
-    data = np.load(cntkOutputPath)['arr_0']
-    assert(len(data) == roiSize)
+def predictLabelsAndScores(scores, decisionThreshold = None, ignoreBackground = False):
+    # label and score of the highest scoring class per roi. Rois with a score
+    # below decisionThreshold are assigned to the background class (label 0).
+    if ignoreBackground:
+        labels = np.argmax(scores[:, 1:], axis=1) + 1
+    else:
+        labels = np.argmax(scores, axis=1)
+    maxScores = scores[np.arange(len(scores)), labels]
+    if decisionThreshold is not None:
+        labels[maxScores < decisionThreshold] = 0
+    return labels.tolist(), maxScores.tolist()
 
-    # get prediction for each roi
-    labels = []
-    maxScores = []
-    for roiIndex in range(roiSize):
-        scores = data[roiIndex]
-        scores = softmax(scores)
-        assert (len(scores) == roiDim)
-        maxArg = np.argmax(scores)
-        maxScore = scores[maxArg]
-        if decisionThreshold and maxScore < decisionThreshold:
-            maxArg = 0
-        labels.append(maxArg)
-        maxScores.append(maxScore)
-    return labels, maxScores
+def svmPredict(imgIndex, cntkOutputIndividualFilesDir, svmWeights, svmBias, svmFeatScale, roiSize, roiDim, decisionThreshold = 0):
+    data = loadCntkOutput(imgIndex, cntkOutputIndividualFilesDir, roiSize)
+    scores = svmScores(data, svmWeights, svmBias, svmFeatScale)
+    assert (scores.shape[1] == roiDim)
+    return predictLabelsAndScores(scores, decisionThreshold, ignoreBackground = True)
+
+def nnPredict(imgIndex, cntkParsedOutputDir, roiSize, roiDim, decisionThreshold = None):
+    data = loadCntkOutput(imgIndex, cntkParsedOutputDir, roiSize)
+    scores = softmax2D(data)
+    assert (scores.shape[1] == roiDim)
+    # a decision threshold of 0 is ignored
+    return predictLabelsAndScores(scores, decisionThreshold if decisionThreshold else None)
 
 def imdbUpdateRoisWithHighGtOverlap(imdb, positivesGtOverlapThreshold):
-    addedPosCounter = 0
-    existingPosCounter = 0
-    for imgIndex in range(imdb.num_images):
-        for boxIndex, gtLabel in enumerate(imdb.roidb[imgIndex]['gt_classes']):
-            if gtLabel > 0:
-                existingPosCounter += 1
-            else:
-                overlaps = imdb.roidb[imgIndex]['gt_overlaps'][boxIndex, :].toarray()[0]
-                maxInd = np.argmax(overlaps)
-                maxOverlap = overlaps[maxInd]
-                if maxOverlap >= positivesGtOverlapThreshold and maxInd > 0:
-                    addedPosCounter += 1
-                    imdb.roidb[imgIndex]['gt_classes'][boxIndex] = maxInd
-    return existingPosCounter, addedPosCounter
+    # relabel the non-positive rois of all images whose overlap with a ground truth box
+    # is at least positivesGtOverlapThreshold, using one sparse matrix for all images
+    gtClasses = [imdb.roidb[imgIndex]['gt_classes'] for imgIndex in range(imdb.num_images)]
+    if len(gtClasses) == 0:
+        return 0, 0
+    allGtClasses = np.concatenate(gtClasses)
+    allOverlaps = scipy.sparse.vstack([imdb.roidb[imgIndex]['gt_overlaps'] for imgIndex in range(imdb.num_images)]).tocsr()
+
+    isPositive = allGtClasses > 0
+    maxOverlaps = allOverlaps.max(axis=1).toarray().ravel()
+    candidates = np.where(~isPositive & (maxOverlaps >= positivesGtOverlapThreshold))[0]
+    maxInds = np.asarray(allOverlaps[candidates].toarray().argmax(axis=1)).ravel()
+    relabel = candidates[maxInds > 0]
+    relabelClasses = maxInds[maxInds > 0]
+
+    # write the new labels back to the rois of each image
+    imgStarts = np.cumsum([0] + [len(c) for c in gtClasses])
+    imgIndices = np.searchsorted(imgStarts, relabel, side='right') - 1
+    for imgIndex, boxIndex, label in zip(imgIndices, relabel - imgStarts[imgIndices], relabelClasses):
+        imdb.roidb[imgIndex]['gt_classes'][boxIndex] = label
+    return int(isPositive.sum()), len(relabel)
 
 
 ####################################
@@ -457,7 +463,7 @@ def applyNonMaximaSuppression(nmsThreshold, labels, scores, coords, ignore_backg
     assert (len(nmsKeepIndices) == len(set(nmsKeepIndices)))  # check if no roi indices was added >1 times
     return nmsKeepIndices
 
-def apply_nms(all_boxes, thresh, ignore_background=False, boUsePythonImpl=True):
+def apply_nms(all_boxes, thresh, ignore_background=False, boUsePythonImpl=False):
     """Apply non-maximum suppression to all predicted boxes output by the test_net method."""
     num_classes = len(all_boxes)
     num_images = len(all_boxes[0])
@@ -465,18 +471,18 @@ def apply_nms(all_boxes, thresh, ignore_background=False, boUsePythonImpl=True):
                  for _ in range(num_classes)]
     nms_keepIndices = [[[] for _ in range(num_images)]
                  for _ in range(num_classes)]
-    for cls_ind in range(num_classes):
-        if ignore_background and (cls_ind == 0):
-            continue
+    first_cls_ind = 1 if ignore_background else 0
+    for im_ind in range(num_images):
+        cls_inds = [cls_ind for cls_ind in range(first_cls_ind, num_classes) if len(all_boxes[cls_ind][im_ind]) > 0]
+        dets_per_class = [all_boxes[cls_ind][im_ind] for cls_ind in cls_inds]
+        if boUsePythonImpl:
+            keep_per_class = [nmsPython(dets, thresh) for dets in dets_per_class]
+        else:
+            # all classes of an image in a single call
+            keep_per_class = nms_per_group(dets_per_class, thresh)
 
-        for im_ind in range(num_images):
+        for cls_ind, keep in zip(cls_inds, keep_per_class):
             dets = all_boxes[cls_ind][im_ind]
-            if dets == []:
-                continue
-            if boUsePythonImpl:
-                keep = nmsPython(dets, thresh)
-            else:
-                keep = nms(dets, thresh)
             if len(keep) == 0:
                 continue
             nms_boxes[cls_ind][im_ind] = dets[keep, :].copy()
@@ -810,7 +816,8 @@ def softmax(vec):
     return outVec
 
 def softmax2D(w):
-    e = np.exp(w)
+    # subtract the maximum per row for numerical stability
+    e = np.exp(w - np.max(w, axis=1)[:, np.newaxis])
     dist = e / np.sum(e, axis=1)[:, np.newaxis]
     return dist
 
@@ -1,2 +1 @@
-from .selectivesearch import selective_search
-
+from .selectivesearch_numpy import selective_search
@@ -232,7 +232,8 @@ def _merge_regions(r1, r2):
     return rt
 
 def mycmp(x, y): 
-    return cmp(x[1],y[1])
+    # compare as Python floats, cmp() of numpy floats fails for numpy >= 1.13 and returns 0
+    return cmp(float(x[1]), float(y[1]))
     
 def cmp_to_key(mycmp):
     'Convert a cmp= function into a key= function'
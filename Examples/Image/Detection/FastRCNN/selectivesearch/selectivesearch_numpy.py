@@ -0,0 +1,255 @@
+# -*- coding: utf-8 -*-
+import heapq
+import numpy
+import skimage.color
+import skimage.feature
+
+from .selectivesearch import _generate_segments
+
+
+# "Selective Search for Object Recognition" by J.R.R. Uijlings et al.
+#
+#  - Vectorized version of selectivesearch.py. The regions are stored in
+#    arrays, where the row index of a region is its position in the output.
+#    The result is the same as for selectivesearch.selective_search().
+
+COLOUR_BINS = 25
+TEXTURE_BINS = 10
+
+
+def _bin_indices(values, bins, value_range):
+    """
+        calculate the bin of each value in the same way as numpy.histogram
+
+        returns the bin indices and a mask of the values within value_range
+    """
+    lo, hi = value_range
+    edges = numpy.linspace(lo, hi, bins + 1)
+    indices = numpy.searchsorted(edges, values, side='right') - 1
+    indices[values == hi] = bins - 1
+    valid = (values >= lo) & (values <= hi)
+    return indices, valid
+
+
+def _calc_hists(region_of_pixel, values, num_regions, bins, value_range):
+    """
+        calculate the histograms of all regions at once
+
+        values has one column per colour channel, the output histograms are
+        the L1 normalized concatenation of the histograms of all channels
+    """
+    hists = []
+    for colour_channel in range(values.shape[1]):
+        indices, valid = _bin_indices(values[:, colour_channel], bins, value_range)
+        counts = numpy.bincount(
+            region_of_pixel[valid] * bins + indices[valid],
+            minlength=num_regions * bins)
+        hists.append(counts.reshape((num_regions, bins)))
+    return numpy.hstack(hists).astype(numpy.float64)
+
+
+def _extract_regions(img):
+    """
+        calculate bounding box, size and histograms of all regions
+
+        regions are ordered by the first occurrence of their label in the
+        image, which is the order of the regions in selectivesearch.py
+    """
+    height, width = img.shape[:2]
+    pixel_labels = img[:, :, 3].ravel()
+    labels, first_pixel, region_of_pixel = numpy.unique(
+        pixel_labels, return_index=True, return_inverse=True)
+    order = numpy.argsort(first_pixel)
+    rank = numpy.empty_like(order)
+    rank[order] = numpy.arange(len(order))
+    region_of_pixel = rank[region_of_pixel.ravel()]
+    labels = labels[order]
+    num_regions = len(labels)
+
+    # bounding boxes and sizes
+    ys, xs = numpy.divmod(numpy.arange(height * width), width)
+    min_x = numpy.full(num_regions, width, dtype=numpy.int64)
+    min_y = numpy.full(num_regions, height, dtype=numpy.int64)
+    max_x = numpy.zeros(num_regions, dtype=numpy.int64)
+    max_y = numpy.zeros(num_regions, dtype=numpy.int64)
+    numpy.minimum.at(min_x, region_of_pixel, xs)
+    numpy.minimum.at(min_y, region_of_pixel, ys)
+    numpy.maximum.at(max_x, region_of_pixel, xs)
+    numpy.maximum.at(max_y, region_of_pixel, ys)
+    sizes = numpy.bincount(region_of_pixel, minlength=num_regions)
+
+    # colour histograms of the hsv image
+    hsv = skimage.color.rgb2hsv(img[:, :, :3]).reshape((-1, 3))
+    hist_c = _calc_hists(region_of_pixel, hsv, num_regions, COLOUR_BINS, (0.0, 255.0))
+
+    # texture histograms of the LBP texture gradient
+    tex_grad = numpy.zeros((height, width, 3))
+    for colour_channel in (0, 1, 2):
+        tex_grad[:, :, colour_channel] = skimage.feature.local_binary_pattern(
+            img[:, :, colour_channel], 8, 1.0)
+    hist_t = _calc_hists(region_of_pixel, tex_grad.reshape((-1, 3)), num_regions, TEXTURE_BINS, (0.0, 1.0))
+
+    hist_c /= sizes[:, numpy.newaxis]
+    hist_t /= sizes[:, numpy.newaxis]
+    return labels, numpy.stack((min_x, min_y, max_x, max_y), axis=1), sizes, hist_c, hist_t
+
+
+def _extract_neighbours(boxes):
+    """
+        calculate the pairs (a, b) with a < b of regions whose bounding boxes
+        intersect, i.e. one corner of b is strictly within the box of a
+    """
+    min_x, min_y, max_x, max_y = [c[:, numpy.newaxis] for c in boxes.T]
+
+    def inside(x, y):
+        return (min_x < x) & (x < max_x) & (min_y < y) & (y < max_y)
+
+    b_min_x, b_min_y, b_max_x, b_max_y = boxes.T
+    intersect = inside(b_min_x, b_min_y) | inside(b_max_x, b_max_y) | \
+        inside(b_min_x, b_max_y) | inside(b_max_x, b_min_y)
+    return numpy.nonzero(numpy.triu(intersect, k=1))
+
+
+def _calc_sims(a, b, boxes, sizes, hist_c, hist_t, imsize):
+    """
+        calculate the similarities of the region pairs (a[i], b[i])
+
+        histogram intersections are summed up sequentially (cumsum), such that
+        the result is the same as for the Python sum in selectivesearch.py
+    """
+    sim_colour = numpy.minimum(hist_c[a], hist_c[b]).cumsum(axis=-1)[..., -1]
+    sim_texture = numpy.minimum(hist_t[a], hist_t[b]).cumsum(axis=-1)[..., -1]
+    sim_size = 1.0 - (sizes[a] + sizes[b]) / float(imsize)
+    bbsize = (
+        (numpy.maximum(boxes[a, 2], boxes[b, 2]) - numpy.minimum(boxes[a, 0], boxes[b, 0]))
+        * (numpy.maximum(boxes[a, 3], boxes[b, 3]) - numpy.minimum(boxes[a, 1], boxes[b, 1])))
+    sim_fill = 1.0 - (bbsize - sizes[a] - sizes[b]) / float(imsize)
+    return sim_colour + sim_texture + sim_size + sim_fill
+
+
+def selective_search(
+        im_orig, scale=1.0, sigma=0.8, min_size=50):
+    '''Selective Search
+
+    Same parameters and result as selectivesearch.selective_search(). The
+    similarities of neighbouring regions are kept in a heap. Entries of merged
+    regions are not removed from the heap, but skipped when popped.
+
+    Parameters
+    ----------
+        im_orig : ndarray
+            Input image
+        scale : int
+            Free parameter. Higher means larger clusters in felzenszwalb segmentation.
+        sigma : float
+            Width of Gaussian kernel for felzenszwalb segmentation.
+        min_size : int
+            Minimum component size for felzenszwalb segmentation.
+    Returns
+    -------
+        img : ndarray
+            image with region label
+            region label is stored in the 4th value of each pixel [r,g,b,(region)]
+        regions : array of dict
+            [
+                {
+                    'rect': (left, top, right, bottom),
+                    'labels': [...]
+                },
+                ...
+            ]
+    '''
+    assert im_orig.shape[2] == 3, "3ch image is expected"
+
+    # load image and get smallest regions
+    # region label is stored in the 4th value of each pixel [r,g,b,(region)]
+    img = _generate_segments(im_orig, scale, sigma, min_size)
+
+    if img is None:
+        return None, {}
+
+    imsize = img.shape[0] * img.shape[1]
+    labels, init_boxes, init_sizes, init_hist_c, init_hist_t = _extract_regions(img)
+    num_init = len(labels)
+
+    # each merge adds one region, at most num_init - 1 merges are done
+    max_regions = 2 * num_init
+    boxes = numpy.zeros((max_regions, 4), dtype=numpy.int64)
+    sizes = numpy.zeros(max_regions, dtype=numpy.int64)
+    hist_c = numpy.zeros((max_regions, init_hist_c.shape[1]))
+    hist_t = numpy.zeros((max_regions, init_hist_t.shape[1]))
+    boxes[:num_init] = init_boxes
+    sizes[:num_init] = init_sizes
+    hist_c[:num_init] = init_hist_c
+    hist_t[:num_init] = init_hist_t
+    region_labels = [[l] for l in labels] + [None] * num_init
+    alive = numpy.zeros(max_regions, dtype=numpy.bool_)
+    alive[:num_init] = True
+    num_regions = num_init
+
+    # the ties of the highest similarity are resolved by the order in which the
+    # pairs were added, the pair added last is merged first
+    a, b = _extract_neighbours(init_boxes)
+    sims = _calc_sims(a, b, boxes, sizes, hist_c, hist_t, imsize)
+    heap = [(-s, -n, ai, bi) for n, (s, ai, bi) in enumerate(zip(sims.tolist(), a.tolist(), b.tolist()))]
+    heapq.heapify(heap)
+    num_pairs = len(heap)
+
+    # pairs of each region as (order, other region), ordered by order
+    pairs = [[] for _ in range(max_regions)]
+    for n, (ai, bi) in enumerate(zip(a.tolist(), b.tolist())):
+        pairs[ai].append((n, bi))
+        pairs[bi].append((n, ai))
+
+    # hierarchal search
+    while heap:
+
+        # get highest similarity of regions that have not been merged yet
+        _, _, i, j = heapq.heappop(heap)
+        if not (alive[i] and alive[j]):
+            continue
+
+        # merge corresponding regions
+        t = num_regions
+        num_regions += 1
+        new_size = sizes[i] + sizes[j]
+        boxes[t, :2] = numpy.minimum(boxes[i, :2], boxes[j, :2])
+        boxes[t, 2:] = numpy.maximum(boxes[i, 2:], boxes[j, 2:])
+        sizes[t] = new_size
+        hist_c[t] = (hist_c[i] * sizes[i] + hist_c[j] * sizes[j]) / new_size
+        hist_t[t] = (hist_t[i] * sizes[i] + hist_t[j] * sizes[j]) / new_size
+        region_labels[t] = region_labels[i] + region_labels[j]
+        alive[i] = alive[j] = False
+        alive[t] = True
+
+        # the neighbours of the new region are the remaining neighbours of
+        # both regions, each in the order of its first pair
+        neighbours = []
+        seen = set()
+        for _, n in sorted(pairs[i] + pairs[j]):
+            if alive[n] and n not in seen:
+                seen.add(n)
+                neighbours.append(n)
+        pairs[i] = pairs[j] = None
+        if not neighbours:
+            continue
+
+        # calculate similarity set with the new region
+        neighbours = numpy.array(neighbours)
+        sims = _calc_sims(t, neighbours, boxes, sizes, hist_c, hist_t, imsize)
+        for s, n in zip(sims.tolist(), neighbours.tolist()):
+            heapq.heappush(heap, (-s, -num_pairs, t, n))
+            pairs[t].append((num_pairs, n))
+            pairs[n].append((num_pairs, t))
+            num_pairs += 1
+
+    regions = []
+    for k in range(num_regions):
+        min_x, min_y, max_x, max_y = boxes[k].tolist()
+        regions.append({
+            'rect': (min_x, min_y, max_x - min_x, max_y - min_y),
+            'size': int(sizes[k]),
+            'labels': region_labels[k]
+        })
+
+    return img, regions
@@ -6,7 +6,8 @@
 
 from __future__ import print_function
 import numpy as np
-import os, sys
+import os, sys, time
+import hashlib
 import argparse
 import yaml     # pip install pyyaml
 import easydict # pip install easydict
@@ -33,6 +34,7 @@ from utils.map.map_helpers import evaluate_detections
 from utils.annotations.annotations_helper import parse_class_map_file
 from config import cfg
 from od_mb_source import ObjectDetectionMinibatchSource
+from proposal_store import ProposalStore
 from cntk_helpers import regress_rois
 
 ###############################################################
@@ -89,6 +91,7 @@ def set_global_vars(use_arg_parser = True):
     globalvars['rnd_seed'] = cfg.RNG_SEED
     globalvars['train_conv'] = cfg["CNTK"].TRAIN_CONV_LAYERS
     globalvars['train_e2e'] = cfg["CNTK"].TRAIN_E2E
+    globalvars['mb_size'] = mb_size
 
 
     if use_arg_parser:
@@ -101,7 +104,7 @@ def set_global_vars(use_arg_parser = True):
                             required=False, default=None)
         parser.add_argument('-n', '--num_epochs', help='Total number of epochs to train', type=int,
                             required=False, default=cfg["CNTK"].E2E_MAX_EPOCHS)
-        parser.add_argument('-m', '--minibatch_size', help='Minibatch size', type=int,
+        parser.add_argument('-m', '--minibatch_size', help='Minibatch size (number of images)', type=int,
                             required=False, default=mb_size)
         parser.add_argument('-e', '--epoch_size', help='Epoch size', type=int,
                             required=False, default=epoch_size)
@@ -125,6 +128,8 @@ def set_global_vars(use_arg_parser = True):
 
         args = vars(parser.parse_args())
 
+        if args['minibatch_size'] is not None:
+            globalvars['mb_size'] = args['minibatch_size']
         if args['rpnLrFactor'] is not None:
             globalvars['rpn_lr_factor'] = args['rpnLrFactor']
         if args['frcnLrFactor'] is not None:
@@ -361,7 +366,10 @@ def train_model(image_input, roi_input, dims_input, loss, pred_error,
         pad_width=image_width, pad_height=image_height, pad_value=img_pad_value,
         randomize=True, use_flipping=cfg["TRAIN"].USE_FLIPPED,
         max_images=cfg["CNTK"].NUM_TRAIN_IMAGES,
-        buffered_rpn_proposals=buffered_rpn_proposals)
+        buffered_rpn_proposals=buffered_rpn_proposals,
+        num_workers=cfg["CNTK"].READER_NUM_WORKERS,
+        cache_size_mb=cfg["CNTK"].READER_CACHE_SIZE_MB,
+        cache_file=cfg["CNTK"].READER_CACHE_FILE)
 
     # define mapping from reader streams to network inputs
     input_map = {
@@ -372,24 +380,46 @@ def train_model(image_input, roi_input, dims_input, loss, pred_error,
 
     use_buffered_proposals = buffered_rpn_proposals is not None
     progress_printer = ProgressPrinter(tag='Training', num_epochs=epochs_to_train, gen_heartbeat=True)
-    for epoch in range(epochs_to_train):       # loop over epochs
-        sample_count = 0
-        while sample_count < epoch_size:  # loop over minibatches in the epoch
-            data, proposals = od_minibatch_source.next_minibatch_with_proposals(min(mb_size, epoch_size-sample_count), input_map=input_map)
-            if use_buffered_proposals:
-                data[rpn_rois_input] = MinibatchData(Value(batch=np.asarray(proposals, dtype=np.float32)), 1, 1, False)
-                # remove dims input if no rpn is required to avoid warnings
-                del data[[k for k in data if '[6]' in str(k)][0]]
-
-            trainer.train_minibatch(data)                                    # update model with it
-            sample_count += trainer.previous_minibatch_sample_count          # count samples processed so far
-            progress_printer.update_with_trainer(trainer, with_metric=True)  # log progress
-            if sample_count % 100 == 0:
-                print("Processed {} samples".format(sample_count))
-
-        progress_printer.epoch_summary(with_metric=True)
-
-def compute_rpn_proposals(rpn_model, image_input, roi_input, dims_input):
+    try:
+        for epoch in range(epochs_to_train):       # loop over epochs
+            sample_count = 0
+            while sample_count < epoch_size:  # loop over minibatches in the epoch
+                data, proposals = od_minibatch_source.next_minibatch_with_proposals(min(globalvars['mb_size'], epoch_size-sample_count), input_map=input_map)
+                if use_buffered_proposals:
+                    num_images = len(proposals)
+                    data[rpn_rois_input] = MinibatchData(Value(batch=proposals), num_images, num_images, False)
+                    # remove dims input if no rpn is required to avoid warnings
+                    del data[[k for k in data if '[6]' in str(k)][0]]
+
+                trainer.train_minibatch(data)                                    # update model with it
+                previous_sample_count = sample_count
+                sample_count += trainer.previous_minibatch_sample_count          # count samples processed so far
+                progress_printer.update_with_trainer(trainer, with_metric=True)  # log progress
+                if sample_count // 100 > previous_sample_count // 100:           # crossed a multiple of 100
+                    print("Processed {} samples".format(sample_count))
+
+            progress_printer.epoch_summary(with_metric=True)
+    finally:
+        od_minibatch_source.close()
+
+def compute_proposals_key(rpn_model):
+    '''
+    Returns a hash of the parameter and constant values of rpn_model and of the proposal layer
+    settings. Buffered proposals are only resumed if they were computed with the same key, since
+    the rpn is retrained after a restart.
+    '''
+    key = hashlib.sha1()
+    for var in list(rpn_model.parameters) + list(rpn_model.constants):
+        key.update(np.ascontiguousarray(var.value).tobytes())
+    key.update(repr((cfg["TEST"].RPN_PRE_NMS_TOP_N, cfg["TEST"].RPN_POST_NMS_TOP_N,
+                     cfg["TEST"].RPN_NMS_THRESH, cfg["TEST"].RPN_MIN_SIZE)).encode('ascii'))
+    return key.hexdigest()
+
+def compute_rpn_proposals(rpn_model, image_input, roi_input, dims_input, store_file):
+    '''
+    Computes the rpn proposals of all training images and writes them to a ProposalStore
+    in store_file. Returns the store, from which the proposals are read during training.
+    '''
     num_images = cfg["CNTK"].NUM_TRAIN_IMAGES
     # Create the minibatch source
     od_minibatch_source = ObjectDetectionMinibatchSource(
@@ -397,7 +427,8 @@ def compute_rpn_proposals(rpn_model, image_input, roi_input, dims_input):
         max_annotations_per_image=cfg["CNTK"].INPUT_ROIS_PER_IMAGE,
         pad_width=image_width, pad_height=image_height, pad_value=img_pad_value,
         max_images=num_images,
-        randomize=False, use_flipping=False)
+        randomize=False, use_flipping=False,
+        num_workers=cfg["CNTK"].READER_NUM_WORKERS)
 
     # define mapping from reader streams to network inputs
     input_map = {
@@ -412,21 +443,30 @@ def compute_rpn_proposals(rpn_model, image_input, roi_input, dims_input):
     cfg["TEST"].RPN_PRE_NMS_TOP_N = cfg["TRAIN"].RPN_PRE_NMS_TOP_N
     cfg["TEST"].RPN_POST_NMS_TOP_N = cfg["TRAIN"].RPN_POST_NMS_TOP_N
 
-    buffered_proposals = [None for _ in range(num_images)]
-    sample_count = 0
-    while sample_count < num_images:
-        data = od_minibatch_source.next_minibatch(1, input_map=input_map)
-        output = rpn_model.eval(data)
-        out_dict = dict([(k.name, k) for k in output])
-        out_rpn_rois = output[out_dict['rpn_rois']][0]
-        buffered_proposals[sample_count] = np.round(out_rpn_rois).astype(np.int16)
-        sample_count += 1
-        if sample_count % 500 == 0:
-            print("Buffered proposals for {} samples".format(sample_count))
-
-    # resetting config values to original test values
-    cfg["TEST"].RPN_PRE_NMS_TOP_N = test_pre
-    cfg["TEST"].RPN_POST_NMS_TOP_N = test_post
+    buffered_proposals = ProposalStore(store_file, num_images, cfg["TRAIN"].RPN_POST_NMS_TOP_N,
+                                       resume=cfg["CNTK"].RESUME_BUFFERED_PROPOSALS,
+                                       key=compute_proposals_key(rpn_model))
+    sample_count = buffered_proposals.num_done()
+    if sample_count > 0:
+        print("Resuming buffering proposals at sample {}".format(sample_count))
+        od_minibatch_source.od_reader.skip_images(sample_count)
+
+    try:
+        while sample_count < num_images:
+            batch_size = min(cfg["CNTK"].EVAL_MB_SIZE, num_images - sample_count)
+            data = od_minibatch_source.next_minibatch(batch_size, input_map=input_map)
+            output = rpn_model.eval(data)
+            out_dict = dict([(k.name, k) for k in output])
+            out_rpn_rois = np.asarray(output[out_dict['rpn_rois']], dtype=np.float32)
+            buffered_proposals.write(sample_count, np.round(out_rpn_rois))
+            if (sample_count + len(out_rpn_rois)) // 500 > sample_count // 500:
+                print("Buffered proposals for {} samples".format(sample_count + len(out_rpn_rois)))
+            sample_count += len(out_rpn_rois)
+    finally:
+        od_minibatch_source.close()
+        # resetting config values to original test values
+        cfg["TEST"].RPN_PRE_NMS_TOP_N = test_pre
+        cfg["TEST"].RPN_POST_NMS_TOP_N = test_post
 
     return buffered_proposals
 
@@ -528,7 +568,8 @@ def train_faster_rcnn_alternating(base_model_file_name, debug_output=False):
                     rpn_lr_per_sample_scaled, mm_schedule, l2_reg_weight, epochs_to_train=rpn_epochs)
 
     print("stage 1a - buffering rpn proposals")
-    buffered_proposals_s1 = compute_rpn_proposals(stage1_rpn_network, image_input, roi_input, dims_input)
+    buffered_proposals_s1 = compute_rpn_proposals(stage1_rpn_network, image_input, roi_input, dims_input,
+                                                  os.path.join(globalvars['output_path'], "buffered_proposals_stage1.bin"))
 
     print("stage 1b - frcn")
     if True:
@@ -585,7 +626,8 @@ def train_faster_rcnn_alternating(base_model_file_name, debug_output=False):
                     rpn_lr_per_sample_scaled, mm_schedule, l2_reg_weight, epochs_to_train=rpn_epochs)
 
     print("stage 2a - buffering rpn proposals")
-    buffered_proposals_s2 = compute_rpn_proposals(stage2_rpn_network, image_input, roi_input, dims_input)
+    buffered_proposals_s2 = compute_rpn_proposals(stage2_rpn_network, image_input, roi_input, dims_input,
+                                                  os.path.join(globalvars['output_path'], "buffered_proposals_stage2.bin"))
 
     print("stage 2b - frcn")
     if True:
@@ -630,7 +672,8 @@ def eval_faster_rcnn_mAP(eval_model):
         max_annotations_per_image=cfg["CNTK"].INPUT_ROIS_PER_IMAGE,
         pad_width=image_width, pad_height=image_height, pad_value=img_pad_value,
         randomize=False, use_flipping=False,
-        max_images=cfg["CNTK"].NUM_TEST_IMAGES)
+        max_images=cfg["CNTK"].NUM_TEST_IMAGES,
+        num_workers=cfg["CNTK"].READER_NUM_WORKERS)
 
     # define mapping from reader streams to network inputs
     input_map = {
@@ -647,41 +690,57 @@ def eval_faster_rcnn_mAP(eval_model):
     # evaluate test images and write netwrok output to file
     print("Evaluating Faster R-CNN model for %s images." % num_test_images)
     all_gt_infos = {key: [] for key in classes}
-    for img_i in range(0, num_test_images):
-        mb_data = minibatch_source.next_minibatch(1, input_map=input_map)
-
-        gt_row = mb_data[roi_input].asarray()
-        gt_row = gt_row.reshape((cfg["CNTK"].INPUT_ROIS_PER_IMAGE, 5))
-        all_gt_boxes = gt_row[np.where(gt_row[:,-1] > 0)]
-
-        for cls_index, cls_name in enumerate(classes):
-            if cls_index == 0: continue
-            cls_gt_boxes = all_gt_boxes[np.where(all_gt_boxes[:,-1] == cls_index)]
-            all_gt_infos[cls_name].append({'bbox': np.array(cls_gt_boxes),
-                                           'difficult': [False] * len(cls_gt_boxes),
-                                           'det': [False] * len(cls_gt_boxes)})
-
-        output = frcn_eval.eval({image_input: mb_data[image_input], dims_input: mb_data[dims_input]})
-        out_dict = dict([(k.name, k) for k in output])
-        out_cls_pred = output[out_dict['cls_pred']][0]
-        out_rpn_rois = output[out_dict['rpn_rois']][0]
-        out_bbox_regr = output[out_dict['bbox_regr']][0]
-
-        labels = out_cls_pred.argmax(axis=1)
-        scores = out_cls_pred.max(axis=1)
-        regressed_rois = regress_rois(out_rpn_rois, out_bbox_regr, labels, mb_data[dims_input].asarray())
-
-        labels.shape = labels.shape + (1,)
-        scores.shape = scores.shape + (1,)
-        coords_score_label = np.hstack((regressed_rois, scores, labels))
-
-        #   shape of all_boxes: e.g. 21 classes x 4952 images x 58 rois x 5 coords+score
-        for cls_j in range(1, globalvars['num_classes']):
-            coords_score_label_for_cls = coords_score_label[np.where(coords_score_label[:,-1] == cls_j)]
-            all_boxes[cls_j][img_i] = coords_score_label_for_cls[:,:-1].astype(np.float32, copy=False)
-
-        if (img_i+1) % 100 == 0:
-            print("Processed {} samples".format(img_i+1))
+    start_time = time.time()
+    img_i = 0
+    try:
+        while img_i < num_test_images:
+            # several images are evaluated in one forward pass
+            mb_size = min(cfg["CNTK"].EVAL_MB_SIZE, num_test_images - img_i)
+            mb_data = minibatch_source.next_minibatch(mb_size, input_map=input_map)
+            num_images = mb_data[image_input].num_samples
+
+            gt_rows = mb_data[roi_input].asarray().reshape((num_images, cfg["CNTK"].INPUT_ROIS_PER_IMAGE, 5))
+            img_dims = mb_data[dims_input].asarray().reshape((num_images, 6))
+
+            output = frcn_eval.eval({image_input: mb_data[image_input], dims_input: mb_data[dims_input]})
+            out_dict = dict([(k.name, k) for k in output])
+
+            for mb_i in range(num_images):
+                gt_row = gt_rows[mb_i]
+                all_gt_boxes = gt_row[np.where(gt_row[:,-1] > 0)]
+
+                for cls_index, cls_name in enumerate(classes):
+                    if cls_index == 0: continue
+                    cls_gt_boxes = all_gt_boxes[np.where(all_gt_boxes[:,-1] == cls_index)]
+                    all_gt_infos[cls_name].append({'bbox': np.array(cls_gt_boxes),
+                                                   'difficult': [False] * len(cls_gt_boxes),
+                                                   'det': [False] * len(cls_gt_boxes)})
+
+                out_cls_pred = output[out_dict['cls_pred']][mb_i]
+                out_rpn_rois = output[out_dict['rpn_rois']][mb_i]
+                out_bbox_regr = output[out_dict['bbox_regr']][mb_i]
+
+                labels = out_cls_pred.argmax(axis=1)
+                scores = out_cls_pred.max(axis=1)
+                regressed_rois = regress_rois(out_rpn_rois, out_bbox_regr, labels, img_dims[mb_i])
+
+                labels.shape = labels.shape + (1,)
+                scores.shape = scores.shape + (1,)
+                coords_score_label = np.hstack((regressed_rois, scores, labels))
+
+                #   shape of all_boxes: e.g. 21 classes x 4952 images x 58 rois x 5 coords+score
+                for cls_j in range(1, globalvars['num_classes']):
+                    coords_score_label_for_cls = coords_score_label[np.where(coords_score_label[:,-1] == cls_j)]
+                    all_boxes[cls_j][img_i] = coords_score_label_for_cls[:,:-1].astype(np.float32, copy=False)
+
+                img_i += 1
+                if img_i % 100 == 0:
+                    print("Processed {} samples".format(img_i))
+    finally:
+        minibatch_source.close()
+
+    elapsed = time.time() - start_time
+    print("Evaluated {} images in {:.1f} seconds ({:.1f} images/sec)".format(num_test_images, elapsed, num_test_images / elapsed))
 
     # calculate mAP
     aps = evaluate_detections(all_boxes, all_gt_infos, classes,
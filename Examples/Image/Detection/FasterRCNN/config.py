@@ -51,6 +51,21 @@ __C.CNTK.INPUT_ROIS_PER_IMAGE = 50
 __C.CNTK.IMAGE_WIDTH = 850
 __C.CNTK.IMAGE_HEIGHT = 850
 
+# number of threads that load upcoming images, 0 loads them on the training thread
+__C.CNTK.READER_NUM_WORKERS = 4
+# size of the in-memory cache for scaled and padded training images in MB (about 8.7 MB per 850 x 850 image),
+# 0 disables caching
+__C.CNTK.READER_CACHE_SIZE_MB = 0
+# if set, all training images are cached in a memory mapped file at this path instead, which is reused
+# by later training stages and runs with the same images
+__C.CNTK.READER_CACHE_FILE = None
+
+# number of images per minibatch when evaluating the model on the test set or buffering rpn proposals for 4-stage training
+__C.CNTK.EVAL_MB_SIZE = 8
+# whether to continue buffering rpn proposals from an existing proposal store in the output folder,
+# which is only reused if it was computed with an rpn with the same weights
+__C.CNTK.RESUME_BUFFERED_PROPOSALS = False
+
 __C.CNTK.RESULTS_NMS_THRESHOLD = 0.5 # see also: __C.TEST.NMS = 0.5
 __C.CNTK.RESULTS_NMS_CONF_THRESHOLD = 0.0
 __C.CNTK.RESULTS_BGR_PLOT_THRESHOLD = 0.1
@@ -12,20 +12,25 @@ import numpy as np
 class ObjectDetectionMinibatchSource(UserMinibatchSource):
     def __init__(self, img_map_file, roi_map_file, max_annotations_per_image,
                  pad_width, pad_height, pad_value, randomize, use_flipping,
-                 max_images=None, buffered_rpn_proposals=None):
+                 max_images=None, buffered_rpn_proposals=None,
+                 num_workers=0, cache_size_mb=0, cache_file=None):
 
         self.image_si = StreamInformation("image", 0, 'dense', np.float32, (3, pad_height, pad_width,))
         self.roi_si = StreamInformation("annotation", 1, 'dense', np.float32, (max_annotations_per_image, 5,))
         self.dims_si = StreamInformation("dims", 1, 'dense', np.float32, (4,))
 
         self.od_reader = ObjectDetectionReader(img_map_file, roi_map_file, max_annotations_per_image,
-                 pad_width, pad_height, pad_value, randomize, use_flipping, max_images, buffered_rpn_proposals)
+                 pad_width, pad_height, pad_value, randomize, use_flipping, max_images, buffered_rpn_proposals,
+                 num_workers, cache_size_mb, cache_file)
 
         super(ObjectDetectionMinibatchSource, self).__init__()
 
     def stream_infos(self):
         return [self.image_si, self.roi_si, self.dims_si]
 
+    def close(self):
+        self.od_reader.close()
+
     def image_si(self):
         return self.image_si
 
@@ -40,24 +45,52 @@ class ObjectDetectionMinibatchSource(UserMinibatchSource):
         return result
 
     def next_minibatch_with_proposals(self, num_samples, number_of_workers=1, worker_rank=1, device=None, input_map=None):
-        if num_samples > 1:
-            print("Only single item mini batches are supported currently by od_mb_source.py")
-            exit(1)
+        '''
+        Reads a minibatch of up to ``num_samples`` images. A minibatch does not
+        span across sweeps, i.e. it is cut short at the end of a sweep. All
+        images are scaled and padded to the same size, and the ground truth
+        annotations are padded with all-zero rows, which the RPN layers mask
+        out per image. The padded area of each image is given by its dims.
+
+        Returns:
+            the minibatch data and the buffered proposals of the images as array of shape
+            (num_images, num_proposals, 4) or None if no buffered proposals are used.
+        '''
+        img_data = []
+        roi_data = []
+        img_dims = []
+        buffered_proposals = []
+        while len(img_data) < num_samples:
+            img, rois, dims, proposals = self.od_reader.get_next_input()
+            img_data.append(img)
+            roi_data.append(rois)
+            img_dims.append(dims)
+            buffered_proposals.append(proposals)
+            if self.od_reader.sweep_end():
+                break
 
-        img_data, roi_data, img_dims, buffered_proposals = self.od_reader.get_next_input()
         sweep_end = self.od_reader.sweep_end()
+        num_images = len(img_data)
+
+        img_data = np.asarray(img_data, dtype=np.float32)
+        roi_data = np.asarray(roi_data, dtype=np.float32)
+        img_dims = np.asarray(img_dims, dtype=np.float32)
+        if buffered_proposals[0] is None:
+            buffered_proposals = None
+        else:
+            buffered_proposals = np.asarray(buffered_proposals, dtype=np.float32)
 
         if input_map is None:
             result = {
-                self.image_si: MinibatchData(Value(batch=img_data), 1, 1, sweep_end),
-                self.roi_si:   MinibatchData(Value(batch=roi_data), 1, 1, sweep_end),
-                self.dims_si:  MinibatchData(Value(batch=np.asarray(img_dims, dtype=np.float32)), 1, 1, sweep_end),
+                self.image_si: MinibatchData(Value(batch=img_data), num_images, num_images, sweep_end),
+                self.roi_si:   MinibatchData(Value(batch=roi_data), num_images, num_images, sweep_end),
+                self.dims_si:  MinibatchData(Value(batch=img_dims), num_images, num_images, sweep_end),
             }
         else:
             result = {
-                input_map[self.image_si]: MinibatchData(Value(batch=np.asarray(img_data, dtype=np.float32)), 1, 1, sweep_end),
-                input_map[self.roi_si]:   MinibatchData(Value(batch=np.asarray(roi_data, dtype=np.float32)), 1, 1, sweep_end),
-                input_map[self.dims_si]:  MinibatchData(Value(batch=np.asarray(img_dims, dtype=np.float32)), 1, 1, sweep_end),
+                input_map[self.image_si]: MinibatchData(Value(batch=img_data), num_images, num_images, sweep_end),
+                input_map[self.roi_si]:   MinibatchData(Value(batch=roi_data), num_images, num_images, sweep_end),
+                input_map[self.dims_si]:  MinibatchData(Value(batch=img_dims), num_images, num_images, sweep_end),
             }
 
         return result, buffered_proposals
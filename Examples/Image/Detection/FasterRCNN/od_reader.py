@@ -4,21 +4,40 @@
 # for full license information.
 # ==============================================================================
 
+import hashlib
 import zipfile
 import cv2 # pip install opencv-python
 import numpy as np
 import os
 import pdb
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 
 DEBUG = False
 if DEBUG:
     import matplotlib.pyplot as mp
 
 
+# number of upcoming images (in reading order) that are loaded ahead per worker
+PREFETCH_IMAGES_PER_WORKER = 2
+
 class ObjectDetectionReader:
+    '''
+    Reads, scales and pads the images and ground truth annotations given in the map files.
+
+    If ``num_workers`` is larger than 0 the upcoming images (following the reading order)
+    are decoded, resized and padded in a pool of worker threads. The padded images can be
+    cached for later epochs, either in memory (``cache_size_mb``, least recently used images
+    are evicted) or in a memory mapped file (``cache_file``, all images). The file is reused by
+    later readers of the same images and padding, e.g. in the later stages of 4-stage training
+    or after a restart. Only the unflipped images are cached, flipped images are created from
+    the cached data.
+    '''
     def __init__(self, img_map_file, roi_map_file, max_annotations_per_image,
                  pad_width, pad_height, pad_value, randomize, use_flipping,
-                 max_images=None, buffered_rpn_proposals=None):
+                 max_images=None, buffered_rpn_proposals=None,
+                 num_workers=0, cache_size_mb=0, cache_file=None):
         self._pad_width = pad_width
         self._pad_height = pad_height
         self._pad_value = pad_value
@@ -34,7 +53,24 @@ class ObjectDetectionReader:
 
         self._reading_order = None
         self._reading_index = -1
-        
+
+        # open zip archives are shared across reads (and workers)
+        self._zip_archives = {}
+        self._zip_lock = threading.Lock()
+
+        img_shape = (3, self._pad_height, self._pad_width)
+        if cache_file is not None:
+            cache_key = hashlib.sha1(repr((self._img_file_paths, img_shape, pad_value)).encode('utf-8')).hexdigest()
+            self._image_cache = _MemmapImageCache(cache_file, self._num_images, img_shape, cache_key)
+        elif cache_size_mb > 0:
+            self._image_cache = _LRUImageCache(cache_size_mb * 1024 * 1024)
+        else:
+            self._image_cache = None
+
+        self._workers = ThreadPoolExecutor(num_workers) if num_workers > 0 else None
+        self._prefetch_size = num_workers * PREFETCH_IMAGES_PER_WORKER
+        self._pending_images = {}
+
     def get_next_input(self):
         '''
         Reads image data and return image, annotations and shape information
@@ -45,6 +81,7 @@ class ObjectDetectionReader:
         '''
 
         index = self._get_next_image_index()
+        self._prefetch_images()
         roi_data = self._get_gt_annotations(index)
         if DEBUG:
             img_data, img_dims, resized_with_pad = self._load_resize_and_pad_image(index)
@@ -58,6 +95,29 @@ class ObjectDetectionReader:
     def sweep_end(self):
         return self._reading_index >= self._num_images
 
+    def skip_images(self, num_images):
+        '''
+        Advances the reading position by num_images without loading them.
+        '''
+        for _ in range(num_images):
+            self._get_next_image_index()
+
+    def close(self):
+        '''
+        Stops the worker threads, closes the zip archives and releases the image cache.
+        '''
+        if self._workers is not None:
+            self._workers.shutdown()
+            self._workers = None
+        self._pending_images = {}
+        if self._image_cache is not None:
+            self._image_cache.close()
+            self._image_cache = None
+        with self._zip_lock:
+            for archive in self._zip_archives.values():
+                archive.close()
+            self._zip_archives = {}
+
     def _debug_plot(self, img_data, roi_data):
         color = (0, 255, 0)
         thickness = 2
@@ -132,8 +192,12 @@ class ObjectDetectionReader:
             at = str.find(image_path, '@')
             zip_file = image_path[:at]
             img_name = image_path[(at + 2):]
-            archive = zipfile.ZipFile(zip_file, 'r')
-            imgdata = archive.read(img_name)
+            with self._zip_lock:
+                archive = self._zip_archives.get(zip_file)
+                if archive is None:
+                    archive = zipfile.ZipFile(zip_file, 'r')
+                    self._zip_archives[zip_file] = archive
+                imgdata = archive.read(img_name)
             imgnp = np.array(bytearray(imgdata), dtype=np.uint8)
             img = cv2.imdecode(imgnp, 1)
         else:
@@ -141,8 +205,7 @@ class ObjectDetectionReader:
 
         return img
 
-    def _prepare_annotations_and_image_stats(self, index, img_width, img_height):
-        annotations = self._gt_annotations[index]
+    def _compute_image_stats(self, img_width, img_height):
         do_scale_w = img_width > img_height
         target_w = self._pad_width
         target_h = self._pad_height
@@ -159,6 +222,14 @@ class ObjectDetectionReader:
         bottom = self._pad_height - top - target_h
         right = self._pad_width - left - target_w
 
+        img_stats = [target_w, target_h, img_width, img_height, top, bottom, left, right]
+        return img_stats, scale_factor
+
+    def _prepare_annotations_and_image_stats(self, index, img_width, img_height):
+        annotations = self._gt_annotations[index]
+        img_stats, scale_factor = self._compute_image_stats(img_width, img_height)
+        target_w, target_h, img_width, img_height, top, bottom, left, right = img_stats
+
         xyxy = annotations[:, :4]
         xyxy *= scale_factor
         xyxy += (left, top, left, top)
@@ -171,7 +242,6 @@ class ObjectDetectionReader:
         annotations[:, 3] = np.round(annotations[:, 3])
 
         # keep image stats for scaling and padding images later
-        img_stats = [target_w, target_h, img_width, img_height, top, bottom, left, right]
         self._img_stats[index] = img_stats
 
     def _get_next_image_index(self):
@@ -181,29 +251,69 @@ class ObjectDetectionReader:
         self._reading_index += 1
         return next_image_index
 
-    def _load_resize_and_pad_image(self, index):
-        image_path = self._img_file_paths[index]
+    def _prefetch_images(self):
+        if self._workers is None:
+            return
 
-        img = self._read_image(image_path)
-        if self._img_stats[index] is None:
-            img_width = len(img[0])
-            img_height = len(img)
-            self._prepare_annotations_and_image_stats(index, img_width, img_height)
+        end = min(self._reading_index + self._prefetch_size, self._num_images)
+        for index in self._reading_order[self._reading_index:end]:
+            if index in self._pending_images or \
+                    (self._image_cache is not None and self._image_cache.contains(index)):
+                continue
+            self._pending_images[index] = self._workers.submit(self._decode_resize_and_pad_image, index)
 
-        target_w, target_h, img_width, img_height, top, bottom, left, right = self._img_stats[index]
+    def _decode_resize_and_pad_image(self, index):
+        '''
+        Returns the unflipped image in CHW format and its image stats. This is called
+        from the worker threads and hence does not modify the state of the reader.
+        '''
+        img = self._read_image(self._img_file_paths[index])
+        img_stats = self._img_stats[index]
+        if img_stats is None:
+            img_stats, _ = self._compute_image_stats(len(img[0]), len(img))
 
+        target_w, target_h, img_width, img_height, top, bottom, left, right = img_stats
         resized = cv2.resize(img, (target_w, target_h), 0, 0, interpolation=cv2.INTER_NEAREST)
         resized_with_pad = cv2.copyMakeBorder(resized, top, bottom, left, right, cv2.BORDER_CONSTANT,
                                               value=self._pad_value)
-        if self._flip_image:
-            resized_with_pad = cv2.flip(resized_with_pad, 1)
 
         # transpose(2,0,1) converts the image to the HWC format which CNTK accepts
         model_arg_rep = np.ascontiguousarray(np.array(resized_with_pad, dtype=np.float32).transpose(2, 0, 1))
+        return model_arg_rep, img_stats
+
+    def _get_unflipped_image(self, index):
+        if self._image_cache is not None:
+            cached = self._image_cache.get(index)
+            if cached is not None:
+                return cached
+
+        pending = self._pending_images.pop(index, None)
+        if pending is not None:
+            img_data, img_stats = pending.result()
+        else:
+            img_data, img_stats = self._decode_resize_and_pad_image(index)
+
+        if self._image_cache is not None:
+            img_data = self._image_cache.put(index, img_data, img_stats)
+        return img_data, img_stats
+
+    def _load_resize_and_pad_image(self, index):
+        img_data, img_stats = self._get_unflipped_image(index)
+        if self._img_stats[index] is None:
+            self._prepare_annotations_and_image_stats(index, img_stats[2], img_stats[3])
+
+        target_w, target_h, img_width, img_height, top, bottom, left, right = self._img_stats[index]
+
+        # flipping the width axis of the CHW data is the same as cv2.flip(resized_with_pad, 1)
+        if self._flip_image:
+            model_arg_rep = np.ascontiguousarray(img_data[:, :, ::-1])
+        else:
+            model_arg_rep = img_data
 
         # dims = pad_width, pad_height, scaled_image_width, scaled_image_height, orig_img_width, orig_img_height
         dims = (self._pad_width, self._pad_height, target_w, target_h, img_width, img_height)
         if DEBUG:
+            resized_with_pad = np.ascontiguousarray(model_arg_rep.transpose(1, 2, 0).astype(np.uint8))
             return model_arg_rep, dims, resized_with_pad
         return model_arg_rep, dims
 
@@ -228,3 +338,85 @@ class ObjectDetectionReader:
             return flipped_proposals
         return buffered_proposals
 
+class _LRUImageCache:
+    '''
+    Keeps the most recently used images as long as their total size is below max_bytes.
+    '''
+    def __init__(self, max_bytes):
+        self._max_bytes = max_bytes
+        self._num_bytes = 0
+        self._images = OrderedDict()
+
+    def contains(self, index):
+        return index in self._images
+
+    def get(self, index):
+        entry = self._images.get(index)
+        if entry is not None:
+            self._images.move_to_end(index)
+        return entry
+
+    def put(self, index, img_data, img_stats):
+        if img_data.nbytes > self._max_bytes:
+            return img_data
+        while self._num_bytes + img_data.nbytes > self._max_bytes:
+            _, (evicted, _) = self._images.popitem(last=False)
+            self._num_bytes -= evicted.nbytes
+
+        # cached images are shared between minibatches and must not be modified
+        img_data.setflags(write=False)
+        self._images[index] = (img_data, img_stats)
+        self._num_bytes += img_data.nbytes
+        return img_data
+
+    def close(self):
+        self._images.clear()
+        self._num_bytes = 0
+
+class _MemmapImageCache:
+    '''
+    Keeps all images in a memory mapped file of shape (num_images, 3, pad_height, pad_width),
+    their image stats in a second file (``<cache_file>.stats``) and ``key``, which identifies the
+    images and the padding, in a third file (``<cache_file>.key``). Existing files of the same
+    shape and key are reused, otherwise they are overwritten.
+    '''
+    def __init__(self, cache_file, num_images, img_shape, key):
+        stats_file = cache_file + ".stats"
+        key_file = cache_file + ".key"
+        shape = (num_images,) + img_shape
+        stats_shape = (num_images, 8)
+
+        reuse = os.path.exists(cache_file) and os.path.exists(stats_file) and os.path.exists(key_file) and \
+            os.path.getsize(cache_file) == int(np.prod(shape)) * np.dtype(np.float32).itemsize and \
+            os.path.getsize(stats_file) == int(np.prod(stats_shape)) * np.dtype(np.int64).itemsize
+        if reuse:
+            with open(key_file) as f:
+                reuse = f.read() == key
+        mode = 'r+' if reuse else 'w+'
+        self._images = np.memmap(cache_file, dtype=np.float32, mode=mode, shape=shape)
+        # the image stats of an image are written after its data, a row of -1 marks a missing image
+        self._img_stats = np.memmap(stats_file, dtype=np.int64, mode=mode, shape=stats_shape)
+        if not reuse:
+            self._img_stats[:] = -1
+            self._img_stats.flush()
+            with open(key_file, 'w') as f:
+                f.write(key)
+
+    def contains(self, index):
+        return self._img_stats[index, 0] >= 0
+
+    def get(self, index):
+        if not self.contains(index):
+            return None
+        img_data = self._images[index]
+        img_data.setflags(write=False)
+        return img_data, [int(v) for v in self._img_stats[index]]
+
+    def put(self, index, img_data, img_stats):
+        self._images[index] = img_data
+        self._img_stats[index] = img_stats
+        return img_data
+
+    def close(self):
+        self._images.flush()
+        self._img_stats.flush()
@@ -0,0 +1,67 @@
+# Copyright (c) Microsoft. All rights reserved.
+
+# Licensed under the MIT license. See LICENSE.md file in the project root
+# for full license information.
+# ==============================================================================
+
+import os
+import numpy as np
+
+def _read_key(key_path):
+    with open(key_path) as f:
+        return f.read()
+
+class ProposalStore:
+    '''
+    Stores the buffered rpn proposals of all training images in a memory mapped file
+    of shape (num_images, num_proposals, 4). Proposals are only read from the file when
+    they are accessed, such that memory use does not depend on the number of images.
+
+    Which images have been written is kept in a second file (``<file_path>.done``), and ``key``,
+    which identifies the model and settings the proposals are computed with, in a third file
+    (``<file_path>.key``). If ``resume`` is True an existing store of the same shape and key is
+    reopened, e.g. to complete it after a restart. Otherwise the store is overwritten.
+    '''
+    def __init__(self, file_path, num_images, num_proposals, resume=False, key=""):
+        self._done_path = file_path + ".done"
+        key_path = file_path + ".key"
+        shape = (num_images, num_proposals, 4)
+
+        reopen = resume and os.path.exists(file_path) and os.path.exists(self._done_path) and \
+            os.path.getsize(file_path) == int(np.prod(shape)) * np.dtype(np.float32).itemsize and \
+            os.path.getsize(self._done_path) == num_images and \
+            os.path.exists(key_path) and _read_key(key_path) == key
+        mode = 'r+' if reopen else 'w+'
+        self._proposals = np.memmap(file_path, dtype=np.float32, mode=mode, shape=shape)
+        self._done = np.memmap(self._done_path, dtype=np.bool_, mode=mode, shape=(num_images,))
+        if not reopen:
+            self._done.flush()
+            with open(key_path, 'w') as f:
+                f.write(key)
+
+    def __len__(self):
+        return len(self._proposals)
+
+    def __getitem__(self, index):
+        return np.array(self._proposals[index])
+
+    def num_done(self):
+        '''
+        Returns the number of leading images for which proposals have been written.
+        '''
+        not_done = np.flatnonzero(~self._done)
+        return len(self._done) if len(not_done) == 0 else int(not_done[0])
+
+    def is_complete(self):
+        return bool(self._done.all())
+
+    def write(self, start, proposals):
+        '''
+        Writes the proposals of shape (num_images, num_proposals, 4) for the images from ``start``
+        on. The images are only marked as written once the proposals are flushed to disk.
+        '''
+        end = start + len(proposals)
+        self._proposals[start:end] = proposals
+        self._proposals.flush()
+        self._done[start:end] = True
+        self._done.flush()
@@ -34,14 +34,140 @@ def evaluate_detections(all_boxes, all_gt_infos, classes, use_07_metric=False, a
         print ("Skipping non-maximum suppression")
         nms_dets = all_boxes
 
+    class_indices = [classIndex for classIndex, className in enumerate(classes) if className != '__background__']
+    results = _evaluate_detections_all_classes(class_indices, nms_dets, [all_gt_infos[classes[classIndex]] for classIndex in class_indices],
+                                               use_07_metric=use_07_metric)
     aps = {}
-    for classIndex, className in enumerate(classes):
-        if className != '__background__':
-            rec, prec, ap = _evaluate_detections(classIndex, nms_dets, all_gt_infos[className], use_07_metric=use_07_metric)
-            aps[className] = ap
+    for classIndex, (rec, prec, ap) in zip(class_indices, results):
+        aps[classes[classIndex]] = ap
 
     return aps
 
+def _evaluate_detections_all_classes(class_indices, all_boxes, gtInfosPerClass, overlapThreshold=0.5, use_07_metric=False):
+    '''
+    Vectorized version of _evaluate_detections() that evaluates all classes in one pass.
+    The detections of all classes are concatenated (per class in the order of decreasing confidence)
+    and matched against the ground truth boxes of their class and image using array operations.
+    The results are the same as calling _evaluate_detections() for each class.
+
+    Returns:
+        a list containing (rec, prec, ap) for each class in class_indices
+    '''
+    num_images = len(all_boxes[0])
+    num_classes = len(class_indices)
+
+    # parse detections, ordered by class and then by decreasing confidence
+    det_bboxes = []
+    det_groups = []
+    det_counts = np.zeros(num_classes, dtype=np.int64)
+    for i, classIndex in enumerate(class_indices):
+        dets_per_image = [(imgIndex, all_boxes[classIndex][imgIndex]) for imgIndex in range(num_images)
+                          if len(all_boxes[classIndex][imgIndex]) > 0]
+        if len(dets_per_image) == 0:
+            continue
+        dets = np.vstack([dets for _, dets in dets_per_image])
+        img_indices = np.concatenate([np.full(len(dets), imgIndex, dtype=np.int64) for imgIndex, dets in dets_per_image])
+        # same sorting as in _voc_computePrecisionRecallAp() to resolve ties identically
+        sorted_ind = np.argsort(-dets[:, -1])
+        # the VOCdevkit expects 1-based indices
+        det_bboxes.append((dets[sorted_ind, :4] + 1).astype(float))
+        det_groups.append(i * num_images + img_indices[sorted_ind])
+        det_counts[i] = len(dets)
+
+    # ground truth boxes, grouped by (class, image)
+    gt_bboxes = []
+    gt_difficult = []
+    gt_detected = []
+    gt_counts = np.zeros(num_classes * num_images, dtype=np.int64)
+    for i, gtInfos in enumerate(gtInfosPerClass):
+        for imgIndex, R in enumerate(gtInfos):
+            if np.size(R['bbox']) > 0:
+                gt_bboxes.append(np.asarray(R['bbox'], dtype=float)[:, :4])
+                gt_difficult.append(np.asarray(R['difficult'], dtype=bool))
+                gt_detected.append(np.asarray(R['det'], dtype=bool))
+                gt_counts[i * num_images + imgIndex] = len(gt_bboxes[-1])
+    gt_starts = np.cumsum(gt_counts) - gt_counts
+
+    num_dets = int(det_counts.sum())
+    tp = np.zeros(num_dets)
+    fp = np.ones(num_dets)
+    if num_dets > 0 and len(gt_bboxes) > 0:
+        det_bboxes = np.vstack(det_bboxes)
+        det_groups = np.concatenate(det_groups)
+        gt_bboxes = np.vstack(gt_bboxes)
+        gt_difficult = np.concatenate(gt_difficult)
+        gt_detected = np.concatenate(gt_detected)
+
+        # all pairs of a detection and a ground truth box of the same class and image
+        pair_counts = gt_counts[det_groups]
+        pair_starts = np.cumsum(pair_counts) - pair_counts
+        pair_dets = np.repeat(np.arange(num_dets), pair_counts)
+        pair_local = np.arange(len(pair_dets)) - pair_starts[pair_dets]
+        overlaps = _overlaps(det_bboxes[pair_dets], gt_bboxes[gt_starts[det_groups][pair_dets] + pair_local])
+
+        # max overlap and the first ground truth box with max overlap per detection
+        has_gt = pair_counts > 0
+        ovmax = np.full(num_dets, -np.inf)
+        ovmax[has_gt] = np.maximum.reduceat(overlaps, pair_starts[has_gt])
+        jmax = np.zeros(num_dets, dtype=np.int64)
+        first_max = np.where(overlaps == ovmax[pair_dets], pair_local, np.iinfo(np.int64).max)
+        jmax[has_gt] = np.minimum.reduceat(first_max, pair_starts[has_gt])
+
+        # the first detection (i.e. the one with the highest confidence) of a ground truth box is a true positive,
+        # all further detections of it are false positives. Detections of difficult ground truth boxes are ignored.
+        matched = np.where(ovmax > overlapThreshold)[0]
+        matched_gts = gt_starts[det_groups[matched]] + jmax[matched]
+        is_difficult = gt_difficult[matched_gts]
+        fp[matched[is_difficult]] = 0.
+        candidates = matched[~is_difficult]
+        candidate_gts = matched_gts[~is_difficult]
+        _, first = np.unique(candidate_gts, return_index=True)
+        first = first[~gt_detected[candidate_gts[first]]]
+        tp[candidates[first]] = 1.
+        fp[candidates[first]] = 0.
+
+        # mark the ground truth boxes as detected like _voc_computePrecisionRecallAp() does
+        gt_groups = np.repeat(np.arange(len(gt_counts)), gt_counts)
+        for gt_index in candidate_gts[first]:
+            group = gt_groups[gt_index]
+            gtInfosPerClass[group // num_images][group % num_images]['det'][gt_index - gt_starts[group]] = 1
+
+    # compute precision recall per class
+    results = []
+    det_starts = np.cumsum(det_counts) - det_counts
+    for i, gtInfos in enumerate(gtInfosPerClass):
+        if det_counts[i] == 0:
+            results.append((0.0, 0.0, 0.0))
+            continue
+        npos = sum([len(cr['bbox']) for cr in gtInfos])
+        cls_fp = np.cumsum(fp[det_starts[i]:det_starts[i] + det_counts[i]])
+        cls_tp = np.cumsum(tp[det_starts[i]:det_starts[i] + det_counts[i]])
+        rec = cls_tp / float(npos)
+        # avoid divide by zero in case the first detection matches a difficult ground truth
+        prec = cls_tp / np.maximum(cls_tp + cls_fp, np.finfo(np.float64).eps)
+        ap = computeAveragePrecision(rec, prec, use_07_metric)
+        results.append((rec, prec, ap))
+    return results
+
+def _overlaps(boxes, gt_boxes):
+    '''
+    Computes the overlaps of pairs of boxes in the same way as _voc_computePrecisionRecallAp().
+    '''
+    ixmin = np.maximum(gt_boxes[:, 0], boxes[:, 0])
+    iymin = np.maximum(gt_boxes[:, 1], boxes[:, 1])
+    ixmax = np.minimum(gt_boxes[:, 2], boxes[:, 2])
+    iymax = np.minimum(gt_boxes[:, 3], boxes[:, 3])
+    iw = np.maximum(ixmax - ixmin + 1., 0.)
+    ih = np.maximum(iymax - iymin + 1., 0.)
+    inters = iw * ih
+
+    # union
+    uni = ((boxes[:, 2] - boxes[:, 0] + 1.) * (boxes[:, 3] - boxes[:, 1] + 1.) +
+           (gt_boxes[:, 2] - gt_boxes[:, 0] + 1.) *
+           (gt_boxes[:, 3] - gt_boxes[:, 1] + 1.) - inters)
+
+    return inters / uni
+
 def _evaluate_detections(classIndex, all_boxes, gtInfos, overlapThreshold=0.5, use_07_metric=False):
     '''
     Top level function that does the PASCAL VOC evaluation.
@@ -55,7 +181,7 @@ def _evaluate_detections(classIndex, all_boxes, gtInfos, overlapThreshold=0.5, u
     detConfidences = []
     for imgIndex in range(num_images):
         dets = all_boxes[classIndex][imgIndex]
-        if dets != []:
+        if len(dets) > 0:
             for k in range(dets.shape[0]):
                 detImgIndices.append(imgIndex)
                 detConfidences.append(dets[k, -1])
@@ -94,8 +220,7 @@ def computeAveragePrecision(recalls, precisions, use_07_metric=False):
         mprecisions = np.concatenate(([0.], precisions, [0.]))
 
         # compute the precision envelope
-        for i in range(mprecisions.size - 1, 0, -1):
-            mprecisions[i - 1] = np.maximum(mprecisions[i - 1], mprecisions[i])
+        mprecisions = np.maximum.accumulate(mprecisions[::-1])[::-1]
 
         # to calculate area under PR curve, look for points
         # where X axis (recall) changes value
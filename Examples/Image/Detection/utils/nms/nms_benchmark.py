@@ -0,0 +1,51 @@
+# Copyright (c) Microsoft. All rights reserved.
+
+# Licensed under the MIT license. See LICENSE.md file in the project root
+# for full license information.
+# ==============================================================================
+
+# Compares the run time of the NumPy nms with the prebuilt Cython cpu_nms (if it can be
+# imported for the current interpreter) and the greedy Python nms on RPN-like proposals.
+# Usage: python nms_benchmark.py [num_boxes ...]
+
+from __future__ import print_function
+import os, sys, timeit
+abs_path = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(abs_path, "..", ".."))
+
+import numpy as np
+from utils.nms.numpy_nms import nms as numpy_nms, nms_greedy
+try:
+    from utils.cython_modules.cpu_nms import cpu_nms
+except ImportError:
+    cpu_nms = None
+
+# the pre-NMS top N proposals used in testing and training (see utils/default_config.py)
+DEFAULT_NUM_BOXES = [6000, 12000]
+NMS_THRESH = 0.7
+NUM_REPEATS = 5
+
+def rpn_like_proposals(num_boxes, seed=0):
+    rng = np.random.RandomState(seed)
+    xy = rng.random_sample((num_boxes, 2)) * 900
+    wh = rng.random_sample((num_boxes, 2)) * 300 + 8
+    scores = rng.random_sample((num_boxes, 1))
+    return np.hstack((xy, xy + wh, scores)).astype(np.float32)
+
+def benchmark(num_boxes):
+    dets = rpn_like_proposals(num_boxes)
+    implementations = [("numpy", numpy_nms), ("greedy", nms_greedy)]
+    if cpu_nms is not None:
+        implementations.append(("cython", cpu_nms))
+
+    expected = numpy_nms(dets, NMS_THRESH)
+    print("{} boxes, {} kept:".format(num_boxes, len(expected)))
+    for name, impl in implementations:
+        keep = list(map(int, impl(dets, NMS_THRESH)))
+        seconds = min(timeit.repeat(lambda: impl(dets, NMS_THRESH), number=1, repeat=NUM_REPEATS))
+        # cpu_nms discards boxes with an overlap of exactly NMS_THRESH, which does not occur for random boxes
+        print("  {:8} {:8.1f} ms  {}".format(name, seconds * 1000, "same result" if keep == expected else "DIFFERENT RESULT"))
+
+if __name__ == '__main__':
+    for num_boxes in [int(n) for n in sys.argv[1:]] or DEFAULT_NUM_BOXES:
+        benchmark(num_boxes)
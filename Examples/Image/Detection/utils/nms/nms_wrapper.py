@@ -5,7 +5,7 @@
 # ==============================================================================
 
 import numpy as np
-from utils.cython_modules.cpu_nms import cpu_nms
+from utils.nms.numpy_nms import nms as numpy_nms, nms_per_group as numpy_nms_per_group
 try:
     from utils.cython_modules.gpu_nms import gpu_nms
     gpu_nms_available = True
@@ -21,14 +21,55 @@ import pdb
 
 def nms(dets, thresh, force_cpu=False):
     '''
-    Dispatches the call to either CPU or GPU NMS implementations
+    Dispatches the call to either the CPU (NumPy) or GPU NMS implementations
     '''
     if dets.shape[0] == 0:
         return []
-    if gpu_nms_available and cfg.USE_GPU_NMS and not force_cpu:
+    if _use_gpu_nms(force_cpu):
         return gpu_nms(dets, thresh, device_id=cfg.GPU_ID)
     else:
-        return cpu_nms(dets, thresh)
+        return numpy_nms(dets, thresh)
+
+def _use_gpu_nms(force_cpu=False):
+    return gpu_nms_available and cfg.USE_GPU_NMS and not force_cpu
+
+def nms_per_image(dets_per_image, thresh, force_cpu=False):
+    '''
+    Applies nms independently to the detections of several images.
+
+    On the GPU all images are processed in a single call: the boxes of each
+    image are shifted by a per-image offset that is larger than the extent of
+    all boxes, such that boxes of different images never overlap. On the CPU
+    the images are processed one after another, which avoids comparing boxes
+    of different images.
+
+    Args:
+        dets_per_image: list of arrays of shape (n_i, 5), i.e. (x1, y1, x2, y2, score) per box
+        thresh:         the threshold for discarding overlapping boxes
+        force_cpu:      if True the CPU implementation is used
+
+    Returns:
+        a list containing the indices of the boxes to keep for each image
+    '''
+    if not _use_gpu_nms(force_cpu) or len(dets_per_image) < 2:
+        return [nms(dets, thresh, force_cpu) for dets in dets_per_image]
+
+    counts = np.array([dets.shape[0] for dets in dets_per_image])
+    if counts.sum() == 0:
+        return [[] for _ in dets_per_image]
+
+    all_dets = np.vstack(dets_per_image).astype(np.float32)
+    coords = all_dets[:, :4]
+    offset = coords.max() - coords.min() + 2
+    image_ids = np.repeat(np.arange(len(dets_per_image)), counts)
+    coords += (image_ids * offset)[:, np.newaxis].astype(np.float32)
+
+    keep = np.asarray(nms(all_dets, thresh), dtype=np.int64)
+
+    # keep is ordered by score, which preserves the per-image ordering
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    keep_ids = image_ids[keep]
+    return [list(keep[keep_ids == i] - starts[i]) for i in range(len(dets_per_image))]
 
 def apply_nms_to_single_image_results(coords, labels, scores, nms_threshold=0.5, conf_threshold=0.0):
     '''
@@ -67,7 +108,8 @@ def apply_nms_to_single_image_results(coords, labels, scores, nms_threshold=0.5,
 
 def apply_nms_to_test_set_results(all_boxes, nms_threshold, conf_threshold):
     '''
-    Applies nms to the results of multiple images.
+    Applies nms to the results of multiple images. On the CPU the results of all
+    classes of an image are processed in a single call (see numpy_nms.nms_per_group()).
 
     Args:
         all_boxes:      shape of all_boxes: e.g. 21 classes x 4952 images x 58 rois x 5 coords+score
@@ -85,12 +127,16 @@ def apply_nms_to_test_set_results(all_boxes, nms_threshold, conf_threshold):
                  for _ in range(num_classes)]
     nms_keepIndices = [[[] for _ in range(num_images)]
                  for _ in range(num_classes)]
-    for cls_ind in range(num_classes):
-        for im_ind in range(num_images):
+    for im_ind in range(num_images):
+        cls_inds = [cls_ind for cls_ind in range(num_classes) if len(all_boxes[cls_ind][im_ind]) > 0]
+        dets_per_class = [all_boxes[cls_ind][im_ind].astype(np.float32) for cls_ind in cls_inds]
+        if _use_gpu_nms():
+            keep_per_class = [nms(dets, nms_threshold) for dets in dets_per_class]
+        else:
+            keep_per_class = numpy_nms_per_group(dets_per_class, nms_threshold)
+
+        for cls_ind, keep in zip(cls_inds, keep_per_class):
             dets = all_boxes[cls_ind][im_ind]
-            if dets == []:
-                continue
-            keep = nms(dets.astype(np.float32), nms_threshold)
 
             # also filter out low confidences
             if conf_threshold > 0:
@@ -0,0 +1,184 @@
+# Copyright (c) Microsoft. All rights reserved.
+
+# Licensed under the MIT license. See LICENSE.md file in the project root
+# for full license information.
+# ==============================================================================
+
+import numpy as np
+
+# number of boxes for which the overlaps are computed at once
+DEFAULT_BLOCK_SIZE = 64
+
+def nms(dets, thresh, block_size=DEFAULT_BLOCK_SIZE):
+    '''
+    Greedy non-maximum suppression implemented with NumPy only, i.e. without the
+    prebuilt Cython modules. The result is the same as for the greedy algorithm.
+
+    The boxes are sorted by score and processed in blocks of block_size boxes.
+    For each block the overlaps of its remaining (i.e. not yet suppressed)
+    boxes with all remaining boxes of lower score are computed at once into a
+    suppression mask. The kept boxes of the block are determined greedily on
+    the part of the mask that is within the block, and the rows of the kept
+    boxes then suppress the boxes of all following blocks in one step.
+
+    Args:
+        dets:       array of shape (n, 5), i.e. (x1, y1, x2, y2, score) per box
+        thresh:     boxes that overlap (IoU) a box with higher score by more than thresh are discarded
+        block_size: number of boxes that are processed at once
+
+    Returns:
+        the indices of the boxes to keep, ordered by decreasing score
+    '''
+    num_boxes = dets.shape[0]
+    if num_boxes == 0:
+        return []
+
+    order = dets[:, 4].argsort()[::-1]
+    x1 = dets[order, 0]
+    y1 = dets[order, 1]
+    x2 = dets[order, 2]
+    y2 = dets[order, 3]
+    areas = (x2 - x1 + 1) * (y2 - y1 + 1)
+
+    # in score order
+    suppressed = np.zeros(num_boxes, dtype=np.bool_)
+    keep = []
+    for start in range(0, num_boxes, block_size):
+        end = min(start + block_size, num_boxes)
+
+        remaining = np.flatnonzero(~suppressed[start:]) + start
+        num_candidates = np.searchsorted(remaining, end)
+        if num_candidates == 0:
+            continue
+        candidates = remaining[:num_candidates]
+
+        mask = _overlap_mask(x1, y1, x2, y2, areas, candidates, remaining, thresh)
+
+        # greedily resolve the candidates of this block in score order
+        block_mask = mask[:, :num_candidates]
+        alive = np.ones(num_candidates, dtype=np.bool_)
+        block_keep = []
+        for row in range(num_candidates):
+            if alive[row]:
+                block_keep.append(row)
+                alive[row + 1:] &= ~block_mask[row, row + 1:]
+
+        keep.extend(candidates[block_keep])
+        suppressed[remaining[mask[block_keep].any(axis=0)]] = True
+
+    return order[keep].tolist()
+
+def nms_batched(dets, groups, thresh, block_size=DEFAULT_BLOCK_SIZE):
+    '''
+    Applies nms independently to several groups of boxes (e.g. the boxes of
+    different classes or images) in a single call. The coordinates of each
+    group are shifted by an offset that is larger than the extent of all
+    boxes, such that boxes of different groups never overlap. The shifted
+    coordinates are computed in double precision to keep them exact.
+
+    Args:
+        dets:       array of shape (n, 5), i.e. (x1, y1, x2, y2, score) per box
+        groups:     array of shape (n,) with an integer group index per box
+        thresh:     the threshold for discarding overlapping boxes
+        block_size: number of boxes that are processed at once
+
+    Returns:
+        the indices of the boxes to keep, ordered by decreasing score
+    '''
+    if dets.shape[0] == 0:
+        return []
+
+    shifted_dets = np.array(dets, dtype=np.float64)
+    coords = shifted_dets[:, :4]
+    offset = coords.max() - coords.min() + 2
+    coords += (np.asarray(groups, dtype=np.float64) * offset)[:, np.newaxis]
+
+    return nms(shifted_dets, thresh, block_size)
+
+def nms_per_group(dets_per_group, thresh, block_size=DEFAULT_BLOCK_SIZE):
+    '''
+    Applies nms independently to each array in dets_per_group using a single call
+    of nms_batched().
+
+    Args:
+        dets_per_group: list of arrays of shape (n_i, 5), i.e. (x1, y1, x2, y2, score) per box
+        thresh:         the threshold for discarding overlapping boxes
+        block_size:     number of boxes that are processed at once
+
+    Returns:
+        a list containing the indices of the boxes to keep for each group, ordered by decreasing score
+    '''
+    counts = np.array([len(dets) for dets in dets_per_group], dtype=np.int64)
+    if counts.sum() == 0:
+        return [[] for _ in dets_per_group]
+
+    all_dets = np.vstack([np.asarray(dets).reshape((-1, 5)) for dets in dets_per_group])
+    groups = np.repeat(np.arange(len(dets_per_group)), counts)
+    keep = np.asarray(nms_batched(all_dets, groups, thresh, block_size), dtype=np.int64)
+
+    # keep is ordered by score, which preserves the order within each group
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    keep_groups = groups[keep]
+    return [list(keep[keep_groups == g] - starts[g]) for g in range(len(dets_per_group))]
+
+def nms_greedy(dets, thresh):
+    '''
+    The original greedy nms of Fast R-CNN, which processes one box per iteration.
+    Used as a reference for nms().
+    '''
+    x1 = dets[:, 0]
+    y1 = dets[:, 1]
+    x2 = dets[:, 2]
+    y2 = dets[:, 3]
+    scores = dets[:, 4]
+
+    areas = (x2 - x1 + 1) * (y2 - y1 + 1)
+    order = scores.argsort()[::-1]
+
+    keep = []
+    while order.size > 0:
+        i = order[0]
+        keep.append(i)
+        xx1 = np.maximum(x1[i], x1[order[1:]])
+        yy1 = np.maximum(y1[i], y1[order[1:]])
+        xx2 = np.minimum(x2[i], x2[order[1:]])
+        yy2 = np.minimum(y2[i], y2[order[1:]])
+
+        w = np.maximum(0.0, xx2 - xx1 + 1)
+        h = np.maximum(0.0, yy2 - yy1 + 1)
+        inter = w * h
+        ovr = inter / (areas[i] + areas[order[1:]] - inter)
+
+        inds = np.where(ovr <= thresh)[0]
+        order = order[inds + 1]
+
+    return keep
+
+def _overlap_mask(x1, y1, x2, y2, areas, rows, cols, thresh):
+    '''
+    Returns whether the overlaps (IoU) of the boxes rows x cols exceed thresh.
+    Computes the same as the greedy algorithm, but in place in three buffers.
+    '''
+    r = rows[:, np.newaxis]
+
+    # w = max(0, min(x2) - max(x1) + 1)
+    w = np.minimum(x2[r], x2[cols])
+    buf = np.maximum(x1[r], x1[cols])
+    w -= buf
+    w += 1
+    np.maximum(w, 0.0, out=w)
+
+    # h = max(0, min(y2) - max(y1) + 1)
+    h = np.minimum(y2[r], y2[cols])
+    np.maximum(y1[r], y1[cols], out=buf)
+    h -= buf
+    h += 1
+    np.maximum(h, 0.0, out=h)
+
+    # inter / (area_row + area_col - inter)
+    inter = w
+    inter *= h
+    union = np.add(areas[r], areas[cols], out=buf)
+    union -= inter
+    ovr = np.divide(inter, union, out=inter)
+    return ovr > thresh
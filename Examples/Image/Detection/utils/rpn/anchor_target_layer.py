@@ -10,7 +10,7 @@ from cntk.ops.functions import UserFunction
 import yaml
 import numpy as np
 import numpy.random as npr
-from utils.rpn.generate_anchors import generate_anchors
+from utils.rpn.generate_anchors import generate_anchors, get_anchor_grid
 from utils.rpn.bbox_transform import bbox_transform
 from utils.cython_modules.cython_bbox import bbox_overlaps
 
@@ -24,7 +24,8 @@ DEBUG = False
 class AnchorTargetLayer(UserFunction):
     '''
     Assign anchors to ground-truth targets. Produces anchor classification
-    labels and bounding-box regression targets.
+    labels and bounding-box regression targets. Minibatches of several images
+    are supported, the targets are computed for each image independently.
     '''
 
     def __init__(self, arg1, arg2, arg3, name='AnchorTargetLayer', param_str=None, cfm_shape=None, deterministic=False):
@@ -34,6 +35,7 @@ class AnchorTargetLayer(UserFunction):
         # parse the layer parameter string, which must be valid YAML
         layer_params = yaml.load(self.param_str_)
         anchor_scales = layer_params.get('scales', (8, 16, 32))
+        self._anchor_scales = anchor_scales
         self._anchors = generate_anchors(scales=np.array(anchor_scales))
         self._num_anchors = self._anchors.shape[0]
         self._feat_stride = layer_params['feat_stride']
@@ -93,13 +95,49 @@ class AnchorTargetLayer(UserFunction):
         # measure GT overlap
 
         bottom = arguments
+        num_images = bottom[0].shape[0]
 
         # map of shape (..., H, W)
         height, width = bottom[0].shape[-2:]
-        # GT boxes (x1, y1, x2, y2, label)
-        gt_boxes = bottom[1][0,:]
-        # im_info
-        im_info = bottom[2][0]
+        # GT boxes (x1, y1, x2, y2, label) per image
+        all_gt_boxes = bottom[1]
+        # im_info, one row per image
+        all_im_info = bottom[2].reshape((num_images, 6))
+
+        # 1. Generate proposals from bbox deltas and shifted anchors
+        # (the same for all images and usually for all minibatches)
+        anchor_grid = get_anchor_grid(height, width, self._feat_stride, self._anchor_scales)
+
+        A = self._num_anchors
+        labels = np.empty((num_images, height * width * A), dtype=np.float32)
+        bbox_targets = np.empty((num_images, height * width * A, 4), dtype=np.float32)
+        bbox_inside_weights = np.empty((num_images, height * width * A, 4), dtype=np.float32)
+        for i in range(num_images):
+            labels[i], bbox_targets[i], bbox_inside_weights[i] = \
+                self._compute_image_targets(anchor_grid, all_gt_boxes[i], all_im_info[i], height, width)
+
+        # labels
+        labels = labels.reshape((num_images, height, width, A)).transpose(0, 3, 1, 2)
+        outputs[self.outputs[0]] = np.ascontiguousarray(labels)
+
+        # bbox_targets
+        bbox_targets = bbox_targets.reshape((num_images, height, width, A * 4)).transpose(0, 3, 1, 2)
+        outputs[self.outputs[1]] = np.ascontiguousarray(bbox_targets)
+
+        # bbox_inside_weights
+        bbox_inside_weights = bbox_inside_weights \
+            .reshape((num_images, height, width, A * 4)).transpose(0, 3, 1, 2)
+        assert bbox_inside_weights.shape[2] == height
+        assert bbox_inside_weights.shape[3] == width
+        outputs[self.outputs[2]] = np.ascontiguousarray(bbox_inside_weights)
+
+        # No state needs to be passed to backward() so we just pass None
+        return None
+
+    def _compute_image_targets(self, anchor_grid, gt_boxes, im_info, height, width):
+        '''
+        Computes the labels, bbox targets and bbox inside weights of all anchors for a single image.
+        '''
 
         # remove zero padded ground truth boxes
         keep = np.where(
@@ -119,36 +157,11 @@ class AnchorTargetLayer(UserFunction):
             print ('rpn: gt_boxes.shape', gt_boxes.shape)
             #print ('rpn: gt_boxes', gt_boxes)
 
-        # 1. Generate proposals from bbox deltas and shifted anchors
-        shift_x = np.arange(0, width) * self._feat_stride
-        shift_y = np.arange(0, height) * self._feat_stride
-        shift_x, shift_y = np.meshgrid(shift_x, shift_y)
-        shifts = np.vstack((shift_x.ravel(), shift_y.ravel(),
-                            shift_x.ravel(), shift_y.ravel())).transpose()
-        # add A anchors (1, A, 4) to
-        # cell K shifts (K, 1, 4) to get
-        # shift anchors (K, A, 4)
-        # reshape to (K*A, 4) shifted anchors
-        A = self._num_anchors
-        K = shifts.shape[0]
-        all_anchors = (self._anchors.reshape((1, A, 4)) +
-                       shifts.reshape((1, K, 4)).transpose((1, 0, 2)))
-        all_anchors = all_anchors.reshape((K * A, 4))
-        total_anchors = int(K * A)
+        all_anchors = anchor_grid.anchors
+        total_anchors = all_anchors.shape[0]
 
         # only keep anchors inside the image
-        padded_wh = im_info[0:2]
-        scaled_wh = im_info[2:4]
-        xy_offset = (padded_wh - scaled_wh) / 2
-        xy_min = xy_offset
-        xy_max = xy_offset + scaled_wh
-
-        inds_inside = np.where(
-            (all_anchors[:, 0] >= xy_min[0] - self._allowed_border) &
-            (all_anchors[:, 1] >= xy_min[1] - self._allowed_border) &
-            (all_anchors[:, 2] < xy_max[0] + self._allowed_border) &  # width
-            (all_anchors[:, 3] < xy_max[1] + self._allowed_border)    # height
-        )[0]
+        inds_inside = anchor_grid.inds_inside(im_info, self._allowed_border)
 
         if DEBUG:
             print ('total_anchors', total_anchors)
@@ -210,7 +223,6 @@ class AnchorTargetLayer(UserFunction):
                 disable_inds = npr.choice(bg_inds, size=(len(bg_inds) - num_bg), replace=False)
             labels[disable_inds] = -1
 
-        bbox_targets = np.zeros((len(inds_inside), 4), dtype=np.float32)
         bbox_targets = _compute_targets(anchors, gt_boxes[argmax_overlaps, :])
 
         bbox_inside_weights = np.zeros((len(inds_inside), 4), dtype=np.float32)
@@ -242,23 +254,7 @@ class AnchorTargetLayer(UserFunction):
             print ('rpn: num_positive avg', self._fg_sum / self._count)
             print ('rpn: num_negative avg', self._bg_sum / self._count)
 
-        # labels
-        labels = labels.reshape((1, height, width, A)).transpose(0, 3, 1, 2)
-        outputs[self.outputs[0]] = np.ascontiguousarray(labels)
-
-        # bbox_targets
-        bbox_targets = bbox_targets.reshape((1, height, width, A * 4)).transpose(0, 3, 1, 2)
-        outputs[self.outputs[1]] = np.ascontiguousarray(bbox_targets)
-
-        # bbox_inside_weights
-        bbox_inside_weights = bbox_inside_weights \
-            .reshape((1, height, width, A * 4)).transpose(0, 3, 1, 2)
-        assert bbox_inside_weights.shape[2] == height
-        assert bbox_inside_weights.shape[3] == width
-        outputs[self.outputs[2]] = np.ascontiguousarray(bbox_inside_weights)
-
-        # No state needs to be passed to backward() so we just pass None
-        return None
+        return labels, bbox_targets, bbox_inside_weights
 
     def backward(self, state, root_gradients, variables):
         """This layer does not propagate gradients."""
@@ -50,10 +50,16 @@ def bbox_transform_inv(boxes, deltas):
     ctr_x = boxes[:, 0] + 0.5 * widths
     ctr_y = boxes[:, 1] + 0.5 * heights
 
-    dx = deltas[:, 0::4]
-    dy = deltas[:, 1::4]
-    dw = deltas[:, 2::4]
-    dh = deltas[:, 3::4]
+    return bbox_transform_inv_whctrs(widths, heights, ctr_x, ctr_y, deltas)
+
+# same as bbox_transform_inv() for boxes given as
+# - widths, heights, ctr_x, ctr_y of shape (n,), e.g. from AnchorGrid.whctrs()
+# - deltas (..., n, 4) as [dx, dy, dw, dh], e.g. for several images at once
+def bbox_transform_inv_whctrs(widths, heights, ctr_x, ctr_y, deltas):
+    dx = deltas[..., 0::4]
+    dy = deltas[..., 1::4]
+    dw = deltas[..., 2::4]
+    dh = deltas[..., 3::4]
 
     pred_ctr_x = dx * widths[:, np.newaxis] + ctr_x[:, np.newaxis]
     pred_ctr_y = dy * heights[:, np.newaxis] + ctr_y[:, np.newaxis]
@@ -62,13 +68,13 @@ def bbox_transform_inv(boxes, deltas):
 
     pred_boxes = np.zeros(deltas.shape, dtype=deltas.dtype)
     # x1
-    pred_boxes[:, 0::4] = pred_ctr_x - 0.5 * pred_w
+    pred_boxes[..., 0::4] = pred_ctr_x - 0.5 * pred_w
     # y1
-    pred_boxes[:, 1::4] = pred_ctr_y - 0.5 * pred_h
+    pred_boxes[..., 1::4] = pred_ctr_y - 0.5 * pred_h
     # x2
-    pred_boxes[:, 2::4] = pred_ctr_x + 0.5 * pred_w
+    pred_boxes[..., 2::4] = pred_ctr_x + 0.5 * pred_w
     # y2
-    pred_boxes[:, 3::4] = pred_ctr_y + 0.5 * pred_h
+    pred_boxes[..., 3::4] = pred_ctr_y + 0.5 * pred_h
 
     return pred_boxes
 
@@ -96,3 +102,23 @@ def clip_boxes(boxes, im_info):
     # y_min <= y2 <= y_max
     boxes[:, 3::4] = np.maximum(np.minimum(boxes[:, 3::4], xy_max[1] - 1), xy_min[1])
     return boxes
+
+def clip_boxes_per_image(boxes, im_info):
+    '''
+    Clip the boxes of a batch of images to the respective image boundaries.
+    :param boxes: boxes of shape (num_images, num_boxes, 4)
+    :param im_info: (num_images, 6) array with one row per image as described in clip_boxes()
+    '''
+
+    im_info = im_info.reshape((-1, 6))
+    padded_wh = im_info[:, 0:2]
+    scaled_wh = im_info[:, 2:4]
+    xy_offset = (padded_wh - scaled_wh) / 2
+    xy_min = xy_offset[:, np.newaxis, :]
+    xy_max = (xy_offset + scaled_wh)[:, np.newaxis, :]
+
+    # x_min <= x1, x2 <= x_max
+    boxes[:, :, 0::2] = np.maximum(np.minimum(boxes[:, :, 0::2], xy_max[:, :, 0:1] - 1), xy_min[:, :, 0:1])
+    # y_min <= y1, y2 <= y_max
+    boxes[:, :, 1::2] = np.maximum(np.minimum(boxes[:, :, 1::2], xy_max[:, :, 1:2] - 1), xy_min[:, :, 1:2])
+    return boxes
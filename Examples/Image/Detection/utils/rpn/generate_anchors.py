@@ -5,6 +5,11 @@
 # ==============================================================================
 
 import numpy as np
+from collections import OrderedDict
+
+# maximum number of feature map sizes and image regions (per feature map size) that are cached
+ANCHOR_GRID_CACHE_SIZE = 8
+_anchor_grid_cache = OrderedDict()
 
 def generate_anchors(base_size=16, ratios=[0.5, 1, 2],
                      scales=2**np.arange(3, 6)):
@@ -19,6 +24,103 @@ def generate_anchors(base_size=16, ratios=[0.5, 1, 2],
                          for i in range(ratio_anchors.shape[0])]) # was xrange
     return anchors
 
+def generate_shifted_anchors(anchors, height, width, feat_stride):
+    """
+    Enumerate all shifted anchors for a (height, width) feature map, i.e.
+    add the A anchors (1, A, 4) to the K cell shifts (K, 1, 4) to get the
+    shifted anchors (K, A, 4), reshaped to (K*A, 4). Rows are ordered by
+    (h, w, a) in slowest to fastest order.
+    """
+
+    shift_x = np.arange(0, width) * feat_stride
+    shift_y = np.arange(0, height) * feat_stride
+    shift_x, shift_y = np.meshgrid(shift_x, shift_y)
+    shifts = np.vstack((shift_x.ravel(), shift_y.ravel(),
+                        shift_x.ravel(), shift_y.ravel())).transpose()
+
+    A = anchors.shape[0]
+    K = shifts.shape[0]
+    all_anchors = anchors.reshape((1, A, 4)) + \
+                  shifts.reshape((1, K, 4)).transpose((1, 0, 2))
+    return all_anchors.reshape((K * A, 4))
+
+class AnchorGrid:
+    """
+    The shifted anchors for a feature map of a fixed size together with
+    quantities derived from them, which are computed once and then reused
+    by all images with the same feature map size (see get_anchor_grid()).
+    """
+
+    def __init__(self, height, width, feat_stride, scales, ratios):
+        base_anchors = generate_anchors(ratios=np.array(ratios), scales=np.array(scales))
+        self.num_anchors = base_anchors.shape[0]
+        self.anchors = generate_shifted_anchors(base_anchors, height, width, feat_stride)
+        self.anchors.setflags(write=False)
+        self._whctrs = {}
+        self._inds_inside = OrderedDict()
+
+    def whctrs(self, dtype):
+        """
+        Widths, heights, x centers and y centers of the anchors as used by
+        bbox_transform_inv(), converted to dtype.
+        """
+        dtype = np.dtype(dtype)
+        if dtype not in self._whctrs:
+            anchors = self.anchors.astype(dtype, copy=False)
+            widths = anchors[:, 2] - anchors[:, 0] + 1.0
+            heights = anchors[:, 3] - anchors[:, 1] + 1.0
+            ctr_x = anchors[:, 0] + 0.5 * widths
+            ctr_y = anchors[:, 1] + 0.5 * heights
+            for a in (widths, heights, ctr_x, ctr_y):
+                a.setflags(write=False)
+            self._whctrs[dtype] = (widths, heights, ctr_x, ctr_y)
+        return self._whctrs[dtype]
+
+    def inds_inside(self, im_info, allowed_border=0):
+        """
+        Indices of the anchors that lie inside the scaled image area.
+        :param im_info: (pad_width, pad_height, scaled_image_width, scaled_image_height, orig_img_width, orig_img_height)
+        """
+        key = (tuple(im_info[0:4].tolist()), im_info.dtype, allowed_border)
+        inds = self._inds_inside.pop(key, None)
+        if inds is None:
+            padded_wh = im_info[0:2]
+            scaled_wh = im_info[2:4]
+            xy_offset = (padded_wh - scaled_wh) / 2
+            xy_min = xy_offset
+            xy_max = xy_offset + scaled_wh
+
+            all_anchors = self.anchors
+            inds = np.where(
+                (all_anchors[:, 0] >= xy_min[0] - allowed_border) &
+                (all_anchors[:, 1] >= xy_min[1] - allowed_border) &
+                (all_anchors[:, 2] < xy_max[0] + allowed_border) &  # width
+                (all_anchors[:, 3] < xy_max[1] + allowed_border)    # height
+            )[0]
+            inds.setflags(write=False)
+
+        self._inds_inside[key] = inds
+        if len(self._inds_inside) > ANCHOR_GRID_CACHE_SIZE:
+            self._inds_inside.popitem(last=False)
+        return inds
+
+def get_anchor_grid(height, width, feat_stride, scales, ratios=(0.5, 1, 2)):
+    """
+    Returns the (cached) AnchorGrid for a (height, width) feature map. Since all
+    images are padded to the same size the grid usually never changes during a run.
+    The cache holds the ANCHOR_GRID_CACHE_SIZE most recently used grids.
+    """
+
+    key = (int(height), int(width), feat_stride, tuple(scales), tuple(ratios))
+    grid = _anchor_grid_cache.pop(key, None)
+    if grid is None:
+        grid = AnchorGrid(height, width, feat_stride, scales, ratios)
+
+    _anchor_grid_cache[key] = grid
+    if len(_anchor_grid_cache) > ANCHOR_GRID_CACHE_SIZE:
+        _anchor_grid_cache.popitem(last=False)
+    return grid
+
 def _whctrs(anchor):
     """
     Return width, height, x center, and y center for an anchor (window).
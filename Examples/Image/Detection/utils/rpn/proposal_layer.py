@@ -8,9 +8,9 @@ from cntk import output_variable, FreeDimension
 from cntk.ops.functions import UserFunction
 import numpy as np
 import yaml
-from utils.rpn.generate_anchors import generate_anchors
-from utils.rpn.bbox_transform import bbox_transform_inv, clip_boxes
-from utils.nms.nms_wrapper import nms
+from utils.rpn.generate_anchors import generate_anchors, get_anchor_grid
+from utils.rpn.bbox_transform import bbox_transform_inv_whctrs, clip_boxes_per_image
+from utils.nms.nms_wrapper import nms_per_image
 
 try:
     from config import cfg
@@ -23,6 +23,8 @@ class ProposalLayer(UserFunction):
     '''
     Outputs object detection proposals by applying estimated bounding-box
     transformations to a set of regular boxes (called "anchors").
+    Minibatches of several images are supported, the proposals are computed
+    for each image independently.
     '''
 
     def __init__(self, arg1, arg2, arg3, name='ProposalLayer', param_str=None):
@@ -32,6 +34,7 @@ class ProposalLayer(UserFunction):
         layer_params = yaml.load(self.param_str_)
         self._feat_stride = layer_params['feat_stride']
         anchor_scales = layer_params.get('scales', (8, 16, 32))
+        self._anchor_scales = anchor_scales
         self._anchors = generate_anchors(scales=np.array(anchor_scales))
         self._num_anchors = self._anchors.shape[0]
 
@@ -57,7 +60,7 @@ class ProposalLayer(UserFunction):
     def forward(self, arguments, device=None, outputs_to_retain=None):
         # Algorithm:
         #
-        # for each (H, W) location i
+        # for each image n and (H, W) location i
         #   generate A anchor boxes centered on cell i
         #   apply predicted bbox deltas at cell i to each of the A anchors
         # clip predicted boxes to image
@@ -82,21 +85,22 @@ class ProposalLayer(UserFunction):
             min_size = cfg["TRAIN"].RPN_MIN_SIZE
 
         bottom = arguments
-        assert bottom[0].shape[0] == 1, \
-            'Only single item batches are supported'
+        num_images = bottom[0].shape[0]
 
         # the first set of _num_anchors channels are bg probs
         # the second set are the fg probs, which we want
         scores = bottom[0][:, self._num_anchors:, :, :]
         bbox_deltas = bottom[1]
-        im_info = bottom[2][0]
+        # one row per image
+        im_info = bottom[2].reshape((num_images, 6))
 
         if DEBUG:
             # im_info = (pad_width, pad_height, scaled_image_width, scaled_image_height, orig_img_width, orig_img_height)
             # e.g.(1000, 1000, 1000, 600, 500, 300) for an original image of 600x300 that is scaled and padded to 1000x1000
-            print ('im_size: ({}, {})'.format(im_info[0], im_info[1]))
-            print ('scaled im_size: ({}, {})'.format(im_info[2], im_info[3]))
-            print ('original im_size: ({}, {})'.format(im_info[4], im_info[5]))
+            for info in im_info:
+                print ('im_size: ({}, {})'.format(info[0], info[1]))
+                print ('scaled im_size: ({}, {})'.format(info[2], info[3]))
+                print ('original im_size: ({}, {})'.format(info[4], info[5]))
 
         # 1. Generate proposals from bbox deltas and shifted anchors
         height, width = scores.shape[-2:]
@@ -104,87 +108,70 @@ class ProposalLayer(UserFunction):
         if DEBUG:
             print ('score map size: {}'.format(scores.shape))
 
-        # Enumerate all shifts
-        shift_x = np.arange(0, width) * self._feat_stride
-        shift_y = np.arange(0, height) * self._feat_stride
-        shift_x, shift_y = np.meshgrid(shift_x, shift_y)
-        shifts = np.vstack((shift_x.ravel(), shift_y.ravel(),
-                            shift_x.ravel(), shift_y.ravel())).transpose()
-
-        # Enumerate all shifted anchors:
-        #
-        # add A anchors (1, A, 4) to
-        # cell K shifts (K, 1, 4) to get
-        # shift anchors (K, A, 4)
-        # reshape to (K*A, 4) shifted anchors
-        A = self._num_anchors
-        K = shifts.shape[0]
-        anchors = self._anchors.reshape((1, A, 4)) + \
-                  shifts.reshape((1, K, 4)).transpose((1, 0, 2))
-        anchors = anchors.reshape((K * A, 4))
+        # The shifted anchors (K*A, 4) are the same for all images (and usually for all minibatches)
+        anchor_grid = get_anchor_grid(height, width, self._feat_stride, self._anchor_scales)
 
         # Transpose and reshape predicted bbox transformations to get them
         # into the same order as the anchors:
         #
-        # bbox deltas will be (1, 4 * A, H, W) format
-        # transpose to (1, H, W, 4 * A)
-        # reshape to (1 * H * W * A, 4) where rows are ordered by (h, w, a)
+        # bbox deltas will be (N, 4 * A, H, W) format
+        # transpose to (N, H, W, 4 * A)
+        # reshape to (N, H * W * A, 4) where rows are ordered by (h, w, a)
         # in slowest to fastest order
-        bbox_deltas = bbox_deltas.transpose((0, 2, 3, 1)).reshape((-1, 4))
+        bbox_deltas = bbox_deltas.transpose((0, 2, 3, 1)).reshape((num_images, -1, 4))
 
         # Same story for the scores:
         #
-        # scores are (1, A, H, W) format
-        # transpose to (1, H, W, A)
-        # reshape to (1 * H * W * A, 1) where rows are ordered by (h, w, a)
-        scores = scores.transpose((0, 2, 3, 1)).reshape((-1, 1))
+        # scores are (N, A, H, W) format
+        # transpose to (N, H, W, A)
+        # reshape to (N, H * W * A) where columns are ordered by (h, w, a)
+        scores = scores.transpose((0, 2, 3, 1)).reshape((num_images, -1))
 
         # Convert anchors into proposals via bbox transformations
-        proposals = bbox_transform_inv(anchors, bbox_deltas)
+        widths, heights, ctr_x, ctr_y = anchor_grid.whctrs(bbox_deltas.dtype)
+        proposals = bbox_transform_inv_whctrs(widths, heights, ctr_x, ctr_y, bbox_deltas)
 
-        # 2. clip predicted boxes to image
-        proposals = clip_boxes(proposals, im_info)
+        # 2. clip predicted boxes to each image
+        proposals = clip_boxes_per_image(proposals, im_info)
 
         # 3. remove predicted boxes with either height or width < threshold
         # (NOTE: convert min_size to input image scale. Original size = im_info[4:6], scaled size = im_info[2:4])
-        cntk_image_scale = im_info[2] / im_info[4]
-        keep = _filter_boxes(proposals, min_size * cntk_image_scale)
-        proposals = proposals[keep, :]
-        scores = scores[keep]
+        cntk_image_scale = im_info[:, 2] / im_info[:, 4]
+        valid = _valid_boxes(proposals, (min_size * cntk_image_scale)[:, np.newaxis])
+        num_valid = valid.sum(axis=1)
 
-        # 4. sort all (proposal, score) pairs by score from highest to lowest
+        # 4. sort all (proposal, score) pairs by score from highest to lowest,
+        # moving the removed boxes to the end of each row
         # 5. take top pre_nms_topN (e.g. 6000)
-        order = scores.ravel().argsort(kind='mergesort')[::-1]
-        if pre_nms_topN > 0:
-            order = order[:pre_nms_topN]
-        proposals = proposals[order, :]
-        scores = scores[order]
+        masked_scores = np.where(valid, scores, -np.inf)
+        order = masked_scores.argsort(axis=1, kind='mergesort')[:, ::-1]
+
+        dets_per_image = []
+        for i in range(num_images):
+            order_i = order[i, :num_valid[i]]
+            if pre_nms_topN > 0:
+                order_i = order_i[:pre_nms_topN]
+            dets_per_image.append(np.hstack((proposals[i, order_i, :], scores[i, order_i, np.newaxis])))
 
-        # 6. apply nms (e.g. threshold = 0.7)
+        # 6. apply nms (e.g. threshold = 0.7) to each image
         # 7. take after_nms_topN (e.g. 300)
         # 8. return the top proposals (-> RoIs top)
-        keep = nms(np.hstack((proposals, scores)), nms_thresh)
+        keep_per_image = nms_per_image(dets_per_image, nms_thresh)
         if post_nms_topN > 0:
-            keep = keep[:post_nms_topN]
-        proposals = proposals[keep, :]
-        scores = scores[keep]
+            keep_per_image = [keep[:post_nms_topN] for keep in keep_per_image]
+            num_rois = post_nms_topN
+        else:
+            num_rois = max(len(keep) for keep in keep_per_image)
 
         # pad with zeros if too few rois were found
-        num_found_proposals = proposals.shape[0]
-        if num_found_proposals < post_nms_topN:
-            if DEBUG:
-                print("Only {} proposals generated in ProposalLayer".format(num_found_proposals))
-            proposals_padded = np.zeros(((post_nms_topN,) + proposals.shape[1:]), dtype=np.float32)
-            proposals_padded[:num_found_proposals, :] = proposals
-            proposals = proposals_padded
-
-        # Output rois blob
-        # Our RPN implementation only supports a single input image, so all
-        # batch inds are 0
-        # for CNTK: add batch axis to output shape
-        proposals.shape = (1,) + proposals.shape
-
-        return None, proposals
+        # for CNTK: the first axis of the output is the batch axis
+        rois = np.zeros((num_images, num_rois, 4), dtype=np.float32)
+        for i, keep in enumerate(keep_per_image):
+            if DEBUG and len(keep) < num_rois:
+                print("Only {} proposals generated in ProposalLayer".format(len(keep)))
+            rois[i, :len(keep), :] = dets_per_image[i][keep, :4]
+
+        return None, rois
 
     def backward(self, state, root_gradients, variables):
         """This layer does not propagate gradients."""
@@ -206,9 +193,8 @@ class ProposalLayer(UserFunction):
         return ProposalLayer(inputs[0], inputs[1], inputs[2], name=name, param_str=param_str)
 
 
-def _filter_boxes(boxes, min_size):
-    """Remove all boxes with any side smaller than min_size."""
-    ws = boxes[:, 2] - boxes[:, 0] + 1
-    hs = boxes[:, 3] - boxes[:, 1] + 1
-    keep = np.where((ws >= min_size) & (hs >= min_size))[0]
-    return keep
+def _valid_boxes(boxes, min_size):
+    """Mask of all boxes (..., 4) that have both sides larger or equal to min_size."""
+    ws = boxes[..., 2] - boxes[..., 0] + 1
+    hs = boxes[..., 3] - boxes[..., 1] + 1
+    return (ws >= min_size) & (hs >= min_size)
@@ -22,7 +22,9 @@ DEBUG = False
 class ProposalTargetLayer(UserFunction):
     '''
     Assign object detection proposals to ground-truth targets. Produces proposal
-    classification labels and bounding-box regression targets.
+    classification labels and bounding-box regression targets. Minibatches of
+    several images are supported, the rois are sampled for each image
+    independently.
     '''
     
     def __init__(self, arg1, arg2, name='ProposalTargetLayer', param_str=None, deterministic=False):
@@ -57,10 +59,50 @@ class ProposalTargetLayer(UserFunction):
 
     def forward(self, arguments, outputs, device=None, outputs_to_retain=None):
         bottom = arguments
+        num_images = bottom[0].shape[0]
+
+        rois_per_image = cfg.TRAIN.BATCH_SIZE
+        fg_rois_per_image = np.round(cfg["TRAIN"].FG_FRACTION * rois_per_image).astype(int)
+
+        # pad with zeros if too few rois were found
+        # for CNTK: the first axis of the outputs is the batch axis
+        rois = np.zeros((num_images, rois_per_image, 4), dtype=np.float32)
+        labels = np.zeros((num_images, rois_per_image), dtype=np.float32)
+        bbox_targets = np.zeros((num_images, rois_per_image, self._num_classes * 4), dtype=np.float32)
+        bbox_inside_weights = np.zeros((num_images, rois_per_image, self._num_classes * 4), dtype=np.float32)
+
+        for i in range(num_images):
+            # Proposal ROIs (x1, y1, x2, y2) coming from RPN
+            # (i.e., rpn.proposal_layer.ProposalLayer), or any other source
+            # GT boxes (x1, y1, x2, y2, label)
+            image_labels, image_rois, image_bbox_targets, image_bbox_inside_weights = \
+                self._sample_image_rois(bottom[0][i], bottom[1][i], fg_rois_per_image, rois_per_image)
+
+            num_found_rois = image_rois.shape[0]
+            # for CNTK: get rid of batch ind zeros
+            rois[i, :num_found_rois, :] = image_rois[:, 1:]
+            labels[i, :num_found_rois] = image_labels
+            bbox_targets[i, :num_found_rois, :] = image_bbox_targets
+            bbox_inside_weights[i, :num_found_rois, :] = image_bbox_inside_weights
+
+        # sampled rois
+        outputs[self.outputs[0]] = rois
+
+        # classification labels
+        labels_dense = np.eye(self._num_classes, dtype=np.float32)[labels.astype(int)]
+        outputs[self.outputs[1]] = labels_dense
+
+        # bbox_targets
+        outputs[self.outputs[2]] = bbox_targets
+
+        # bbox_inside_weights
+        outputs[self.outputs[3]] = bbox_inside_weights
+
+    def _sample_image_rois(self, all_rois, gt_boxes, fg_rois_per_image, rois_per_image):
+        '''
+        Samples the rois and computes the targets for a single image.
+        '''
 
-        # Proposal ROIs (0, x1, y1, x2, y2) coming from RPN
-        # (i.e., rpn.proposal_layer.ProposalLayer), or any other source
-        all_rois = bottom[0][0,:]
         # remove zero padded proposals
         keep0 = np.where(
             ((all_rois[:, 2] - all_rois[:, 0]) > 0) &
@@ -68,10 +110,8 @@ class ProposalTargetLayer(UserFunction):
         )
         all_rois = all_rois[keep0]
 
-        # GT boxes (x1, y1, x2, y2, label)
         # TODO(rbg): it's annoying that sometimes I have extra info before
         # and other times after box coordinates -- normalize to one format
-        gt_boxes = bottom[1][0,:]
         # remove zero padded ground truth boxes
         keep1 = np.where(
             ((gt_boxes[:,2] - gt_boxes[:,0]) > 0) &
@@ -88,13 +128,6 @@ class ProposalTargetLayer(UserFunction):
         zeros = np.zeros((all_rois.shape[0], 1), dtype=all_rois.dtype)
         all_rois = np.hstack((zeros, all_rois))
 
-        # Sanity check: single batch only
-        assert np.all(all_rois[:, 0] == 0), \
-                'Only single item batches are supported'
-
-        rois_per_image = cfg.TRAIN.BATCH_SIZE
-        fg_rois_per_image = np.round(cfg["TRAIN"].FG_FRACTION * rois_per_image).astype(int)
-
         # Sample rois with classification labels and bounding box regression
         # targets
         labels, rois, bbox_targets, bbox_inside_weights = _sample_rois(
@@ -113,45 +146,7 @@ class ProposalTargetLayer(UserFunction):
             print ('num bg avg: {}'.format(self._bg_num / self._count))
             print ('ratio: {:.3f}'.format(float(self._fg_num) / float(self._bg_num)))
 
-        # pad with zeros if too few rois were found
-        num_found_rois = rois.shape[0]
-        if num_found_rois < rois_per_image:
-            rois_padded = np.zeros((rois_per_image, rois.shape[1]), dtype=np.float32)
-            rois_padded[:num_found_rois, :] = rois
-            rois = rois_padded
-
-            labels_padded = np.zeros((rois_per_image), dtype=np.float32)
-            labels_padded[:num_found_rois] = labels
-            labels = labels_padded
-
-            bbox_targets_padded = np.zeros((rois_per_image, bbox_targets.shape[1]), dtype=np.float32)
-            bbox_targets_padded[:num_found_rois, :] = bbox_targets
-            bbox_targets = bbox_targets_padded
-
-            bbox_inside_weights_padded = np.zeros((rois_per_image, bbox_inside_weights.shape[1]), dtype=np.float32)
-            bbox_inside_weights_padded[:num_found_rois, :] = bbox_inside_weights
-            bbox_inside_weights = bbox_inside_weights_padded
-
-        # for CNTK: get rid of batch ind zeros and add batch axis
-        rois = rois[:,1:]
-
-        # sampled rois
-        rois.shape = (1,) + rois.shape
-        outputs[self.outputs[0]] = np.ascontiguousarray(rois)
-
-        # classification labels
-        labels_as_int = [i.item() for i in labels.astype(int)]
-        labels_dense = np.eye(self._num_classes, dtype=np.float32)[labels_as_int]
-        labels_dense.shape = (1,) + labels_dense.shape # batch axis
-        outputs[self.outputs[1]] = labels_dense
-
-        # bbox_targets
-        bbox_targets.shape = (1,) + bbox_targets.shape # batch axis
-        outputs[self.outputs[2]] = np.ascontiguousarray(bbox_targets)
-
-        # bbox_inside_weights
-        bbox_inside_weights.shape = (1,) + bbox_inside_weights.shape # batch axis
-        outputs[self.outputs[3]] = np.ascontiguousarray(bbox_inside_weights)
+        return labels, rois, bbox_targets, bbox_inside_weights
 
     def backward(self, state, root_gradients, variables):
         """This layer does not propagate gradients."""
@@ -20,6 +20,7 @@ from rpn.anchor_target_layer import AnchorTargetLayer as CntkAnchorTargetLayer
 from caffe_layers.proposal_layer import ProposalLayer as CaffeProposalLayer
 from caffe_layers.proposal_target_layer import ProposalTargetLayer as CaffeProposalTargetLayer
 from caffe_layers.anchor_target_layer import AnchorTargetLayer as CaffeAnchorTargetLayer
+from rpn.proposal_layer import cfg
 
 def test_proposal_layer():
     cls_prob_shape_cntk = (18,61,61)
@@ -189,7 +190,151 @@ def test_anchor_target_layer():
     assert np.allclose(cntk_bbox_inside_w, caffe_bbox_inside_w, rtol=0.0, atol=0.0)
     print("Verified AnchorTargetLayer")
 
+def test_rpn_layers_batch():
+    num_images = 3
+    cls_prob_shape = (18,31,31)
+    rpn_bbox_shape = (36,31,31)
+    dims_info_shape = (6,)
+    num_gt_boxes = 20
+    gt_boxes_shape = (num_gt_boxes,5)
+
+    # Create input tensors with values, the last image has only padding gt boxes but one
+    cls_prob = np.random.random_sample((num_images,) + cls_prob_shape).astype(np.float32)
+    rpn_bbox_pred = np.random.random_sample((num_images,) + rpn_bbox_shape).astype(np.float32)
+    dims_input = np.array([[500, 500, 500, 500, 1000, 1000],
+                           [500, 500, 500, 400, 1000, 800],
+                           [500, 500, 350, 500, 700, 1000]]).astype(np.float32)
+
+    gt_boxes = np.zeros((num_images,) + gt_boxes_shape, dtype=np.float32)
+    for i in range(num_images):
+        num_boxes = num_gt_boxes if i < num_images - 1 else 1
+        x1y1 = np.random.random_sample((num_boxes, 2)) * 250
+        wh = np.random.random_sample((num_boxes, 2)) * 200
+        x2y2 = x1y1 + wh + 50
+        label = np.random.random_sample((num_boxes, 1)) * 17.0
+        gt_boxes[i, :num_boxes] = np.hstack((x1y1, x2y2, label))
+
+    cls_prob_var = input_variable(cls_prob_shape)
+    rpn_bbox_var = input_variable(rpn_bbox_shape)
+    dims_info_var = input_variable(dims_info_shape)
+    gt_boxes_var = input_variable(gt_boxes_shape)
+
+    proposal_layer = user_function(CntkProposalLayer(cls_prob_var, rpn_bbox_var, dims_info_var))
+    anchor_target_layer = user_function(CntkAnchorTargetLayer(cls_prob_var, gt_boxes_var, dims_info_var, deterministic=True))
+    # proposal layer forward() uses the test settings since no outputs are retained
+    rois_var = input_variable((cfg["TEST"].RPN_POST_NMS_TOP_N, 4))
+    proposal_target_layer = user_function(CntkProposalTargetLayer(rois_var, gt_boxes_var, param_str="'num_classes': 17", deterministic=True))
+
+    def forward(images):
+        _, proposals = proposal_layer.forward({cls_prob_var: cls_prob[images], rpn_bbox_var: rpn_bbox_pred[images],
+                                               dims_info_var: dims_input[images]})
+        proposals = proposals[next(iter(proposals))]
+        _, anchor_targets = anchor_target_layer.forward({cls_prob_var: cls_prob[images], gt_boxes_var: gt_boxes[images],
+                                                         dims_info_var: dims_input[images]})
+        _, proposal_targets = proposal_target_layer.forward({rois_var: proposals, gt_boxes_var: gt_boxes[images]})
+        outputs = [proposals]
+        for output in (anchor_targets, proposal_targets):
+            outputs += [output[k] for k in sorted(output, key=lambda k: k.name)]
+        return outputs
+
+    # the results for a minibatch of images are exactly the same as for each image on its own
+    batch_outputs = forward(slice(0, num_images))
+    for i in range(num_images):
+        image_outputs = forward(slice(i, i + 1))
+        for batch_output, image_output in zip(batch_outputs, image_outputs):
+            assert np.allclose(batch_output[i], image_output[0], rtol=0.0, atol=0.0)
+    print("Verified batched RPN layers")
+
+def test_anchor_grid_cache():
+    from rpn.generate_anchors import generate_anchors, generate_shifted_anchors, get_anchor_grid
+    from rpn.bbox_transform import bbox_transform_inv, bbox_transform_inv_whctrs
+
+    grid = get_anchor_grid(61, 61, 16, (8, 16, 32))
+    assert get_anchor_grid(61, 61, 16, [8, 16, 32]) is grid
+    assert get_anchor_grid(62, 61, 16, (8, 16, 32)) is not grid
+
+    anchors = generate_shifted_anchors(generate_anchors(scales=np.array((8, 16, 32))), 61, 61, 16)
+    assert np.array_equal(grid.anchors, anchors)
+
+    deltas = np.random.random_sample(anchors.shape).astype(np.float32) - 0.5
+    widths, heights, ctr_x, ctr_y = grid.whctrs(np.float32)
+    assert np.array_equal(bbox_transform_inv_whctrs(widths, heights, ctr_x, ctr_y, deltas),
+                          bbox_transform_inv(anchors, deltas))
+
+    im_info = np.array([1000, 1000, 1000, 600, 500, 300], dtype=np.float32)
+    inds_inside = grid.inds_inside(im_info)
+    assert grid.inds_inside(im_info) is inds_inside
+    assert np.array_equal(inds_inside, np.where(
+        (anchors[:, 0] >= 0) & (anchors[:, 1] >= 200) &
+        (anchors[:, 2] < 1000) & (anchors[:, 3] < 800))[0])
+
+def _random_dets(num_boxes):
+    xy = np.random.random_sample((num_boxes, 2)) * 900
+    wh = np.random.random_sample((num_boxes, 2)) * 300 + 8
+    scores = np.random.random_sample((num_boxes, 1))
+    return np.hstack((xy, xy + wh, scores)).astype(np.float32)
+
+def test_numpy_nms():
+    from nms.numpy_nms import nms, nms_per_group, nms_greedy
+
+    assert nms(np.zeros((0, 5), dtype=np.float32), 0.7) == []
+    for num_boxes in (1, 63, 64, 65, 1000):
+        dets = _random_dets(num_boxes)
+        for thresh in (0.3, 0.7):
+            for block_size in (8, 64):
+                assert nms(dets, thresh, block_size) == nms_greedy(dets, thresh)
+
+    dets_per_class = [_random_dets(n) for n in (30, 0, 200, 55)]
+    keep_per_class = nms_per_group(dets_per_class, 0.5)
+    assert len(keep_per_class) == len(dets_per_class)
+    for dets, keep in zip(dets_per_class, keep_per_class):
+        assert keep == (nms_greedy(dets, 0.5) if len(dets) > 0 else [])
+
+def test_map_evaluation():
+    import copy
+    from utils.map.map_helpers import _evaluate_detections, _evaluate_detections_all_classes
+
+    num_classes = 4
+    num_images = 12
+    all_boxes = [[[] for _ in range(num_images)] for _ in range(num_classes)]
+    all_gt_infos = [[] for _ in range(num_classes)]
+    for cls_index in range(1, num_classes):
+        for img_index in range(num_images):
+            num_gt = np.random.randint(0, 4) if cls_index < num_classes - 1 else 0
+            gt_boxes = np.hstack((_random_dets(num_gt)[:, :4], np.full((num_gt, 1), cls_index)))
+            all_gt_infos[cls_index].append({'bbox': gt_boxes,
+                                            'difficult': list(np.random.random_sample(num_gt) < 0.2),
+                                            'det': [False] * num_gt})
+
+            num_dets = np.random.randint(0, 6)
+            if num_dets > 0 and img_index % 5 > 0:
+                # detections close to ground truth boxes, with tied scores
+                dets = _random_dets(num_dets)
+                if num_gt > 0:
+                    dets[:, :4] = gt_boxes[np.random.randint(0, num_gt, num_dets), :4] + np.random.randint(-20, 20, (num_dets, 4))
+                dets[:, 4] = np.round(dets[:, 4], 1)
+                all_boxes[cls_index][img_index] = dets
+
+    class_indices = list(range(1, num_classes))
+    for use_07_metric in (False, True):
+        gt_infos = copy.deepcopy(all_gt_infos)
+        results = _evaluate_detections_all_classes(class_indices, all_boxes, [gt_infos[i] for i in class_indices],
+                                                   use_07_metric=use_07_metric)
+        for cls_index, (rec, prec, ap) in zip(class_indices, results):
+            expected_gt_infos = copy.deepcopy(all_gt_infos[cls_index])
+            expected_rec, expected_prec, expected_ap = _evaluate_detections(cls_index, all_boxes, expected_gt_infos,
+                                                                            use_07_metric=use_07_metric)
+            assert np.array_equal(rec, expected_rec, equal_nan=True)
+            assert np.array_equal(prec, expected_prec)
+            assert ap == expected_ap or (np.isnan(ap) and np.isnan(expected_ap))
+            assert [list(map(bool, R['det'])) for R in gt_infos[cls_index]] == \
+                   [list(map(bool, R['det'])) for R in expected_gt_infos]
+
 if __name__ == '__main__':
     test_proposal_layer()
     test_proposal_target_layer()
     test_anchor_target_layer()
+    test_rpn_layers_batch()
+    test_anchor_grid_cache()
+    test_numpy_nms()
+    test_map_evaluation()
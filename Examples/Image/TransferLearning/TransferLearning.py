@@ -8,6 +8,8 @@ from __future__ import print_function
 import numpy as np
 import cntk as C
 import os
+import time
+from multiprocessing.pool import ThreadPool
 from PIL import Image
 from cntk.device import try_set_default_device, gpu
 from cntk import load_model, placeholder, Constant
@@ -17,7 +19,7 @@ from cntk.io import MinibatchSource, ImageDeserializer, StreamDefs, StreamDef
 import cntk.io.transforms as xforms
 from cntk.layers import Dense
 from cntk.learners import momentum_sgd, learning_rate_schedule, momentum_schedule
-from cntk.ops import combine, softmax
+from cntk.ops import combine
 from cntk.ops.functions import CloneMethod
 from cntk.losses import cross_entropy_with_softmax
 from cntk.metrics import classification_error
@@ -43,6 +45,10 @@ lr_per_mb = [0.2]*10 + [0.1]
 momentum_per_mb = 0.9
 l2_reg_weight = 0.0005
 
+# Evaluation parameters: number of images per forward pass and number of threads that load images
+eval_mb_size = 32
+eval_num_workers = 4
+
 # define base model location and characteristics
 _base_model_file = os.path.join(base_folder, "..", "..", "..", "PretrainedModels", "ResNet18_ImageNet_CNTK.model")
 _feature_node_name = "features"
@@ -138,7 +144,7 @@ def train_model(base_model_file, feature_node_name, last_hidden_node_name,
 
 
 # Evaluates a single image using the provided model
-def eval_single_image(loaded_model, image_path, image_width, image_height):
+def load_image(image_path, image_width, image_height):
     # load and format image (resize, RGB -> BGR, CHW -> HWC)
     img = Image.open(image_path)
     if image_path.endswith("png"):
@@ -155,45 +161,79 @@ def eval_single_image(loaded_model, image_path, image_width, image_height):
     # bgr_image = np.asarray(resized, dtype=np.float32)
     # hwc_format = np.ascontiguousarray(np.rollaxis(bgr_image, 2))
 
+    return hwc_format
+
+
+# Computes the softmax probabilities along the last axis
+def softmax_probabilities(output):
+    exp_output = np.exp(output - np.max(output, axis=-1, keepdims=True))
+    return exp_output / np.sum(exp_output, axis=-1, keepdims=True)
+
+
+def eval_single_image(loaded_model, image_path, image_width, image_height):
+    hwc_format = load_image(image_path, image_width, image_height)
+
     # compute model output
     arguments = {loaded_model.arguments[0]: [hwc_format]}
     output = loaded_model.eval(arguments)
 
     # return softmax probabilities
-    sm = softmax(output[0])
-    return sm.eval()
+    return softmax_probabilities(output[0])
+
+
+# Evaluates the images in minibatches of mb_size images and yields the softmax probabilities
+# of each minibatch. The images of the next minibatch are loaded by num_workers threads
+# while the current minibatch is evaluated.
+def eval_images(loaded_model, image_paths, image_width, image_height, mb_size=eval_mb_size, num_workers=eval_num_workers):
+    load = lambda image_path: load_image(image_path, image_width, image_height)
+    minibatches = [image_paths[i:i + mb_size] for i in range(0, len(image_paths), mb_size)]
+    if len(minibatches) == 0:
+        return
+
+    pool = ThreadPool(num_workers)
+    try:
+        next_images = pool.map_async(load, minibatches[0])
+        for i in range(len(minibatches)):
+            images = next_images.get()
+            if i + 1 < len(minibatches):
+                next_images = pool.map_async(load, minibatches[i + 1])
+
+            output = loaded_model.eval({loaded_model.arguments[0]: np.asarray(images)})
+            yield softmax_probabilities(np.reshape(output, (len(images), -1)))
+    finally:
+        pool.close()
 
 
 # Evaluates an image set using the provided model
-def eval_test_images(loaded_model, output_file, test_map_file, image_width, image_height, max_images=-1, column_offset=0):
-    num_images = sum(1 for line in open(test_map_file))
+def eval_test_images(loaded_model, output_file, test_map_file, image_width, image_height, max_images=-1, column_offset=0,
+                     mb_size=eval_mb_size, num_workers=eval_num_workers):
+    with open(test_map_file, "r") as input_file:
+        map_tokens = [line.rstrip().split('\t') for line in input_file]
     if max_images > 0:
-        num_images = min(num_images, max_images)
+        map_tokens = map_tokens[:max_images]
+    num_images = len(map_tokens)
     print("Evaluating model output node '{0}' for {1} images.".format(new_output_node_name, num_images))
 
+    img_files = [tokens[0 + column_offset] for tokens in map_tokens]
+    true_labels = np.array([int(tokens[1 + column_offset]) for tokens in map_tokens])
+
     pred_count = 0
     correct_count = 0
     np.seterr(over='raise')
+    start_time = time.time()
     with open(output_file, 'wb') as results_file:
-        with open(test_map_file, "r") as input_file:
-            for line in input_file:
-                tokens = line.rstrip().split('\t')
-                img_file = tokens[0 + column_offset]
-                probs = eval_single_image(loaded_model, img_file, image_width, image_height)
-
-                pred_count += 1
-                true_label = int(tokens[1 + column_offset])
-                predicted_label = np.argmax(probs)
-                if predicted_label == true_label:
-                    correct_count += 1
-
-                np.savetxt(results_file, probs[np.newaxis], fmt="%.3f")
-                if pred_count % 100 == 0:
-                    print("Processed {0} samples ({1} correct)".format(pred_count, (float(correct_count) / pred_count)))
-                if pred_count >= num_images:
-                    break
+        for probs in eval_images(loaded_model, img_files, image_width, image_height, mb_size, num_workers):
+            predicted_labels = np.argmax(probs, axis=1)
+            correct_count += int(np.sum(predicted_labels == true_labels[pred_count:pred_count + len(probs)]))
+
+            np.savetxt(results_file, probs, fmt="%.3f")
+            if (pred_count + len(probs)) // 100 > pred_count // 100:
+                print("Processed {0} samples ({1} correct)".format(pred_count + len(probs), (float(correct_count) / (pred_count + len(probs)))))
+            pred_count += len(probs)
 
+    elapsed = time.time() - start_time
     print ("{0} out of {1} predictions were correct {2}.".format(correct_count, pred_count, (float(correct_count) / pred_count)))
+    print ("Evaluated {0} images in {1:.1f} seconds ({2:.1f} images/sec).".format(pred_count, elapsed, pred_count / elapsed))
 
 
 if __name__ == '__main__':
@@ -89,16 +89,18 @@ def train_and_eval(_base_model_file, _train_image_folder, _test_image_folder, _r
         print("Stored trained model at %s" % tl_model_file)
 
     # evaluate test images
+    with open(test_map_file, "r") as input_file:
+        map_tokens = [line.rstrip().split('\t') for line in input_file]
+    img_files = [tokens[0] for tokens in map_tokens]
+    true_labels = [int(tokens[1]) for tokens in map_tokens]
+
     with open(_results_file, 'w') as output_file:
-        with open(test_map_file, "r") as input_file:
-            for line in input_file:
-                tokens = line.rstrip().split('\t')
-                img_file = tokens[0]
-                true_label = int(tokens[1])
-                probs = eval_single_image(trained_model, img_file, image_width, image_height)
-
-                formatted_line = format_output_line(img_file, true_label, probs, class_mapping)
-                output_file.write(formatted_line)
+        img_index = 0
+        for probs in eval_images(trained_model, img_files, image_width, image_height):
+            lines = [format_output_line(img_files[img_index + i], true_labels[img_index + i], probs[i], class_mapping)
+                     for i in range(len(probs))]
+            output_file.writelines(lines)
+            img_index += len(probs)
 
     print("Done. Wrote output to %s" % _results_file)
 
@@ -8,6 +8,7 @@ from __future__ import print_function
 import os
 import argparse
 import math
+import time
 import cntk
 from cntk.layers import *  # Layers library
 from cntk.layers.typing import *
@@ -31,12 +32,33 @@ hidden_dim = 300
 # define the reader    #
 ########################
 
-def create_reader(path, is_training):
-    return cntk.io.MinibatchSource(cntk.io.CTFDeserializer(path, cntk.io.StreamDefs(
+# With bucketing_window > 0, windows of that many queries are sorted by length, such that each
+# minibatch contains queries of similar length and little compute is wasted on padding.
+def create_reader(path, is_training, bucketing_window=0):
+    reader = cntk.io.MinibatchSource(cntk.io.CTFDeserializer(path, cntk.io.StreamDefs(
         query         = cntk.io.StreamDef(field='S0', shape=vocab_size,  is_sparse=True),
         intent_labels = cntk.io.StreamDef(field='S1', shape=num_intents, is_sparse=True),  # (used for intent classification variant)
         slot_labels   = cntk.io.StreamDef(field='S2', shape=num_labels,  is_sparse=True)
     )), randomize=is_training, max_sweeps = cntk.io.INFINITELY_REPEAT if is_training else 1)
+    if bucketing_window > 0:
+        reader = cntk.io.BucketingMinibatchSource(reader, window_in_sequences=bucketing_window,
+                                                  length_stream='query', randomize=is_training)
+    return reader
+
+# Reads all minibatches of a (not repeating) reader and counts the padded positions of the queries.
+# Returns the number of words, the number of padded positions and the time it took.
+def measure_padding(reader, minibatch_size):
+    num_words = 0
+    num_padded = 0
+    start = time.time()
+    while True:
+        mb = reader.next_minibatch(minibatch_size)
+        if not mb:
+            break
+        mask = mb[reader.streams.query].mask
+        num_words += mb[reader.streams.query].num_samples
+        num_padded += mask.size - np.count_nonzero(mask)
+    return num_words, num_padded, time.time() - start
 
 ########################
 # define the model     #
@@ -188,6 +210,8 @@ if __name__=='__main__':
     parser.add_argument('-e', '--epochs', help='total epochs', required=False, default='8')
     parser.add_argument('-tensorboard_logdir', '--tensorboard_logdir',
                         help='Directory where TensorBoard logs should be created', required=False, default=None)
+    parser.add_argument('-bucketing_window', '--bucketing_window', type=int, default=0, required=False,
+                        help='Number of test queries that are sorted by length to form minibatches of similar length (0: no bucketing)')
 
     args = vars(parser.parse_args())
     max_epochs = int(args['epochs'])
@@ -210,5 +234,15 @@ if __name__=='__main__':
     model = Function.load(path)
 
     # test
-    reader = create_reader(data_dir + "/atis.test.ctf", is_training=False)
+    bucketing_window = args['bucketing_window']
+    reader = create_reader(data_dir + "/atis.test.ctf", is_training=False, bucketing_window=bucketing_window)
+    start = time.time()
     evaluate(reader, model)
+    print("Evaluation took {:.2f} s".format(time.time() - start))
+
+    # compare the padding of the test minibatches with and without bucketing
+    if bucketing_window > 0:
+        for window in [0, bucketing_window]:
+            reader = create_reader(data_dir + "/atis.test.ctf", is_training=False, bucketing_window=window)
+            num_words, num_padded, seconds = measure_padding(reader, minibatch_size=1000)
+            print("Bucketing window {}: {} padded positions for {} words, read in {:.2f} s".format(window, num_padded, num_words, seconds))
@@ -5,6 +5,8 @@
 # ==============================================================================
 
 from argparse import ArgumentParser
+import threading
+import time
 
 import gym
 import numpy as np
@@ -25,18 +27,25 @@ class ReplayMemory(object):
     We store all the transitions (s(t), action, s(t+1), reward, done).
     The replay memory allows us to efficiently sample minibatches from it, and generate the correct state representation
     (w.r.t the number of previous frames needed).
+
+    The states are stored with the specified dtype (uint8 by default, which holds ALE frames
+    in a quarter of the memory of float32) and converted to float32 when a minibatch is created.
     """
-    def __init__(self, size, sample_shape, history_length=4):
+    def __init__(self, size, sample_shape, history_length=4, dtype=np.uint8):
         self._pos = 0
         self._count = 0
         self._max_size = size
         self._history_length = max(1, history_length)
         self._state_shape = sample_shape
-        self._states = np.zeros((size,) + sample_shape, dtype=np.float32)
+        self._states = np.zeros((size,) + sample_shape, dtype=dtype)
         self._actions = np.zeros(size, dtype=np.uint8)
         self._rewards = np.zeros(size, dtype=np.float32)
         self._terminals = np.zeros(size, dtype=np.float32)
 
+        # Offsets of the frames of the pre state (all but the last) and the post state (all but the first)
+        # relative to the sampled index
+        self._history_offsets = np.arange(-self._history_length + 1, 2)
+
     def __len__(self):
         """ Returns the number of items currently present in the memory
         Returns: Int >= 0
@@ -54,6 +63,8 @@ class ReplayMemory(object):
         """
         assert state.shape == self._state_shape, \
             'Invalid state shape (required: %s, got: %s)' % (self._state_shape, state.shape)
+        assert np.can_cast(state.dtype, self._states.dtype, casting='same_kind'), \
+            'Invalid state dtype (memory stores %s, got: %s)' % (self._states.dtype, state.dtype)
 
         self._states[self._pos] = state
         self._actions[self._pos] = action
@@ -68,30 +79,34 @@ class ReplayMemory(object):
             The returned indices can be retrieved using #get_state().
             See the method #minibatch() if you want to retrieve samples directly.
 
+            Candidates are drawn in batches. A candidate is valid if its history does not
+            wrap over the current pointer and does not contain a terminal state. The first
+            size distinct valid candidates are returned.
+
         Attributes:
             size (int): The minibatch size
 
         Returns:
              Indexes of the sampled states ([int])
         """
-
-        # Local variable access is faster in loops
-        count, pos, history_len, terminals = self._count - 1, self._pos, \
-                                             self._history_length, self._terminals
-        indexes = []
+        count, pos, history_len = self._count - 1, self._pos, self._history_length
+        history_offsets = np.arange(-history_len, 0)
+        indexes = np.zeros(0, dtype=np.int64)
 
         while len(indexes) < size:
-            index = np.random.randint(history_len, count)
+            candidates = np.random.randint(history_len, count, size=2 * size)
 
-            if index not in indexes:
+            # if not wrapping over current pointer,
+            # then check if there is terminal state wrapped inside
+            valid = ~((candidates >= pos) & (pos > candidates - history_len))
+            valid &= ~self._terminals[candidates[:, np.newaxis] + history_offsets].any(axis=1)
 
-                # if not wrapping over current pointer,
-                # then check if there is terminal state wrapped inside
-                if not (index >= pos > index - history_len):
-                    if not terminals[(index - history_len):index].any():
-                        indexes.append(index)
+            # keep the first occurrence of each index, in the order in which they were drawn
+            candidates = np.concatenate((indexes, candidates[valid]))
+            _, first = np.unique(candidates, return_index=True)
+            indexes = candidates[np.sort(first)]
 
-        return indexes
+        return indexes[:size].tolist()
 
     def minibatch(self, size):
         """ Generate a minibatch with the number of samples specified by the size parameter.
@@ -102,10 +117,12 @@ class ReplayMemory(object):
         Returns:
             tuple: Tensor[minibatch_size, input_shape...], [int], [float], [bool]
         """
-        indexes = self.sample(size)
+        indexes = np.array(self.sample(size))
 
-        pre_states = np.array([self.get_state(index) for index in indexes], dtype=np.float32)
-        post_states = np.array([self.get_state(index + 1) for index in indexes], dtype=np.float32)
+        # gather the frames of pre and post states at once, the sampled states never wrap
+        frames = self._states[indexes[:, np.newaxis] + self._history_offsets]
+        pre_states = np.ascontiguousarray(frames[:, :-1], dtype=np.float32)
+        post_states = np.ascontiguousarray(frames[:, 1:], dtype=np.float32)
         actions = self._actions[indexes]
         rewards = self._rewards[indexes]
         dones = self._terminals[indexes]
@@ -254,12 +271,18 @@ class DeepQAgent(object):
     """
     Implementation of Deep Q Neural Network agent like in:
         Nature 518. "Human-level control through deep reinforcement learning" (Mnih & al. 2015)
+
+    In pipelined mode, training runs on a background learner thread while the agent keeps acting.
+    The actor selects actions with a copy of the Action Value Network, which is synced every
+    `actor_sync_interval` updates. The learner does one update per `train_interval` actions like
+    the sequential mode, and the actor waits when the learner falls more than `max_update_lag`
+    updates behind, which bounds the staleness of both.
     """
     def __init__(self, input_shape, nb_actions,
                  gamma=0.99, explorer=LinearEpsilonAnnealingExplorer(1, 0.1, 1000000),
                  learning_rate=0.00025, momentum=0.95, minibatch_size=32,
                  memory_size=500000, train_after=200000, train_interval=4, target_update_interval=10000,
-                 monitor=True):
+                 monitor=True, pipelined=False, actor_sync_interval=100, max_update_lag=100):
         self.input_shape = input_shape
         self.nb_actions = nb_actions
         self.gamma = gamma
@@ -273,6 +296,8 @@ class DeepQAgent(object):
         self._history = History(input_shape)
         self._memory = ReplayMemory(memory_size, input_shape[1:], 4)
         self._num_actions_taken = 0
+        self._num_updates = 0
+        self._start_time = None
 
         # Metrics accumulator
         self._episode_rewards, self._episode_q_means, self._episode_q_stddev = [], [], []
@@ -327,6 +352,17 @@ class DeepQAgent(object):
         self._learner = l_sgd
         self._trainer = Trainer(criterion, (criterion, None), l_sgd, self._metrics_writer)
 
+        # Pipelined mode: the network used by the actor, and the state shared with the learner thread
+        self._pipelined = pipelined
+        self._actor_sync_interval = actor_sync_interval
+        self._max_update_lag = max_update_lag
+        self._actor_net = self._action_value_net.clone(CloneMethod.freeze) if pipelined else self._action_value_net
+        self._memory_lock = threading.Lock()
+        self._progress = threading.Condition()
+        self._learner_thread = None
+        self._learner_error = None
+        self._stop_learner = False
+
     def act(self, state):
         """ This allows the agent to select the next action to perform in regard of the current state of the environment.
         It follows the terminology used in the Nature paper.
@@ -336,6 +372,9 @@ class DeepQAgent(object):
 
         Returns: Int >= 0 : Next action to do
         """
+        if self._start_time is None:
+            self._start_time = time.time()
+
         # Append the state to the short term memory (ie. History)
         self._history.append(state)
 
@@ -345,7 +384,7 @@ class DeepQAgent(object):
         else:
             # Use the network to output the best action
             env_with_history = self._history.value
-            q_values = self._action_value_net.eval(
+            q_values = self._actor_net.eval(
                 # Append batch axis with only one sample to evaluate
                 env_with_history.reshape((1,) + env_with_history.shape)
             )
@@ -382,7 +421,8 @@ class DeepQAgent(object):
             self._history.reset()
 
         # Append to long term memory
-        self._memory.append(old_state, action, reward, done)
+        with self._memory_lock:
+            self._memory.append(old_state, action, reward, done)
 
     def train(self):
         """ This allows the agent to train itself to better understand the environment dynamics.
@@ -395,26 +435,108 @@ class DeepQAgent(object):
         The Target Network is a frozen copy of the Action Value Network updated as regular intervals.
         """
 
+        if self._pipelined:
+            self._wait_for_learner()
+            return
+
         agent_step = self._num_actions_taken
 
         if agent_step >= self._train_after:
             if (agent_step % self._train_interval) == 0:
-                pre_states, actions, post_states, rewards, terminals = self._memory.minibatch(self._minibatch_size)
-
-                self._trainer.train_minibatch(
-                    self._trainer.loss_function.argument_map(
-                        pre_states=pre_states,
-                        actions=Value.one_hot(actions.reshape(-1, 1).tolist(), self.nb_actions),
-                        post_states=post_states,
-                        rewards=rewards,
-                        terminals=terminals
-                    )
-                )
+                self._train_minibatch()
 
                 # Update the Target Network if needed
                 if (agent_step % self._target_update_interval) == 0:
                     self._target_net = self._action_value_net.clone(CloneMethod.freeze)
 
+    def close(self):
+        """ Stops the learner thread of the pipelined mode. Pending updates are not done.
+        """
+        if self._learner_thread is not None:
+            with self._progress:
+                self._stop_learner = True
+                self._progress.notify_all()
+            self._learner_thread.join()
+            self._learner_thread = None
+
+    def throughput(self):
+        """ Rates of the agent since its first action
+
+        Returns:
+            tuple: environment steps (actions) per second, network updates per second
+        """
+        if self._start_time is None:
+            return 0.0, 0.0
+        elapsed = max(time.time() - self._start_time, 1e-6)
+        return self._num_actions_taken / elapsed, self._num_updates / elapsed
+
+    def _train_minibatch(self):
+        """ Trains the Action Value Network on one minibatch sampled from the replay memory
+        """
+        with self._memory_lock:
+            pre_states, actions, post_states, rewards, terminals = self._memory.minibatch(self._minibatch_size)
+
+        self._trainer.train_minibatch(
+            self._trainer.loss_function.argument_map(
+                pre_states=pre_states,
+                actions=Value.one_hot(actions.reshape(-1, 1).tolist(), self.nb_actions),
+                post_states=post_states,
+                rewards=rewards,
+                terminals=terminals
+            )
+        )
+        self._num_updates += 1
+
+    def _num_updates_due(self):
+        """ Number of updates the sequential mode would have done after the actions taken so far
+        """
+        if self._num_actions_taken < self._train_after:
+            return 0
+        return (self._num_actions_taken - self._train_after) // self._train_interval + 1
+
+    def _wait_for_learner(self):
+        """ Starts the learner thread with the first update and blocks the actor while the learner
+        is more than max_update_lag updates behind
+        """
+        with self._progress:
+            if self._num_updates_due() > 0 and self._learner_thread is None:
+                self._learner_thread = threading.Thread(target=self._learn)
+                self._learner_thread.daemon = True
+                self._learner_thread.start()
+            self._progress.notify_all()
+            while self._num_updates_due() - self._num_updates > self._max_update_lag and \
+                    self._learner_error is None:
+                self._progress.wait()
+            if self._learner_error is not None:
+                raise self._learner_error
+
+    def _learn(self):
+        """ Learner thread of the pipelined mode
+        """
+        target_update_updates = max(1, self._target_update_interval // self._train_interval)
+        try:
+            while True:
+                with self._progress:
+                    while not self._stop_learner and self._num_updates >= self._num_updates_due():
+                        self._progress.wait()
+                    if self._stop_learner:
+                        return
+
+                self._train_minibatch()
+
+                # Sync the actor and update the Target Network if needed
+                if (self._num_updates % self._actor_sync_interval) == 0:
+                    self._actor_net = self._action_value_net.clone(CloneMethod.freeze)
+                if (self._num_updates % target_update_updates) == 0:
+                    self._target_net = self._action_value_net.clone(CloneMethod.freeze)
+
+                with self._progress:
+                    self._progress.notify_all()
+        except Exception as e:
+            with self._progress:
+                self._learner_error = e
+                self._progress.notify_all()
+
     def _plot_metrics(self):
         """Plot current buffers accumulated values to visualize agent learning
         """
@@ -428,6 +550,10 @@ class DeepQAgent(object):
 
         self._metrics_writer.write_value('Sum rewards per ep.', sum(self._episode_rewards), self._num_actions_taken)
 
+        steps_per_second, updates_per_second = self.throughput()
+        self._metrics_writer.write_value('Env steps per sec.', steps_per_second, self._num_actions_taken)
+        self._metrics_writer.write_value('Updates per sec.', updates_per_second, self._num_actions_taken)
+
 
 def as_ale_input(environment):
     """Convert the Atari environment RGB output (210, 160, 3) to an ALE one (84, 84).
@@ -446,6 +572,8 @@ if __name__ == '__main__':
     parser = ArgumentParser()
     parser.add_argument('-e', '--epoch', default=100, type=int, help='Number of epochs to run (epoch = 250k actions')
     parser.add_argument('-p', '--plot', action='store_true', default=False, help='Flag for enabling Tensorboard')
+    parser.add_argument('--pipelined', action='store_true', default=False,
+                        help='Flag for training on a background thread while acting')
     parser.add_argument('env', default='Pong-v3', type=str, metavar='N', nargs='?', help='Gym Atari environment to run')
 
     args = parser.parse_args()
@@ -454,7 +582,7 @@ if __name__ == '__main__':
     env = gym.make(args.env)
 
     # 2. Make agent
-    agent = DeepQAgent((4, 84, 84), env.action_space.n, monitor=args.plot)
+    agent = DeepQAgent((4, 84, 84), env.action_space.n, monitor=args.plot, pipelined=args.pipelined)
 
     # Train
     current_step = 0
@@ -478,3 +606,8 @@ if __name__ == '__main__':
             current_state = as_ale_input(env.reset())
 
         current_step += 1
+
+        if current_step % 10000 == 0:
+            print('%d steps, %.1f env steps/sec, %.1f updates/sec' % ((current_step,) + agent.throughput()))
+
+    agent.close()
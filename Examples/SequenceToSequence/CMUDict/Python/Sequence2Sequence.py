@@ -7,10 +7,11 @@
 from __future__ import print_function
 import numpy as np
 import os
+import time
 from cntk import Trainer, Axis
-from cntk.io import MinibatchSource, CTFDeserializer, StreamDef, StreamDefs, INFINITELY_REPEAT
+from cntk.io import MinibatchSource, BucketingMinibatchSource, CTFDeserializer, StreamDef, StreamDefs, INFINITELY_REPEAT
 from cntk.learners import momentum_sgd, fsadagrad, momentum_as_time_constant_schedule, learning_rate_schedule, UnitType
-from cntk import input, cross_entropy_with_softmax, classification_error, sequence, \
+from cntk import input, input_variable, cross_entropy_with_softmax, classification_error, sequence, \
                  element_select, alias, hardmax, placeholder, combine, parameter, times, plus
 from cntk.ops.functions import CloneMethod, load_model, Function
 from cntk.initializer import glorot_uniform
@@ -60,11 +61,17 @@ def model_path(epoch):
 # define the reader    #
 ########################
 
-def create_reader(path, is_training):
-    return MinibatchSource(CTFDeserializer(path, StreamDefs(
+# With bucketing_window > 0, windows of that many words are sorted by length, such that each
+# minibatch contains words of similar length and little compute is wasted on padding.
+def create_reader(path, is_training, bucketing_window=0):
+    reader = MinibatchSource(CTFDeserializer(path, StreamDefs(
         features = StreamDef(field='S0', shape=input_vocab_dim, is_sparse=True),
         labels   = StreamDef(field='S1', shape=label_vocab_dim, is_sparse=True)
     )), randomize = is_training, max_sweeps = INFINITELY_REPEAT if is_training else 1)
+    if bucketing_window > 0:
+        reader = BucketingMinibatchSource(reader, window_in_sequences=bucketing_window,
+                                          length_stream='features', randomize=is_training)
+    return reader
 
 ########################
 # define the model     #
@@ -174,6 +181,19 @@ def create_model_greedy(s2smodel):
         return unfold(initial_state=sentence_start, dynamic_axes_like=input)
     return model_greedy
 
+def create_model_beam(s2smodel, beam_width):
+    # model used in beam-search decoding (history is the decoder's own output for each of the beam_width hypotheses)
+    @Function
+    @Signature(LabelSequence[Tensor[label_vocab_dim]], InputSequence[Tensor[input_vocab_dim]])
+    def model_scores(history, input): # (history*, input*) --> (word_logp*)
+        return s2smodel(history, input)
+
+    # The decoder evaluates model_scores for all hypotheses of all input sequences at once, and
+    # returns the most probable output sequence (length-normalized) for each input sequence.
+    return BeamUnfoldFrom(model_scores,
+                          until_predicate=lambda w: w[...,sentence_end_index],  # a hypothesis ends with sentence_end_index
+                          length_increase=length_increase, beam_width=beam_width)
+
 def create_criterion_function(model):
     @Function
     @Signature(input = InputSequence[Tensor[input_vocab_dim]], labels = LabelSequence[Tensor[label_vocab_dim]])
@@ -278,9 +298,15 @@ def train(train_reader, valid_reader, vocab, i2w, s2smodel, max_epochs, epoch_si
 ########################
 
 # This decodes the test set and counts the string error rate.
-def evaluate_decoding(reader, s2smodel, i2w):
+# A beam_width of 1 uses the greedy decoder, otherwise beam search.
+def evaluate_decoding(reader, s2smodel, i2w, beam_width=1):
 
-    model_decoding = create_model_greedy(s2smodel) # wrap the greedy decoder around the model
+    if beam_width == 1:
+        model_decoding = create_model_greedy(s2smodel) # wrap the greedy decoder around the model
+    else:
+        model_decoding = create_model_beam(s2smodel, beam_width) # wrap the beam-search decoder around the model
+        # the beam-search decoder takes the input as list of (sparse) sequences
+        input_sequences = input_variable(input_vocab_dim, is_sparse=True)
 
     progress_printer = ProgressPrinter(tag='Evaluation')
 
@@ -289,11 +315,17 @@ def evaluate_decoding(reader, s2smodel, i2w):
     minibatch_size = 1024
     num_total = 0
     num_wrong = 0
+    decoding_time = 0
     while True:
         mb = reader.next_minibatch(minibatch_size)
         if not mb: # finish when end of test set reached
             break
-        e = model_decoding(mb[reader.streams.features])
+        start = time.time()
+        if beam_width == 1:
+            e = model_decoding(mb[reader.streams.features])
+        else:
+            e = model_decoding(sentence_start.value, mb[reader.streams.features].as_sequences(input_sequences))
+        decoding_time += time.time() - start
         outputs = format_sequences(e, i2w)
         labels  = format_sequences(sparse_to_dense(mb[reader.streams.labels]), i2w)
         # prepend sentence start for comparison
@@ -304,6 +336,7 @@ def evaluate_decoding(reader, s2smodel, i2w):
 
     rate = num_wrong / num_total
     print("string error rate of {:.1f}% in {} samples".format(100 * rate, num_total))
+    print("decoded {:.1f} sequences/sec with beam width {}".format(num_total / decoding_time, beam_width))
     return rate
 
 #######################
@@ -490,6 +523,10 @@ if __name__ == '__main__':
     test_reader = create_reader(os.path.join(DATA_DIR, TESTING_DATA), False)
     evaluate_decoding(test_reader, model, i2w)
 
+    # same with beam-search decoding
+    test_reader = create_reader(os.path.join(DATA_DIR, TESTING_DATA), False)
+    evaluate_decoding(test_reader, model, i2w, beam_width=5)
+
     # test same metric same as in training on test set
     test_reader = create_reader(os.path.join(DATA_DIR, TESTING_DATA), False)
     evaluate_metric(test_reader, model)
@@ -48,7 +48,7 @@ def sample(root, ix_to_char, vocab_dim, char_to_ix, prime_text='', use_hardmax=T
 
     def sample_word(p):
         if use_hardmax:
-            w = np.argmax(p, axis=2)[0,0]
+            w = np.argmax(p[0])
         else:
             # normalize probabilities then take weighted sample
             p = np.exp(p) / np.sum(np.exp(p))            
@@ -60,14 +60,16 @@ def sample(root, ix_to_char, vocab_dim, char_to_ix, prime_text='', use_hardmax=T
     prime = -1
 
     # start sequence with first input    
-    x = np.zeros((1, vocab_dim), dtype=np.float32)    
     if prime_text != '':
         plen = len(prime_text)
         prime = char_to_ix[prime_text[0]]
     else:
         prime = np.random.choice(range(vocab_dim))
-    x[0, prime] = 1
-    arguments = ([x], [True])
+
+    # the recurrent state is kept between the steps, such that each step only
+    # evaluates the model for one character, which is passed as index
+    state = root.step_state()
+    idx = prime
 
     # setup a list for the output characters and add the initial prime text
     output = []
@@ -75,29 +77,21 @@ def sample(root, ix_to_char, vocab_dim, char_to_ix, prime_text='', use_hardmax=T
     
     # loop through prime text
     for i in range(plen):            
-        p = root.eval(arguments)        
+        p = state.step(np.array([idx]))
         
-        # reset
-        x = np.zeros((1, vocab_dim), dtype=np.float32)
         if i < plen-1:
             idx = char_to_ix[prime_text[i+1]]
         else:
             idx = sample_word(p)
 
         output.append(idx)
-        x[0, idx] = 1            
-        arguments = ([x], [False])
     
     # loop through length of generated text, sampling along the way
     for i in range(length-plen):
-        p = root.eval(arguments)
+        p = state.step(np.array([idx]))
         idx = sample_word(p)
         output.append(idx)
 
-        x = np.zeros((1, vocab_dim), dtype=np.float32)
-        x[0, idx] = 1
-        arguments = ([x], [False])
-
     # return output
     return ''.join([ix_to_char[c] for c in output])
 
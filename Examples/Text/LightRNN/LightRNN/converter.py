@@ -11,6 +11,7 @@ from random import shuffle
 import glob
 import operator
 import codecs
+import numpy as np
 
 TEXT_ENCODING = 'utf-8'
 UNK = '<unk>'
@@ -40,6 +41,20 @@ def load_vocab_location_from_file(location_file):
     return location
 
 
+def load_vocab_location_array_from_file(location_file, vocab_size):
+    # Load vocabulary table location from file as array of shape (vocab_size, 2),
+    # i.e. the (row, col) of every word, -1 for words without location
+    with codecs.open(location_file, 'r', encoding=TEXT_ENCODING) as input_file:
+        table = [list(map(int, row.split())) for row in input_file]
+    location = np.full((vocab_size, 2), -1, dtype=np.int32)
+    for row_id, cols in enumerate(table):
+        cols = np.array(cols, dtype=np.int64)
+        col_ids = np.flatnonzero(cols != -1)
+        location[cols[col_ids], 0] = row_id
+        location[cols[col_ids], 1] = col_ids
+    return location
+
+
 def read_line(line, word_count):
     # Count word and frequency by one line
     words = line.split()
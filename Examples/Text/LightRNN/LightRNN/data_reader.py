@@ -12,10 +12,14 @@ import os
 from cntk.io import UserMinibatchSource, StreamInformation, MinibatchData
 from math import ceil, sqrt
 from converter import load_vocab_location_from_file, load_vocab_from_file
+from converter import load_vocab_location_array_from_file
 
 TEXT_ENCODING = 'utf-8'
 UNK = '<unk>'
 
+# the number of lines that are tokenized before the ids are written to the id file
+TOKENIZE_LINES_PER_CHUNK = 10000
+
 
 # a file reader can generate the feature-to-label
 class FileReader(object):
@@ -62,15 +66,58 @@ class FileReader(object):
                 return False
 
 
+# Converts the text file into the id stream of the (feature, label) pairs of FileReader.generator,
+# an int32 array of shape (num_pairs, 2) that is saved to ids_path
+def tokenize_file(path, word_index, ids_path):
+    unk_id = word_index[UNK]
+    # several processes may tokenize the same file at once
+    tmp_path = '%s.%d.tmp' % (ids_path, os.getpid())
+    with codecs.open(path, 'r', encoding=TEXT_ENCODING) as input_file, open(tmp_path, 'wb') as ids_file:
+        chunk = []
+        for line_id, line in enumerate(input_file):
+            word_ids = [word_index.get(word, unk_id) for word in line.split()]
+            chunk.extend(zip(word_ids[:-1], word_ids[1:]))
+            if (line_id + 1) % TOKENIZE_LINES_PER_CHUNK == 0:
+                ids_file.write(np.array(chunk, dtype=np.int32).tobytes())
+                chunk = []
+        ids_file.write(np.array(chunk, dtype=np.int32).tobytes())
+    if hasattr(os, 'replace'):
+        os.replace(tmp_path, ids_path)
+    else:
+        os.rename(tmp_path, ids_path)
+
+
+# Returns the id stream of the text file (see tokenize_file) as memory mapped array. The text file is
+# tokenized once, the id file is reused as long as it is newer than the text file and the vocabulary.
+def load_token_pairs(path, word_config, word_index):
+    ids_path = path + '.ids'
+    source_time = max(os.path.getmtime(path), os.path.getmtime(word_config))
+    if not os.path.exists(ids_path) or os.path.getmtime(ids_path) < source_time:
+        tokenize_file(path, word_index, ids_path)
+    num_pairs = os.path.getsize(ids_path) // (2 * np.dtype(np.int32).itemsize)
+    if num_pairs == 0:  # an empty file cannot be memory mapped
+        return np.zeros((0, 2), dtype=np.int32)
+    return np.memmap(ids_path, dtype=np.int32, mode='r', shape=(num_pairs, 2))
+
+
 # Provides a override-MinibatchSource for parsing the text to a stream-to-data mapping
+# If use_id_stream is True, the text is read from the memory mapped id stream of load_token_pairs, and
+# the minibatches are made by array operations. Otherwise the text file is read word by word with FileReader.
 class DataSource(UserMinibatchSource):
 
-    def __init__(self, path, word_config, location_config, seqlength, batchsize):
+    def __init__(self, path, word_config, location_config, seqlength, batchsize, use_id_stream=True):
         self.word_index = load_vocab_from_file(word_config)
-        self.word_position = load_vocab_location_from_file(location_config)
         self.vocab_dim = len(self.word_index)
         self.vocab_base = int(ceil(sqrt(self.vocab_dim)))
-        self.reader = FileReader(path)
+        self.use_id_stream = use_id_stream
+        if use_id_stream:
+            self.word_position = load_vocab_location_array_from_file(location_config, self.vocab_dim)
+            self.pairs = load_token_pairs(path, word_config, self.word_index)
+            self.pair_id = 0
+        else:
+            self.word_position = load_vocab_location_from_file(location_config)
+            self.reader = FileReader(path)
+            self.lookahead = []
         self.seqlength = seqlength
         self.batchsize = batchsize
         
@@ -117,32 +164,87 @@ class DataSource(UserMinibatchSource):
             cntk.Value(batch=np.asarray(transform(word1, True), dtype=np.float32)), \
             cntk.Value(batch=np.asarray(transform(word2, True), dtype=np.float32))
 
-    def next_minibatch(self, num_samples, number_of_workers=1, worker_rank=0, device=None):
-        samples = []
-        sweep_end = False
-        for i in range(num_samples):
+    def make_minibatch_from_ids(self, pairs):
+        # Make the next minibatch from the (feature, label) ids, each stream by one array operation
+        source = np.reshape(pairs[:, 0], (-1, self.seqlength))
+        target = np.reshape(pairs[:, 1], (-1, self.seqlength))
+        source_position = self.word_position[source]
+        target_row = self.word_position[target, 0]
+        # words without location raise a KeyError, like the dict lookup of make_minibatch
+        missing = np.concatenate((source[source_position[:, :, 0] < 0], target[target_row < 0]))
+        if len(missing) > 0:
+            raise KeyError(int(missing[0]))
+        return \
+            cntk.Value.one_hot(batch=source_position[:, :, 0], num_classes=self.vocab_base), \
+            cntk.Value.one_hot(batch=source_position[:, :, 1], num_classes=self.vocab_base), \
+            cntk.Value.one_hot(batch=source_position[:, :, 1], num_classes=self.vocab_base), \
+            cntk.Value.one_hot(batch=target_row, num_classes=self.vocab_base), \
+            cntk.Value(batch=source.astype(np.float32)[:, :, np.newaxis]), \
+            cntk.Value(batch=target.astype(np.float32)[:, :, np.newaxis])
+
+    def next_minibatch_from_ids(self, num_samples, number_of_workers, worker_rank):
+        # Read the next num_samples pairs of the id stream, the sequences are divided into every gpu by offsets
+        start = self.pair_id
+        end = min(start + num_samples, len(self.pairs))
+        if len(self.pairs) - end < number_of_workers * self.seqlength:
+            end = len(self.pairs)
+        sweep_end = end == len(self.pairs)
+        self.pair_id = 0 if sweep_end else end
+
+        num_seq = self.check_num_sequences(end - start, number_of_workers)
+        worker_num_seq = num_seq // number_of_workers
+        first_seq = worker_num_seq * worker_rank
+        last_seq = min(worker_num_seq * (worker_rank + 1), num_seq)
+        pairs = np.asarray(self.pairs[start + first_seq * self.seqlength: start + last_seq * self.seqlength])
+        return self.make_minibatch_from_ids(pairs), len(pairs), sweep_end
+
+    def check_num_sequences(self, sample_count, number_of_workers):
+        # Every worker gets at least one sequence of a minibatch
+        num_seq = sample_count // self.seqlength
+        if num_seq < number_of_workers:
+            raise ValueError('a minibatch of %d words holds %d sequences of length %d, fewer than the %d workers'
+                             % (sample_count, num_seq, self.seqlength, number_of_workers))
+        return num_seq
+
+    def read_samples(self, count):
+        # Read the next count (feature, label) ids with FileReader, fewer at the end of the text
+        samples, self.lookahead = self.lookahead[:count], self.lookahead[count:]
+        while len(samples) < count:
             feature_to_label = self.reader.next()
             if feature_to_label is None:
-                samples = samples[: (len(samples) // self.seqlength) * self.seqlength]
-                self.reader.reset()
-                sweep_end = True
                 break
             feature, label = feature_to_label
-            curr_word = self.parse_word(feature)
-            next_word = self.parse_word(label)
-            samples.append((curr_word, next_word))
-        batchsize = len(samples) / self.seqlength
+            samples.append((self.parse_word(feature), self.parse_word(label)))
+        return samples
+
+    def next_minibatch(self, num_samples, number_of_workers=1, worker_rank=0, device=None):
+        # A minibatch holds num_samples words. If less than a sequence per worker would be left
+        # of the sweep, the rest is added to the minibatch, which ends the sweep.
+        if self.use_id_stream:
+            minibatch, sample_count, sweep_end = self.next_minibatch_from_ids(num_samples, number_of_workers, worker_rank)
+            return self.minibatch_data(minibatch, sample_count, sweep_end)
+
+        samples = self.read_samples(num_samples)
+        rest = self.read_samples(number_of_workers * self.seqlength)
+        sweep_end = len(rest) < number_of_workers * self.seqlength
+        if sweep_end:
+            samples.extend(rest)
+            self.reader.reset()
+        else:
+            self.lookahead = rest
+        batchsize = self.check_num_sequences(len(samples), number_of_workers)
         # Divide batch into every gpu
-        batchrange = list(map(int, [
+        batchrange = [
                 (batchsize // number_of_workers) * worker_rank,
                 min((batchsize // number_of_workers) * (worker_rank + 1), batchsize)
-            ]))
+            ]
 
         samples = samples[batchrange[0] * self.seqlength: batchrange[1] * self.seqlength]
         minibatch = self.make_minibatch(samples)
-        sample_count = len(samples)
-        num_seq = len(minibatch[0])
+        return self.minibatch_data(minibatch, len(samples), sweep_end)
 
+    def minibatch_data(self, minibatch, sample_count, sweep_end):
+        num_seq = len(minibatch[0])
         minibatch = {
             self.input1: MinibatchData(minibatch[0], num_seq, sample_count, sweep_end),
             self.input2: MinibatchData(minibatch[1], num_seq, sample_count, sweep_end),
@@ -0,0 +1,131 @@
+# =============================================================================
+# copyright (c) Microsoft. All rights reserved.
+# Licensed under the MIT license. See LICENSE.md file in the project root
+# for full license information.
+# ==============================================================================
+
+import cntk as C
+import numpy as np
+import multiprocessing
+import os
+import tempfile
+
+from converter import load_vocab_from_file
+from data_reader import DataSource, load_token_pairs
+from multiprocessing.pool import ThreadPool
+
+# The input names of the model, used to find the inputs in a saved model
+ROW_INPUT_NAME = 'row'
+COL_INPUT_NAME = 'col'
+
+
+#############################################
+# accumulate the loss vector of one shard  #
+#############################################
+
+# Add the losses of one minibatch to the loss vectors.
+# The losses of all positions of the same word are summed up at once.
+def accumulate_loss(loss_vector, log_prob, words):
+    order = np.argsort(words, kind='mergesort')
+    sorted_words = words[order]
+    unique_words, starts = np.unique(sorted_words, return_index=True)
+    loss_vector[unique_words] -= np.add.reduceat(log_prob[order], starts, axis=0)
+
+
+# Evaluate the loss vectors of the shard-th of num_shards parts of the data and add them to
+# row_loss_vector and col_loss_vector. The id stream of the source is divided into minibatches of
+# seqlength * batchsize words, of which every num_shards-th minibatch belongs to the shard.
+# the curr row -> the curr col
+# the curr col -> the next row
+def accumulate_loss_vector(model, row_input, col_input, source, num_shards, shard,
+                           row_loss_vector, col_loss_vector):
+    row_loss = C.log(C.softmax(model.outputs[0]))
+    col_loss = C.log(C.softmax(model.outputs[1]))
+    loss = C.combine([row_loss, col_loss])
+
+    minibatch_size = source.seqlength * source.batchsize
+    for start in range(shard * minibatch_size, len(source.pairs), num_shards * minibatch_size):
+        num_samples = min(minibatch_size, len(source.pairs) - start) // source.seqlength * source.seqlength
+        if num_samples == 0:
+            continue
+        pairs = np.asarray(source.pairs[start:start + num_samples])
+        input1, input2 = source.make_minibatch_from_ids(pairs)[:2]
+        result = loss.eval({
+            row_input: input1,
+            col_input: input2,
+        })
+        accumulate_loss(row_loss_vector, np.concatenate(result[loss.outputs[0]]), pairs[:, 0])
+        accumulate_loss(col_loss_vector, np.concatenate(result[loss.outputs[1]]), pairs[:, 1])
+
+
+#####################################
+# sharded evaluation and reduction #
+#####################################
+
+def _shared_array(raw_array, shape):
+    return np.frombuffer(raw_array, dtype=np.float64).reshape(shape)
+
+
+# The worker process: evaluates one shard on the cpu into the shared memory arrays
+def _loss_vector_worker(model_path, path, vocab_file, location_path, seqlength, batchsize,
+                        num_shards, shard, shape, row_raw, col_raw):
+    C.device.try_set_default_device(C.device.cpu())
+    model = C.load_model(model_path)
+    row_input = [arg for arg in model.arguments if arg.name == ROW_INPUT_NAME][0]
+    col_input = [arg for arg in model.arguments if arg.name == COL_INPUT_NAME][0]
+    source = DataSource(path, vocab_file, location_path, seqlength, batchsize)
+    accumulate_loss_vector(model, row_input, col_input, source, num_shards, shard,
+                           _shared_array(row_raw, shape), _shared_array(col_raw, shape))
+
+
+# Sum up the arrays pairwise (a tree of log2(n) levels, the additions of a level run in parallel),
+# the result is stored in arrays[0]
+def tree_reduce(arrays):
+    pool = ThreadPool(max(1, len(arrays) // 2))
+    try:
+        while len(arrays) > 1:
+            pool.map(lambda i: np.add(arrays[i], arrays[i + 1], out=arrays[i]), range(0, len(arrays) - 1, 2))
+            arrays = arrays[::2]
+    finally:
+        pool.close()
+    return arrays[0]
+
+
+# Evaluate the loss vectors in num_processes local worker processes.
+# With several distributed workers (num_ranks > 1), the data is sharded across all processes of all ranks,
+# and the result only covers the shards of this rank.
+# The model is passed to the workers as a file. Each worker accumulates into its own shared memory arrays,
+# which are summed up by a tree reduction.
+# return: row and col loss vector of shape (vocab_size, vocab_base)
+def calculate_loss_vector_parallel(model, path, vocab_file, location_path, seqlength, batchsize,
+                                   vocab_size, vocab_base, num_processes, num_ranks=1, rank=0):
+    shape = (vocab_size, vocab_base)
+    # tokenize the text before the workers read it
+    load_token_pairs(path, vocab_file, load_vocab_from_file(vocab_file))
+
+    model_file, model_path = tempfile.mkstemp(suffix='.dnn')
+    os.close(model_file)
+    model.save(model_path)
+
+    # the worker processes must not inherit the state of the cntk library
+    context = multiprocessing.get_context('spawn') if hasattr(multiprocessing, 'get_context') else multiprocessing
+    row_raws = [context.RawArray('d', vocab_size * vocab_base) for _ in range(num_processes)]
+    col_raws = [context.RawArray('d', vocab_size * vocab_base) for _ in range(num_processes)]
+    workers = [context.Process(target=_loss_vector_worker,
+                               args=(model_path, path, vocab_file, location_path, seqlength, batchsize,
+                                     num_ranks * num_processes, rank * num_processes + i, shape,
+                                     row_raws[i], col_raws[i]))
+               for i in range(num_processes)]
+    try:
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+    finally:
+        os.remove(model_path)
+    if any(worker.exitcode != 0 for worker in workers):
+        raise RuntimeError('A worker process failed to calculate the loss vector')
+
+    row_loss_vector = tree_reduce([_shared_array(raw, shape) for raw in row_raws])
+    col_loss_vector = tree_reduce([_shared_array(raw, shape) for raw in col_raws])
+    return row_loss_vector, col_loss_vector
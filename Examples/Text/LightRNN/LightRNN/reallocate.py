@@ -7,6 +7,7 @@
 
 import time
 import codecs
+import numpy as np
 try:
     import Queue as Q
 except ImportError:
@@ -15,6 +16,9 @@ except ImportError:
 g_vocab_size = 0
 g_vocab_sqrt = 0
 
+# number of words whose losses are sorted at once, which bounds the temporary memory
+SORT_WORDS_PER_CHUNK = 4096
+
 
 class SortNode:
     def __init__(self, sort_id, word_id, value):
@@ -25,6 +29,9 @@ class SortNode:
     def __cmp__(self, other):
         return cmp(self.value, other.value)
 
+    def __lt__(self, other):
+        return self.value < other.value
+
 
 class InsertNode:
     '''
@@ -78,18 +85,140 @@ def save_allocate_word_location(table, vocab, save_path):
     string_path = save_path + '.string'
     with codecs.open(save_path, 'w', 'utf-8') as output_file,\
             codecs.open(string_path, 'w', 'utf-8') as output_string_file:
-        for i in range(g_vocab_sqrt):
-            for j in range(g_vocab_sqrt):
-                if table[i][j] == -1:
-                    output_string_file.write("<null> ")
-                else:
-                    output_string_file.write(vocab[table[i][j]] + " ")
-                output_file.write("%d " % table[i][j])
-            output_string_file.write('\n')
-            output_file.write('\n')
-
-
-def reallocate_table(row, col, vocab_size, vocab_base, save_location_path, word_path):
+        for table_row in table:
+            words = ["<null>" if word_id == -1 else vocab[word_id] for word_id in table_row]
+            output_string_file.write("".join(word + " " for word in words) + '\n')
+            output_file.write("".join("%d " % word_id for word_id in table_row) + '\n')
+
+
+##############################################
+# The allocate algorithm implement by NumPy #
+##############################################
+def sort_locations(loss, chunk_size=SORT_WORDS_PER_CHUNK):
+    '''
+     Sorts the locations (rows or cols) of every word by increasing loss, and computes the
+     priority of every choice in the same way as InsertNode.next_row/next_col, i.e. the
+     mean loss of the locations after the choice.
+     Params:
+        loss       : the loss vector of every word, shape (vocab_size, vocab_base)
+        chunk_size : the number of words that are sorted at once
+     Return:
+        order      : the locations of every word by increasing loss, int32 array (vocab_size, vocab_base)
+        priority   : the priority of every choice, float64 array (vocab_size, vocab_base)
+    '''
+    vocab_size, vocab_base = loss.shape
+    order = np.empty((vocab_size, vocab_base), dtype=np.int32)
+    priority = np.empty((vocab_size, vocab_base), dtype=np.float64)
+    # the number of locations after choice k that the mean is computed of (by InsertNode)
+    divisor = vocab_base - np.arange(vocab_base) - 2
+    for start in range(0, vocab_size, chunk_size):
+        chunk = np.asarray(loss[start:start + chunk_size], dtype=np.float64)
+        chunk_order = np.argsort(chunk, axis=1, kind='mergesort')
+        sorted_loss = chunk[np.arange(len(chunk))[:, np.newaxis], chunk_order]
+        loss_after = np.zeros_like(sorted_loss)
+        loss_after[:, :-1] = sorted_loss[:, :0:-1].cumsum(axis=1)[:, ::-1]
+        order[start:start + chunk_size] = chunk_order
+        priority[start:start + chunk_size] = np.where(divisor > 0, loss_after / np.maximum(divisor, 1), 0)
+    return order, priority
+
+
+def assign_greedy(order, priority, capacity, offset=None):
+    '''
+     Assigns every word to one of its locations in rounds. In every round, each unassigned word
+     proposes its next location. A location accepts the proposals with the highest priority
+     up to its free capacity (on ties, lower word ids first), the other words move on to their
+     next location. As the priority of a choice is the mean loss of the locations after it, a
+     word whose remaining locations have a high mean loss is preferred over a word that loses
+     little by moving on. This is the reverse of the queue based algorithm, whose priority queue
+     takes the lowest value first, and all proposals of a round are resolved at once.
+     Params:
+        order    : the locations of every word by preference, shape (num_words, vocab_base)
+        priority : the priority of every choice, shape (num_words, vocab_base)
+        capacity : the number of words that fit into each location
+        offset   : added to the locations of every word, e.g. to distinguish the cols of different rows
+     Return:
+        the location (plus offset) of every word
+    '''
+    num_words, num_choices = order.shape
+    capacity = np.array(capacity, dtype=np.int64)
+    choice = np.zeros(num_words, dtype=np.int64)
+    location = np.full(num_words, -1, dtype=np.int64)
+    pending = np.arange(num_words)
+    while len(pending) > 0:
+        pending_choice = choice[pending]
+        if pending_choice.max() >= num_choices:
+            raise ValueError('the locations cannot hold all words')
+        proposal = order[pending, pending_choice].astype(np.int64)
+        if offset is not None:
+            proposal += offset[pending]
+
+        # rank the proposals for each location by decreasing priority
+        proposal_order = np.lexsort((pending, -priority[pending, pending_choice], proposal))
+        sorted_proposal = proposal[proposal_order]
+        rank = np.arange(len(pending)) - np.searchsorted(sorted_proposal, sorted_proposal)
+        accepted = np.zeros(len(pending), dtype=np.bool_)
+        accepted[proposal_order] = rank < capacity[sorted_proposal]
+
+        location[pending[accepted]] = proposal[accepted]
+        capacity -= np.bincount(proposal[accepted], minlength=len(capacity))
+        pending = pending[~accepted]
+        choice[pending] += 1
+    return location
+
+
+def assign_exact(row, col, vocab_base):
+    '''
+     Assigns every word to a location (row, col) such that the sum of the row and col losses of
+     all words is minimal (min-cost assignment). Needs scipy and memory for a matrix of
+     vocab_size * vocab_base * vocab_base losses, so it is only suited for small vocabularies.
+     Return:
+        the location (row * vocab_base + col) of every word
+    '''
+    try:
+        from scipy.optimize import linear_sum_assignment
+    except ImportError:
+        raise ImportError('The exact word allocation requires scipy, please install it or use the greedy allocation.')
+    row = np.asarray(row, dtype=np.float64)
+    col = np.asarray(col, dtype=np.float64)
+    cost = (row[:, :, np.newaxis] + col[:, np.newaxis, :]).reshape((len(row), vocab_base * vocab_base))
+    word_ids, location = linear_sum_assignment(cost)
+    return location[np.argsort(word_ids)]
+
+
+def allocate_table_numpy(row, col, vocab_size, vocab_base, exact=False):
+    '''
+     Computes the word table from the loss vectors. Like the queue based algorithm, the greedy
+     allocation first assigns a row to every word and then a col within its row. Where several
+     words want the same location, it takes the words whose remaining locations have the highest
+     mean loss first (see assign_greedy), while the queue takes the lowest first.
+     Params:
+        row        : the loss vector of row, shape (vocab_size, vocab_base)
+        col        : the loss vector of col, shape (vocab_size, vocab_base)
+        vocab_size : the size of vocabulary
+        vocab_base : the sqrt of vocabuary size
+        exact      : whether to compute the min-cost assignment (see assign_exact)
+     Return:
+        the word table of shape (vocab_base, vocab_base), -1 for the empty locations
+    '''
+    row = np.asarray(row)[:vocab_size]
+    col = np.asarray(col)[:vocab_size]
+    if exact:
+        location = assign_exact(row, col, vocab_base)
+    else:
+        print("Start to assign row for every word")
+        row_order, row_priority = sort_locations(row)
+        word_row = assign_greedy(row_order, row_priority, np.full(vocab_base, vocab_base))
+        del row_order, row_priority
+        print("Start to assign col for every word")
+        col_order, col_priority = sort_locations(col)
+        location = assign_greedy(col_order, col_priority, np.ones(vocab_base * vocab_base),
+                                 offset=word_row * vocab_base)
+    table = np.full(vocab_base * vocab_base, -1, dtype=np.int64)
+    table[location] = np.arange(vocab_size)
+    return table.reshape((vocab_base, vocab_base))
+
+
+def reallocate_table(row, col, vocab_size, vocab_base, save_location_path, word_path, method='greedy'):
     '''
      The allocate algorithm implement by python
      Params:
@@ -100,7 +229,17 @@ def reallocate_table(row, col, vocab_size, vocab_base, save_location_path, word_
         save_location_path : the path of next word location, the reallocated table will be saved
                                into this path
         word_path          : the path of word table
+        method             : 'greedy' or 'exact' for allocate_table_numpy, 'queue' for the
+                               allocation with a priority queue (one word at a time)
     '''
+    if method != 'queue':
+        start = time.time()
+        table = allocate_table_numpy(row, col, vocab_size, vocab_base, exact=(method == 'exact'))
+        vocab = get_word_location(word_path)
+        save_allocate_word_location(table.tolist(), vocab, save_location_path)
+        print("Reallocate word location cost {} seconds".format((time.time() - start)))
+        return
+
     start = time.time()
     global g_vocab_size
     global g_vocab_sqrt
@@ -24,6 +24,8 @@ from functools import reduce
 from operator import add
 from ctypes import c_double, create_string_buffer
 from reallocate import reallocate_table
+from loss_vector import accumulate_loss_vector, calculate_loss_vector_parallel
+from loss_vector import ROW_INPUT_NAME, COL_INPUT_NAME
 
 
 parser = argparse.ArgumentParser(description="Language Model with LightRNN")
@@ -77,6 +79,11 @@ parser.add_argument('-freq', '--freq', default=100, type=int,
                     help='The frequency of the print progress')
 parser.add_argument('-save', '--save', default='model.dnn', type=str,
                     help='The save prefix')
+parser.add_argument('-loss_workers', '--loss_workers', default=1, type=int,
+                    help='The number of local processes that calculate the loss vector for the word allocation')
+parser.add_argument('-alloc_method', '--alloc_method', default='greedy', choices=['greedy', 'exact', 'dll', 'queue'],
+                    help='The word allocate algorithm: greedy or exact (min-cost) by NumPy, '
+                         'the C++ dynamic library, or the priority queue by Python')
 
 opt = parser.parse_args()
 print(opt)
@@ -103,7 +110,8 @@ def get_k_round_location_path(k):
 # Word allocate algorithm #
 ###########################
 
-# The word allocate algorithm which implement by c++ to speed up
+# The word allocate algorithm, by NumPy (see reallocate.allocate_table_numpy)
+# or by the c++ dynamic library (-alloc_method dll)
 # Params:
 #   row: row loss vector
 #   col: col loss vector
@@ -112,6 +120,9 @@ def get_k_round_location_path(k):
 #   word_path: the vocab file
 #   save_location_path: the new location save path
 def allocate_table(row, col, vocab_size, vocab_base, word_path, save_location_path):
+    if opt.alloc_method != 'dll':
+        reallocate_table(row, col, vocab_size, vocab_base, save_location_path, word_path, method=opt.alloc_method)
+        return
     if platform.system() == 'Linux':
         dll_name = 'libpyreallocate.so'
     else:
@@ -119,7 +130,7 @@ def allocate_table(row, col, vocab_size, vocab_base, word_path, save_location_pa
     path_dir = os.path.split(os.path.realpath(__file__))[0]
     dll_path = os.path.join(path_dir, dll_name)
     if not os.path.exists(dll_path):
-        print('Use a slower implementation.')
+        print('The dynamic library is not found, use the NumPy implementation.')
         reallocate_table(row, col, vocab_size, vocab_base, save_location_path, word_path)
         return
     lib = ctypes.cdll.LoadLibrary(dll_path)
@@ -139,8 +150,8 @@ def allocate_table(row, col, vocab_size, vocab_base, word_path, save_location_pa
 ##########################
 
 def create_model(input_dim):
-    row = sequence.input_variable(shape=input_dim)
-    col = sequence.input_variable(shape=input_dim)
+    row = sequence.input_variable(shape=input_dim, name=ROW_INPUT_NAME)
+    col = sequence.input_variable(shape=input_dim, name=COL_INPUT_NAME)
     rowh = Sequential([Embedding(opt.embed), Stabilizer(), Dropout(opt.dropout)])(row)
     colh = Sequential([Embedding(opt.embed), Stabilizer(), Dropout(opt.dropout)])(col)
 
@@ -232,41 +243,23 @@ def evaluate(network, path, location_path):
 # calcuate the loss vector #
 ############################
 
-# evaluate the loss vector from train data
+# evaluate the loss vector from train data, either in this process or,
+# if opt.loss_workers > 1, in several local processes (see loss_vector.py)
+# the data is sharded across the distributed workers
 # return row and col probability distribution on location
 def calculate_loss_vector(network, path, location_path, communicator):
-    source = DataSource(path, opt.vocab_file, location_path,
-                        opt.seqlength, opt.batchsize)
-    # the curr row -> the curr col
-    # the curr col -> the next row
-    row_loss = C.log(C.softmax(network['model'].outputs[0]))
-    col_loss = C.log(C.softmax(network['model'].outputs[1]))
-    loss = C.combine([row_loss, col_loss])
-    row_loss_vector = np.zeros((opt.vocabsize, vocab_sqrt))
-    col_loss_vector = np.zeros((opt.vocabsize, vocab_sqrt))
-
-    flag = True
-    while flag:
-        mb = source.next_minibatch(opt.seqlength * opt.batchsize * Communicator.num_workers(),
-                                   Communicator.num_workers(),
-                                   communicator.rank())
-        result = loss.eval({
-            network['row']: mb[source.input1],
-            network['col']: mb[source.input2],
-        })
-        row_prob = result[loss.outputs[0]]
-        col_prob = result[loss.outputs[1]]
-        label1 = mb[source.word1].asarray()
-        label2 = mb[source.word2].asarray()
-        sequences = len(label1)
-        for i in range(sequences):
-            seqlength = len(row_prob[i])
-            for j in range(seqlength):
-                row_word = int(label1[i][j][0])
-                col_word = int(label2[i][j][0])
-                row_loss_vector[row_word] -= row_prob[i][j]
-                col_loss_vector[col_word] -= col_prob[i][j]
-        flag = not mb[source.input1].sweep_end
+    if opt.loss_workers > 1:
+        row_loss_vector, col_loss_vector = calculate_loss_vector_parallel(
+            network['model'], path, opt.vocab_file, location_path, opt.seqlength, opt.batchsize,
+            opt.vocabsize, vocab_sqrt, opt.loss_workers, Communicator.num_workers(), communicator.rank())
+    else:
+        source = DataSource(path, opt.vocab_file, location_path,
+                            opt.seqlength, opt.batchsize)
+        row_loss_vector = np.zeros((opt.vocabsize, vocab_sqrt))
+        col_loss_vector = np.zeros((opt.vocabsize, vocab_sqrt))
+        accumulate_loss_vector(network['model'], network['row'], network['col'], source,
+                               Communicator.num_workers(), communicator.rank(),
+                               row_loss_vector, col_loss_vector)
     return col_loss_vector, row_loss_vector
 
 
@@ -332,17 +325,15 @@ def train(network, location_path, id):
     if Communicator.num_workers() > 1:
         try:
             from mpi4py import MPI
-            comm = MPI.COMM_WORLD
+        except ImportError:
+            raise RuntimeError("Please install mpi4py if uses multi gpus!")
+        # sum up the loss vectors of all workers on the main worker (MPI reduces in a tree)
+        comm = MPI.COMM_WORLD
+        for loss_vector in (row_loss, col_loss):
             if communicator.is_main():
-                for i in range(1, Communicator.num_workers()):
-                    row_loss_i, col_loss_i = comm.recv(source=i)
-                    row_loss += row_loss_i
-                    col_loss += col_loss_i
+                comm.Reduce(MPI.IN_PLACE, loss_vector, op=MPI.SUM, root=0)
             else:
-                data_send = [row_loss, col_loss]
-                comm.send(data_send, 0)
-        except:
-            raise RuntimeError("Please install mpi4py if uses multi gpus!")
+                comm.Reduce(loss_vector, None, op=MPI.SUM, root=0)
         communicator.barrier()
     if communicator.is_main():
         allocate_table(row_loss, col_loss,
@@ -4,8 +4,20 @@
 # for full license information.
 # ==============================================================================
 
+import os
+import sys
+import threading
+import numpy as np
 import cntk as C
 
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+# Number of lines that are tokenized before the ids are written to the id file
+TOKENIZE_LINES_PER_CHUNK = 10000
+
 # Read the mapping of tokens to ids from a file (tab separated)
 def load_token_to_id(token_to_id_file_path):
     token_to_id = {}
@@ -17,14 +29,125 @@ def load_token_to_id(token_to_id_file_path):
 
     return token_to_id
 
+# Replaces dst by src (os.replace is not available in Python 2)
+def _replace(src, dst):
+    if os.path.exists(dst):
+        os.remove(dst)
+    os.rename(src, dst)
+
+# Converts a text file into a file of token ids (int32) and an index of the line offsets (int64, one more than lines).
+# The ids of line i are ids[offsets[i] : offsets[i+1]]. Both files are written to temporary files first, such that
+# an interrupted run does not leave an incomplete index behind.
+def tokenize_file(input_text_path, token_to_id, ids_path, offsets_path):
+    offsets = [0]
+    with open(input_text_path) as text_file, open(ids_path + '.tmp', 'wb') as ids_file:
+        chunk = []
+        num_written = 0
+        for line_number, line in enumerate(text_file):
+            for token in line.split():
+                if not token in token_to_id:
+                    raise ValueError("while reading file '%s' line %d: token without id: %s" % (input_text_path, line_number + 1, token))
+                chunk.append(token_to_id[token])
+            offsets.append(num_written + len(chunk))
+            if len(offsets) % TOKENIZE_LINES_PER_CHUNK == 0:
+                ids_file.write(np.array(chunk, dtype=np.int32).tobytes())
+                num_written += len(chunk)
+                chunk = []
+        ids_file.write(np.array(chunk, dtype=np.int32).tobytes())
+    with open(offsets_path + '.tmp', 'wb') as offsets_file:
+        np.save(offsets_file, np.array(offsets, dtype=np.int64))
+    _replace(offsets_path + '.tmp', offsets_path)
+    _replace(ids_path + '.tmp', ids_path)
+
+# Groups consecutive lines into sequences in the same way as DataReader.minibatch_generator: a sequence starts with
+# the segment separator and is extended by full lines until it has at least sequence_length tokens. Lines at the end
+# of the file that do not complete a sequence are dropped.
+# Returns the offsets of the first and behind the last token id of each sequence (without the separator).
+def group_lines_into_sequences(offsets, sequence_length):
+    starts = []
+    ends = []
+    start = None
+    for line_start, line_end in zip(offsets[:-1].tolist(), offsets[1:].tolist()):
+        if start is None:
+            start = line_start
+        if 1 + line_end - start >= sequence_length:
+            starts.append(start)
+            ends.append(line_end)
+            start = None
+    return np.array(starts, dtype=np.int64), np.array(ends, dtype=np.int64)
+
+# Splits the sequences into minibatches of sequences with similar length, such that little padding is needed.
+# The sequences are divided into buckets of batches_per_bucket minibatches (in the given order), which are sorted by
+# length and cut into minibatches. If rng is given, the sequences and the order of the minibatches are shuffled.
+# Returns a list of arrays of sequence indices.
+def make_bucketed_batches(sequence_lengths, sequences_per_batch, batches_per_bucket, rng=None):
+    num_sequences = len(sequence_lengths)
+    order = rng.permutation(num_sequences) if rng is not None else np.arange(num_sequences)
+    bucket_size = sequences_per_batch * batches_per_bucket
+    batches = []
+    for bucket_start in range(0, num_sequences, bucket_size):
+        bucket = order[bucket_start : bucket_start + bucket_size]
+        bucket = bucket[np.argsort(sequence_lengths[bucket], kind='mergesort')]
+        batches.extend(bucket[i : i + sequences_per_batch] for i in range(0, len(bucket), sequences_per_batch))
+    if rng is not None:
+        batches = [batches[i] for i in rng.permutation(len(batches))]
+    return batches
+
+# Calls create(item) for all items on a background thread and yields the results in order. At most prefetch results
+# are created ahead of the consumer. Exceptions are raised in the consumer. Closing the generator stops the thread.
+def prefetch_generator(create, items, prefetch):
+    if prefetch <= 0:
+        for item in items:
+            yield create(item)
+        return
+
+    results = queue.Queue(maxsize=prefetch)
+    stop = threading.Event()
+
+    def put(entry):
+        while not stop.is_set():
+            try:
+                results.put(entry, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce():
+        try:
+            for item in items:
+                if not put((create(item), None)):
+                    return
+        except Exception as e:
+            put((None, e))
+            return
+        put((None, None))
+
+    thread = threading.Thread(target=produce)
+    thread.daemon = True
+    thread.start()
+    try:
+        while True:
+            result, error = results.get()
+            if error is not None:
+                raise error
+            if result is None:
+                return
+            yield result
+    finally:
+        stop.set()
+        thread.join()
+
 # Provides functionality for reading text file and converting them to mini-batches using a token-to-id mapping from a file.
 class DataReader(object):
     def __init__(
         self,
         token_to_id_path,        # file mapping tokens to ids (format: token tab idtokens_per_sequence, sequences_per_minibatch):
-        segment_sepparator_token # segment separator
+        segment_sepparator_token,# segment separator
+        cache_dir = None         # directory for the token id files created by bucketed_minibatch_generator (default: next to the text files)
                 ):
         self.token_to_id_path = token_to_id_path
+        self.cache_dir = cache_dir
         self.token_to_id = load_token_to_id(token_to_id_path)
         self.vocab_dim = len(self.token_to_id)
 
@@ -80,13 +203,71 @@ class DataReader(object):
             if len(feature_sequences) > 0:
                 yield C.Value.one_hot(feature_sequences, self.vocab_dim), C.Value.one_hot(label_sequences, self.vocab_dim), token_count
 
-def get_count_data():
+    # Returns the token ids of a text file as memory mapped int32 array together with the offsets of its lines.
+    # The text file is tokenized only once, the ids are reused as long as they are newer than the text file and the token-to-id mapping.
+    def load_token_ids(self, input_text_path):
+        cache_dir = self.cache_dir if self.cache_dir is not None else os.path.dirname(os.path.abspath(input_text_path))
+        ids_path = os.path.join(cache_dir, os.path.basename(input_text_path) + '.ids')
+        offsets_path = ids_path + '.offsets.npy'
+
+        source_time = max(os.path.getmtime(input_text_path), os.path.getmtime(self.token_to_id_path))
+        if not (os.path.exists(ids_path) and os.path.exists(offsets_path) and os.path.getmtime(ids_path) >= source_time):
+            tokenize_file(input_text_path, self.token_to_id, ids_path, offsets_path)
+
+        offsets = np.load(offsets_path)
+        if offsets[-1] == 0: # an empty file cannot be memory mapped
+            return np.zeros(0, dtype=np.int32), offsets
+        return np.memmap(ids_path, dtype=np.int32, mode='r', shape=(int(offsets[-1]),)), offsets
+
+    # Creates a generator that returns the same sequences as minibatch_generator, but
+    #  - reads the token ids from the memory mapped id file created by load_token_ids instead of tokenizing the text,
+    #  - puts sequences of similar length into the same minibatch (see make_bucketed_batches),
+    #  - creates the one-hot values of the next minibatches on a background thread while the current one is used,
+    #  - optionally returns only the minibatches of one of num_workers workers (e.g. for distributed training).
+    #    All workers get the same number of minibatches, the remaining minibatches are dropped.
+    def bucketed_minibatch_generator(
+        self,
+        input_text_path,        # Path to text file (train, test or validation data).
+        sequence_length,        # Minimal sequence length
+        sequences_per_batch,    # Number of sequences per batch
+        batches_per_bucket = 50,# Number of minibatches whose sequences are sorted by length together
+        randomize = False,      # Whether to shuffle the sequences and the order of the minibatches
+        seed = None,            # Random seed (if randomize is True), required if there are several workers
+        num_workers = 1,        # Number of workers that read disjoint sets of minibatches
+        worker_rank = 0,        # Index of this worker
+        prefetch = 2            # Number of minibatches prepared ahead (0: no background thread)
+                            ):
+        # all workers must shuffle in the same way, otherwise their minibatches are not disjoint
+        if randomize and num_workers > 1 and seed is None:
+            raise ValueError('a seed is required to randomize the minibatches of several workers')
+
+        ids, offsets = self.load_token_ids(input_text_path)
+        starts, ends = group_lines_into_sequences(offsets, sequence_length)
+
+        rng = np.random.RandomState(seed) if randomize else None
+        batches = make_bucketed_batches(ends - starts, sequences_per_batch, batches_per_bucket, rng)
+        if num_workers > 1:
+            batches = batches[ : len(batches) // num_workers * num_workers][worker_rank :: num_workers]
+
+        def create_minibatch(batch):
+            # We prepend a segment separator before the feature segments
+            sequences = [np.concatenate(([self.segment_sepparator_id], ids[start : end]))
+                         for start, end in zip(starts[batch].tolist(), ends[batch].tolist())]
+            feature_sequences = [sequence[ : -1] for sequence in sequences]
+            label_sequences = [sequence[1 : ] for sequence in sequences]
+            token_count = int(np.sum(ends[batch] - starts[batch]))
+            return C.Value.one_hot(feature_sequences, self.vocab_dim), C.Value.one_hot(label_sequences, self.vocab_dim), token_count
+
+        return prefetch_generator(create_minibatch, batches, prefetch)
+
+def get_count_data(bucketed=False):
     data_reader = DataReader('./ptb/token2id.txt', '<eos>')
 
     print('vocab_dim = ' + str(data_reader.vocab_dim))
 
+    generator = data_reader.bucketed_minibatch_generator if bucketed else data_reader.minibatch_generator
     count=0
-    for a,b,c in data_reader.minibatch_generator('./ptb/train.txt', 1, 20):
+    for a,b,c in generator('./ptb/train.txt', 1, 20):
         count += 1
     return count
 
@@ -42,6 +42,9 @@ train_file_path         = './ptb/train.txt'
 token_frequencies_file_path = './ptb/freq.txt'
 segment_sepparator = '<eos>'
 num_samples_between_progress_report = 100000
+batches_per_bucket = 50 # number of minibatches whose sequences are sorted by length together
+reader_prefetch = 2     # number of minibatches the reader prepares ahead on a background thread
+token_id_cache_dir = None # directory of the token id files (default: next to the text files)
 
 
 # reads a file with one number per line and returns the numbers as a list
@@ -125,7 +128,8 @@ def cross_entropy_with_sampled_softmax(
 def average_cross_entropy(full_cross_entropy_node, input_node, label_node, data):
     count = 0
     ce_sum = 0
-    for features, labels, _ in data.minibatch_generator(validation_file_path, sequence_length, sequences_per_batch):
+    for features, labels, _ in data.bucketed_minibatch_generator(validation_file_path, sequence_length, sequences_per_batch,
+                                                                 batches_per_bucket=batches_per_bucket, prefetch=reader_prefetch):
         arguments = ({input_node : features, label_node : labels})
         full_cross_entropy = full_cross_entropy_node.eval(arguments)
         for ce_list in full_cross_entropy:
@@ -174,7 +178,7 @@ def print_progress(samples_per_second, average_full_ce, total_samples, total_tim
 
 # Creates and trains an rnn language model.
 def train_lm(testing=False):
-    data = DataReader(token_to_id_path, segment_sepparator)
+    data = DataReader(token_to_id_path, segment_sepparator, token_id_cache_dir)
 
     # Create model nodes for the source and target inputs
     input_sequence, label_sequence = create_inputs(data.vocab_dim)
@@ -206,7 +210,8 @@ def train_lm(testing=False):
 
     last_avg_ce = 0
     for epoch_count in range(num_epochs):
-        for features, labels, token_count in data.minibatch_generator(train_file_path, sequence_length, sequences_per_batch):
+        for features, labels, token_count in data.bucketed_minibatch_generator(train_file_path, sequence_length, sequences_per_batch,
+                                                                               batches_per_bucket=batches_per_bucket, prefetch=reader_prefetch):
             arguments = ({input_sequence : features, label_sequence : labels})
 
             t_start = timeit.default_timer()
@@ -8,8 +8,10 @@ from __future__ import print_function
 import sys
 import os
 import csv
+import collections
+import multiprocessing
+import argparse
 import numpy as np
-from random import randint
 
 from PIL import Image
 import imageio
@@ -23,6 +25,134 @@ abs_path   = os.path.dirname(os.path.abspath(__file__))
 data_path  = os.path.join(abs_path, "..", "..", "DataSets", "UCF11")
 model_path = os.path.join(abs_path, "Models")
 
+# Size to which the frames are resized before cropping (c3d_video.pdf)
+RESIZED_WIDTH  = 171
+RESIZED_HEIGHT = 128
+
+# Number of clips that are decoded ahead of the training loop per worker process
+PREFETCH_CLIPS_PER_WORKER = 4
+
+def select_frame_indices(num_frames, sequence_length, start_fraction, video_file):
+    '''
+    Select which frames of a video of num_frames frames form the sequence. Every
+    second frame is used if the video is long enough. The sequence starts at
+    start_fraction of the possible start frames, or in the middle of the video
+    if start_fraction is None.
+    '''
+    if sequence_length > num_frames:
+        raise ValueError('Sequence length {} is larger then the total number of frames {} in {}.'.format(sequence_length, num_frames, video_file))
+
+    step = 1
+    expanded_sequence = sequence_length
+    if num_frames > 2*sequence_length:
+        step = 2
+        expanded_sequence = 2*sequence_length
+
+    seq_start = int(num_frames/2) - int(expanded_sequence/2)
+    if start_fraction is not None:
+        seq_start = int(start_fraction * (num_frames - expanded_sequence + 1))
+
+    return [seq_start + step*i for i in range(sequence_length)]
+
+def resize_frame(data):
+    '''
+    Resize a frame to fit into 128x171 (keeping the aspect ratio).
+    '''
+    image = Image.fromarray(data)
+    image.thumbnail((RESIZED_WIDTH, RESIZED_HEIGHT), Image.ANTIALIAS)
+    return np.array(image, dtype=np.uint8)
+
+def load_resized_video(video_file, cache_file):
+    '''
+    Return all frames of video_file resized by resize_frame as memory mapped
+    uint8 array of shape (frames, height, width, channels), and the number of
+    frames the video reader reports, which is estimated from the container and
+    can differ from the number of decoded frames. The frames are decoded once and
+    cached in cache_file, the number of frames in <cache_file>.frames. Both are
+    reused as long as they are newer than the video.
+    '''
+    count_file = cache_file + '.frames'
+    video_time = os.path.getmtime(video_file)
+    if not all(os.path.exists(f) and os.path.getmtime(f) >= video_time for f in [cache_file, count_file]):
+        video_reader = imageio.get_reader(video_file, 'ffmpeg')
+        try:
+            num_frames = len(video_reader)
+            frames = np.stack([resize_frame(data) for data in video_reader])
+        finally:
+            video_reader.close()
+
+        # Write to temporary files first, such that an interrupted run does not leave an incomplete cache behind.
+        # The frame count is replaced first, if the frames are not replaced after it, they are decoded again.
+        tmp_file = '{}.{}.tmp'.format(count_file, os.getpid())
+        with open(tmp_file, 'w') as f:
+            f.write(str(num_frames))
+        replace_file(tmp_file, count_file)
+        tmp_file = '{}.{}.tmp.npy'.format(cache_file, os.getpid())
+        np.save(tmp_file, frames)
+        replace_file(tmp_file, cache_file)
+
+    with open(count_file) as f:
+        num_frames = int(f.read())
+    return np.load(cache_file, mmap_mode='r'), num_frames
+
+def replace_file(src, dst):
+    '''
+    Rename src to dst, replacing an existing dst.
+    '''
+    if os.path.exists(dst):
+        os.remove(dst)
+    os.rename(src, dst)
+
+def read_frames(video_file, cache_file, sequence_length, start_fraction):
+    '''
+    Read the resized frames of the sequence as uint8 array of shape
+    (sequence_length, height, width, channels), either from the cache or by
+    decoding only the selected frames. In both cases the frames are selected by
+    the number of frames the video reader reports, such that the clip does not
+    depend on the cache.
+    '''
+    if cache_file is not None:
+        frames, num_frames = load_resized_video(video_file, cache_file)
+        return frames[select_frame_indices(num_frames, sequence_length, start_fraction, video_file)]
+
+    video_reader = imageio.get_reader(video_file, 'ffmpeg')
+    try:
+        frame_range = select_frame_indices(len(video_reader), sequence_length, start_fraction, video_file)
+        return np.stack([resize_frame(video_reader.get_data(frame_index)) for frame_index in frame_range])
+    finally:
+        video_reader.close()
+
+def crop_and_normalize(frames, height, width, crop_fractions):
+    '''
+    Select a height x width crop of all frames at once and normalize it to [-1, 1].
+    The crop is centered if crop_fractions is None, otherwise its top left corner is
+    at crop_fractions of the possible offsets.
+
+    Returns the clip as float32 array of shape (channel, sequence, height, width).
+    '''
+    frame_height, frame_width = frames.shape[1:3]
+    if crop_fractions is None:
+        # same offsets as the crop of the centered box by PIL
+        top  = int(round(frame_height / 2.0 - height / 2.0))
+        left = int(round(frame_width  / 2.0 - width  / 2.0))
+    else:
+        top  = int(crop_fractions[0] * (frame_height - height + 1))
+        left = int(crop_fractions[1] * (frame_width  - width  + 1))
+
+    clip = np.array(frames[:, top:top + height, left:left + width, :], dtype=np.float32)
+    clip -= 127.5
+    clip /= 127.5
+
+    # (channel, sequence, height, width)
+    return np.ascontiguousarray(np.transpose(clip, (3, 0, 1, 2)))
+
+def load_clip(video_file, cache_file, sequence_length, height, width, start_fraction, crop_fractions):
+    '''
+    Read and preprocess one clip, this runs in the worker processes of VideoReader.
+    '''
+    frames = read_frames(video_file, cache_file, sequence_length, start_fraction)
+    return crop_and_normalize(frames, height, width, crop_fractions)
+
 # Define the reader for both training and evaluation action.
 class VideoReader(object):
     '''
@@ -30,8 +160,15 @@ class VideoReader(object):
     It iterates through each video and select 16 frames as
     stacked numpy arrays.
     Similar to http://vlg.cs.dartmouth.edu/c3d/c3d_video.pdf
+
+    If num_workers is larger than 0, the clips are decoded by a pool of worker
+    processes ahead of the training loop. If cache_dir is given, the resized
+    frames of each video are cached there (see load_resized_video), such that
+    later epochs only crop and normalize the frames. With random_crop, the
+    training clips are cropped at random positions instead of the center.
     '''
-    def __init__(self, map_file, label_count, is_training, limit_epoch_size=sys.maxsize):
+    def __init__(self, map_file, label_count, is_training, limit_epoch_size=sys.maxsize,
+                 num_workers=0, cache_dir=None, random_crop=False):
         '''
         Load video file paths and their corresponding labels.
         '''
@@ -42,10 +179,15 @@ class VideoReader(object):
         self.sequence_length = 16
         self.channel_count   = 3
         self.is_training     = is_training
+        self.random_crop     = random_crop
+        self.cache_dir       = cache_dir
         self.video_files     = []
         self.targets         = []
         self.batch_start     = 0
 
+        if (self.width >= RESIZED_WIDTH) or (self.height >= RESIZED_HEIGHT):
+            raise ValueError("Target width need to be less than 171 and target height need to be less than 128.")
+
         map_file_dir = os.path.dirname(map_file)
 
         with open(map_file) as csv_file:
@@ -56,11 +198,23 @@ class VideoReader(object):
                 target[int(row[1])] = 1.0
                 self.targets.append(target)
 
+        if cache_dir is not None and not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+
         self.indices = np.arange(len(self.video_files))
         if self.is_training:
             np.random.shuffle(self.indices)
         self.epoch_size = min(len(self.video_files), limit_epoch_size)
 
+        # clips that are being decoded by the workers, in reading order
+        self._pool    = None
+        self._pending = collections.deque()
+        if num_workers > 0:
+            # the worker processes must not inherit the state of the cntk library
+            context = multiprocessing.get_context('spawn') if hasattr(multiprocessing, 'get_context') else multiprocessing
+            self._pool = context.Pool(num_workers)
+        self._prefetch_size = num_workers * PREFETCH_CLIPS_PER_WORKER
+
     def size(self):
         return self.epoch_size
             
@@ -73,6 +227,17 @@ class VideoReader(object):
         if self.is_training:
             np.random.shuffle(self.indices)
         self.batch_start = 0
+        self._pending.clear()
+
+    def close(self):
+        '''
+        Stop the worker processes.
+        '''
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool.join()
+            self._pool = None
+        self._pending.clear()
 
     def next_minibatch(self, batch_size):
         '''
@@ -87,66 +252,72 @@ class VideoReader(object):
         targets = np.empty(shape=(current_batch_size, self.label_count), dtype=np.float32)
         for idx in range(self.batch_start, batch_end):
             index = self.indices[idx]
-            inputs[idx - self.batch_start, :, :, :, :] = self._select_features(self.video_files[index])
+            inputs[idx - self.batch_start, :, :, :, :] = self._next_clip(idx)
             targets[idx - self.batch_start, :]         = self.targets[index]
 
         self.batch_start += current_batch_size
         return inputs, targets, current_batch_size
 
-    def _select_features(self, video_file):
+    def _next_clip(self, idx):
         '''
-        Select a sequence of frames from video_file and return them as
-        a Tensor.
+        Return the clip at position idx of the reading order. Without workers it is
+        read right away, otherwise the clips up to idx + prefetch size are scheduled.
         '''
-        video_reader = imageio.get_reader(video_file, 'ffmpeg')
-        num_frames   = len(video_reader)
-        if self.sequence_length > num_frames:
-            raise ValueError('Sequence length {} is larger then the total number of frames {} in {}.'.format(self.sequence_length, num_frames, video_file))
-
-        # select which sequence frames to use.
-        step = 1
-        expanded_sequence = self.sequence_length
-        if num_frames > 2*self.sequence_length:
-            step = 2
-            expanded_sequence = 2*self.sequence_length
-
-        seq_start = int(num_frames/2) - int(expanded_sequence/2)
-        if self.is_training:
-            seq_start = randint(0, num_frames - expanded_sequence)
-
-        frame_range = [seq_start + step*i for i in range(self.sequence_length)]            
-        video_frames = []
-        for frame_index in frame_range:
-            video_frames.append(self._read_frame(video_reader.get_data(frame_index)))
-        
-        return np.stack(video_frames, axis=1)
-
-    def _read_frame(self, data):
+        if self._pool is None:
+            return load_clip(*self._clip_args(self.indices[idx]))
+
+        if not self._pending or self._pending[0][0] != idx:
+            self._pending.clear()
+        next_idx = self._pending[-1][0] + 1 if self._pending else idx
+        while next_idx < min(idx + self._prefetch_size, self.size()) or next_idx == idx:
+            self._pending.append((next_idx, self._pool.apply_async(load_clip, self._clip_args(self.indices[next_idx]))))
+            next_idx += 1
+        return self._pending.popleft()[1].get()
+
+    def _clip_args(self, index):
         '''
-        Based on http://vlg.cs.dartmouth.edu/c3d/c3d_video.pdf
-        We resize the image to 128x171 first, then selecting a 112x112
-        crop.
+        Arguments of load_clip for the video at index. The random positions are
+        drawn here, such that the clips do not depend on the number of workers.
         '''
-        if (self.width >= 171) or (self.height >= 128):
-            raise ValueError("Target width need to be less than 171 and target height need to be less than 128.")
-        
-        image = Image.fromarray(data)
-        image.thumbnail((171, 128), Image.ANTIALIAS)
-        
-        center_w = image.size[0] / 2
-        center_h = image.size[1] / 2
-
-        image = image.crop((center_w - self.width  / 2,
-                            center_h - self.height / 2,
-                            center_w + self.width  / 2,
-                            center_h + self.height / 2))
-        
-        norm_image = np.array(image, dtype=np.float32)
-        norm_image -= 127.5
-        norm_image /= 127.5
-
-        # (channel, height, width)
-        return np.ascontiguousarray(np.transpose(norm_image, (2, 0, 1)))
+        video_file = self.video_files[index]
+        cache_file = None
+        if self.cache_dir is not None:
+            cache_file = os.path.join(self.cache_dir, '{}_{}.npy'.format(index, os.path.splitext(os.path.basename(video_file))[0]))
+
+        start_fraction = np.random.random_sample() if self.is_training else None
+        crop_fractions = tuple(np.random.random_sample(2)) if self.is_training and self.random_crop else None
+        return video_file, cache_file, self.sequence_length, self.height, self.width, start_fraction, crop_fractions
+
+class VideoMinibatchSource(C.io.UserMinibatchSource):
+    '''
+    Wraps a VideoReader as CNTK minibatch source, e.g. to drive the training by
+    a training session. The reader is reset at the start of each sweep, and a
+    minibatch does not span across sweeps.
+    '''
+    def __init__(self, reader):
+        self.reader = reader
+        self.features_si = C.io.StreamInformation("features", 0, 'dense', np.float32,
+            (reader.channel_count, reader.sequence_length, reader.height, reader.width))
+        self.labels_si   = C.io.StreamInformation("labels", 1, 'dense', np.float32, (reader.label_count,))
+
+        super(VideoMinibatchSource, self).__init__()
+
+    def stream_infos(self):
+        return [self.features_si, self.labels_si]
+
+    def next_minibatch(self, num_samples, number_of_workers=1, worker_rank=0, device=None):
+        if number_of_workers != 1:
+            raise ValueError('distributed reading is not supported by VideoMinibatchSource')
+
+        if not self.reader.has_more():
+            self.reader.reset()
+        videos, labels, current_minibatch = self.reader.next_minibatch(num_samples)
+        sweep_end = not self.reader.has_more()
+
+        return {
+            self.features_si: C.io.MinibatchData(C.Value(batch=videos, device=device), current_minibatch, current_minibatch, sweep_end),
+            self.labels_si:   C.io.MinibatchData(C.Value(batch=labels, device=device), current_minibatch, current_minibatch, sweep_end),
+        }
 
 # Creates and trains a feedforward classification model for UCF11 action videos
 def conv3d_ucf11(train_reader, test_reader, max_epochs=30):
@@ -238,8 +409,20 @@ def conv3d_ucf11(train_reader, test_reader, max_epochs=30):
     return metric_numer/metric_denom
 
 if __name__=='__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-workers', '--workers', help='Number of processes that decode the videos ahead of training (0: no prefetching)', type=int, required=False, default=0)
+    parser.add_argument('-cache_dir', '--cache_dir', help='Directory in which the resized frames of each video are cached', required=False, default=None)
+    parser.add_argument('-random_crop', '--random_crop', help='Crop the training clips at random positions', action='store_true', default=False)
+    args = parser.parse_args()
+
     num_output_classes = 11
-    train_reader = VideoReader(os.path.join(data_path, 'train_map.csv'), num_output_classes, True)
-    test_reader  = VideoReader(os.path.join(data_path, 'test_map.csv'), num_output_classes, False)
-        
-    conv3d_ucf11(train_reader, test_reader)
+    train_reader = VideoReader(os.path.join(data_path, 'train_map.csv'), num_output_classes, True,
+                               num_workers=args.workers, cache_dir=args.cache_dir, random_crop=args.random_crop)
+    test_reader  = VideoReader(os.path.join(data_path, 'test_map.csv'), num_output_classes, False,
+                               num_workers=args.workers, cache_dir=args.cache_dir)
+
+    try:
+        conv3d_ucf11(train_reader, test_reader)
+    finally:
+        train_reader.close()
+        test_reader.close()
@@ -0,0 +1,178 @@
+# Copyright (c) Microsoft. All rights reserved.
+
+# Licensed under the MIT license. See LICENSE.md file in the project root
+# for full license information.
+# ==============================================================================
+
+'''
+Minimal stand-in for the ``benchmark`` fixture of pytest-benchmark, used when
+the plugin is not installed. Only the parts of the API that the benchmarks in
+this directory use are provided. Results are written in the JSON layout of
+pytest-benchmark, so that ``compare_benchmarks.py`` works on both.
+'''
+
+import datetime
+import json
+import math
+import platform
+import subprocess
+from timeit import default_timer as timer
+
+
+def _stats(timings, iterations):
+    timings = sorted(t / iterations for t in timings)
+    n = len(timings)
+    mean = sum(timings) / n
+    stddev = math.sqrt(sum((t - mean) ** 2 for t in timings) / (n - 1)) if n > 1 else 0.0
+
+    def quantile(q):
+        pos = (n - 1) * q
+        lo = int(math.floor(pos))
+        hi = min(lo + 1, n - 1)
+        return timings[lo] + (timings[hi] - timings[lo]) * (pos - lo)
+
+    q1, median, q3 = quantile(0.25), quantile(0.5), quantile(0.75)
+    return {
+        'min': timings[0],
+        'max': timings[-1],
+        'mean': mean,
+        'stddev': stddev,
+        'median': median,
+        'q1': q1,
+        'q3': q3,
+        'iqr': q3 - q1,
+        'rounds': n,
+        'iterations': iterations,
+        'total': sum(timings) * iterations,
+        'ops': 1.0 / mean if mean > 0 else 0.0,
+    }
+
+
+class BenchmarkFixture(object):
+    '''
+    Callable that runs and times a function, like pytest-benchmark's
+    ``benchmark`` fixture.
+
+    Args:
+        name (str): name of the test
+        fullname (str): node id of the test
+        min_time (float): a round is extended to several iterations until it
+         takes at least this long (in seconds)
+        max_time (float): the rounds are repeated until they took this long
+         in total (in seconds)
+        min_rounds (int): minimum number of rounds
+    '''
+
+    def __init__(self, name, fullname, min_time=0.000005, max_time=1.0,
+                 min_rounds=5):
+        self.name = name
+        self.fullname = fullname
+        self.group = None
+        self.extra_info = {}
+        self.stats = None
+        self._min_time = min_time
+        self._max_time = max_time
+        self._min_rounds = min_rounds
+
+    def _calibrate(self, func, args, kwargs):
+        iterations = 1
+        while True:
+            start = timer()
+            for _ in range(iterations):
+                result = func(*args, **kwargs)
+            duration = timer() - start
+            if duration >= self._min_time or iterations >= 1 << 20:
+                return result, iterations, duration
+            iterations *= 10
+
+    def __call__(self, func, *args, **kwargs):
+        if self.stats is not None:
+            raise RuntimeError('the benchmark fixture can only be used once per test')
+
+        result, iterations, duration = self._calibrate(func, args, kwargs)
+        timings = []
+        total = 0.0
+        while len(timings) < self._min_rounds or total < self._max_time:
+            start = timer()
+            for _ in range(iterations):
+                func(*args, **kwargs)
+            duration = timer() - start
+            timings.append(duration)
+            total += duration
+
+        self.stats = _stats(timings, iterations)
+        return result
+
+    def pedantic(self, target, args=(), kwargs=None, setup=None, rounds=1,
+                 iterations=1, warmup_rounds=0):
+        if self.stats is not None:
+            raise RuntimeError('the benchmark fixture can only be used once per test')
+        if setup is not None and iterations > 1:
+            raise ValueError('cannot use setup with more than one iteration')
+
+        kwargs = kwargs or {}
+
+        def run_round():
+            a, kw = args, kwargs
+            if setup is not None:
+                maybe_args = setup()
+                if maybe_args is not None:
+                    a, kw = maybe_args
+            start = timer()
+            for _ in range(iterations):
+                result = target(*a, **kw)
+            return timer() - start, result
+
+        for _ in range(warmup_rounds):
+            run_round()
+
+        timings = []
+        result = None
+        for _ in range(rounds):
+            duration, result = run_round()
+            timings.append(duration)
+
+        self.stats = _stats(timings, iterations)
+        return result
+
+    def as_dict(self):
+        return {
+            'group': self.group,
+            'name': self.name,
+            'fullname': self.fullname,
+            'params': None,
+            'extra_info': self.extra_info,
+            'stats': self.stats,
+        }
+
+
+def _commit_info():
+    try:
+        commit_id = subprocess.check_output(['git', 'rev-parse', 'HEAD'],
+                                            stderr=subprocess.STDOUT)
+        return {'id': commit_id.decode('ascii').strip()}
+    except Exception:
+        return {}
+
+
+def write_json(filename, benchmarks):
+    import cntk
+    import numpy
+    report = {
+        'machine_info': {
+            'node': platform.node(),
+            'processor': platform.processor(),
+            'machine': platform.machine(),
+            'python_version': platform.python_version(),
+            'system': platform.system(),
+            'release': platform.release(),
+            'cntk_version': cntk.__version__,
+            'numpy_version': numpy.version.full_version,
+        },
+        'commit_info': _commit_info(),
+        'benchmarks': benchmarks,
+        'datetime': datetime.datetime.utcnow().isoformat(),
+        'version': 'cntk-fallback',
+    }
+    with open(filename, 'w') as f:
+        json.dump(report, f, indent=4, sort_keys=True)
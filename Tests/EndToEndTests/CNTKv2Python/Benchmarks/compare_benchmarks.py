@@ -0,0 +1,67 @@
+# Copyright (c) Microsoft. All rights reserved.
+
+# Licensed under the MIT license. See LICENSE.md file in the project root
+# for full license information.
+# ==============================================================================
+
+'''
+Compares two JSON benchmark reports (as written by ``--benchmark-json``) and
+reports benchmarks whose median time regressed by more than a threshold.
+
+Usage:
+    python compare_benchmarks.py baseline.json current.json [--threshold 0.1]
+'''
+
+import argparse
+import json
+import sys
+
+
+def load(filename):
+    with open(filename) as f:
+        report = json.load(f)
+    return dict((b['fullname'], b['stats']) for b in report['benchmarks'])
+
+
+def compare(baseline, current, threshold, stat='median'):
+    '''
+    Returns a list of ``(fullname, baseline, current, ratio)`` tuples for all
+    benchmarks present in both reports, and the list of names of those that
+    regressed by more than ``threshold`` (relative).
+    '''
+    rows = []
+    regressions = []
+    for name in sorted(set(baseline) & set(current)):
+        old, new = baseline[name][stat], current[name][stat]
+        ratio = new / old if old > 0 else float('inf')
+        rows.append((name, old, new, ratio))
+        if ratio > 1.0 + threshold:
+            regressions.append(name)
+    return rows, regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('baseline', help='JSON report of the reference run')
+    parser.add_argument('current', help='JSON report of the run to check')
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help='relative slow-down that counts as regression')
+    parser.add_argument('--stat', default='median',
+                        help='statistic to compare (min, median, mean)')
+    args = parser.parse_args()
+
+    baseline, current = load(args.baseline), load(args.current)
+    rows, regressions = compare(baseline, current, args.threshold, args.stat)
+
+    print('%-70s %12s %12s %8s' % ('benchmark', 'baseline us', 'current us', 'ratio'))
+    for name, old, new, ratio in rows:
+        marker = ' <--' if name in regressions else ''
+        print('%-70s %12.2f %12.2f %8.3f%s' % (name, old * 1e6, new * 1e6, ratio, marker))
+
+    for name in sorted(set(baseline) ^ set(current)):
+        print('%s: only in one of the reports' % name)
+
+    if regressions:
+        print('%i benchmark(s) regressed by more than %.0f%%' %
+              (len(regressions), args.threshold * 100))
+        sys.exit(1)
@@ -0,0 +1,115 @@
+# Copyright (c) Microsoft. All rights reserved.
+
+# Licensed under the MIT license. See LICENSE.md file in the project root
+# for full license information.
+# ==============================================================================
+
+import sys
+import pytest
+
+_DEFAULT_DEVICE_ID=-1
+
+import cntk
+import cntk.debugging
+cntk.cntk_py.always_allow_setting_default_device()
+# Checked mode adds validation overhead that we do not want to measure.
+cntk.debugging.set_checked_mode(False)
+
+# The benchmarks are written against the pytest-benchmark fixture API. If the
+# plugin is not installed, we fall back to a minimal implementation of the
+# fixture that writes the same JSON layout (see _benchmark_fallback.py).
+try:
+    import pytest_benchmark
+    _HAS_PYTEST_BENCHMARK = True
+except ImportError:
+    _HAS_PYTEST_BENCHMARK = False
+    from _benchmark_fallback import BenchmarkFixture, write_json
+
+def pytest_addoption(parser):
+    parser.addoption("--deviceid", action="append", default=[_DEFAULT_DEVICE_ID],
+        help="list of device ids to pass to test functions")
+    parser.addoption("--is1bitsgd", default="0",
+                     help="whether 1-bit SGD is used")
+    if not _HAS_PYTEST_BENCHMARK:
+        parser.addoption("--benchmark-json", default=None,
+                         help="file to write the benchmark results to")
+        parser.addoption("--benchmark-min-time", type=float, default=0.000005,
+                         help="minimum time per round in seconds")
+        parser.addoption("--benchmark-max-time", type=float, default=1.0,
+                         help="maximum run time per benchmark in seconds")
+
+DEVICE_MAP = {
+        'auto': 'auto',
+        'cpu': -1,
+        'gpu': 0
+        }
+
+def pytest_generate_tests(metafunc):
+    if 'device_id' in metafunc.fixturenames:
+        if (len(metafunc.config.option.deviceid)) > 1:
+            del metafunc.config.option.deviceid[0]
+
+        devices = set()
+        for elem in metafunc.config.option.deviceid:
+            try:
+                if elem in DEVICE_MAP:
+                    devices.add(DEVICE_MAP[elem])
+                else:
+                    devices.add(int(elem))
+            except ValueError:
+                raise RuntimeError("invalid deviceid value '{0}', please " +
+                    "use integer values or 'auto'".format(elem))
+
+        metafunc.parametrize("device_id", devices, scope='session')
+
+    if 'is_1bit_sgd' in metafunc.fixturenames:
+        if (len(metafunc.config.option.is1bitsgd)) > 1:
+            del metafunc.config.option.is1bitsgd[0]
+
+        is1bitsgd = set()
+        for elem in metafunc.config.option.is1bitsgd:
+            if elem == "0" or elem == "1":
+                is1bitsgd.add(int(elem))
+            else:
+                raise RuntimeError("invalid is1bitsgd value {}, only 0 or 1 allowed".format(elem))
+
+        metafunc.parametrize("is_1bit_sgd", is1bitsgd, scope='session')
+
+@pytest.fixture(autouse=True)
+def reset_random_seed():
+    cntk.cntk_py.reset_random_seed(0)
+
+@pytest.fixture(autouse=True)
+def cpu_device(device_id):
+    from cntk.device import try_set_default_device
+    from cntk.ops.tests.ops_test_utils import cntk_device
+    try_set_default_device(cntk_device(device_id))
+
+if not _HAS_PYTEST_BENCHMARK:
+    _results = []
+
+    @pytest.fixture
+    def benchmark(request):
+        fixture = BenchmarkFixture(request.node.name, request.node.nodeid,
+                                   min_time=request.config.option.benchmark_min_time,
+                                   max_time=request.config.option.benchmark_max_time)
+        yield fixture
+        if fixture.stats is not None:
+            _results.append(fixture.as_dict())
+
+    def pytest_sessionfinish(session, exitstatus):
+        filename = session.config.option.benchmark_json
+        if filename:
+            write_json(filename, _results)
+
+    def pytest_terminal_summary(terminalreporter):
+        if not _results:
+            return
+        terminalreporter.section('benchmark results (time per call in us)')
+        terminalreporter.write_line('%-50s %12s %12s %12s %8s' %
+                                    ('name', 'min', 'median', 'mean', 'rounds'))
+        for r in sorted(_results, key=lambda r: r['fullname']):
+            s = r['stats']
+            terminalreporter.write_line('%-50s %12.2f %12.2f %12.2f %8i' %
+                                        (r['name'], s['min'] * 1e6, s['median'] * 1e6,
+                                         s['mean'] * 1e6, s['rounds']))
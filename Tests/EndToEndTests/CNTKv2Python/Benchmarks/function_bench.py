@@ -0,0 +1,110 @@
+# Copyright (c) Microsoft. All rights reserved.
+
+# Licensed under the MIT license. See LICENSE.md file in the project root
+# for full license information.
+# ==============================================================================
+
+'''
+Benchmarks for the per-call overhead of Function evaluation, Python user
+functions, and graph traversal.
+'''
+
+import numpy as np
+import pytest
+import cntk as C
+from cntk.ops.functions import UserFunction
+from cntk.logging.graph import depth_first_search, find_by_name
+
+DIM = 256
+BATCH_SIZE = 64
+
+
+class _Identity(UserFunction):
+    def __init__(self, arg, name='identity'):
+        super(_Identity, self).__init__([arg], name=name)
+
+    def infer_outputs(self):
+        return [C.output_variable(self.inputs[0].shape, self.inputs[0].dtype,
+                                  self.inputs[0].dynamic_axes)]
+
+    def forward(self, argument, device=None, outputs_to_retain=None):
+        return None, argument
+
+    def backward(self, state, root_gradients):
+        return root_gradients
+
+
+class _ZeroCopyIdentity(UserFunction):
+    def __init__(self, arg, name='identity'):
+        super(_ZeroCopyIdentity, self).__init__([arg], zero_copy=True, name=name)
+
+    def infer_outputs(self):
+        return [C.output_variable(self.inputs[0].shape, self.inputs[0].dtype,
+                                  self.inputs[0].dynamic_axes)]
+
+    def forward(self, argument, outputs, device=None, outputs_to_retain=None):
+        outputs[self.output][...] = argument
+
+    def backward(self, state, root_gradients, variables):
+        variables[self.inputs[0]][...] = root_gradients
+
+
+_USER_FUNCTIONS = {'copy': _Identity, 'zero_copy': _ZeroCopyIdentity}
+
+
+def _deep_model(depth):
+    x = C.input_variable(DIM, name='x')
+    h = x
+    for i in range(depth):
+        h = C.layers.Dense(DIM, activation=C.relu, name='layer%i' % i)(h)
+    return x, h
+
+
+def test_eval_batch_size_1(benchmark):
+    x = C.input_variable(DIM)
+    z = C.layers.Dense(DIM)(x)
+    data = np.random.rand(1, DIM).astype(np.float32)
+    benchmark.group = 'Function.eval'
+    benchmark(z.eval, {x: data})
+
+
+def test_eval_batch_size_1_deep(benchmark):
+    x, z = _deep_model(10)
+    data = np.random.rand(1, DIM).astype(np.float32)
+    benchmark.group = 'Function.eval'
+    benchmark(z.eval, {x: data})
+
+
+@pytest.mark.parametrize("mode", sorted(_USER_FUNCTIONS))
+@pytest.mark.parametrize("batch_size", [1, BATCH_SIZE])
+def test_user_function_forward(benchmark, batch_size, mode):
+    x = C.input_variable(DIM)
+    z = C.user_function(_USER_FUNCTIONS[mode](x * 2))
+    data = np.random.rand(batch_size, DIM).astype(np.float32)
+    benchmark.group = 'UserFunction'
+    benchmark(z.eval, {x: data})
+
+
+@pytest.mark.parametrize("mode", sorted(_USER_FUNCTIONS))
+@pytest.mark.parametrize("batch_size", [1, BATCH_SIZE])
+def test_user_function_forward_backward(benchmark, batch_size, mode):
+    x = C.input_variable(DIM, needs_gradient=True)
+    z = C.user_function(_USER_FUNCTIONS[mode](x * 2))
+    data = np.random.rand(batch_size, DIM).astype(np.float32)
+    benchmark.group = 'UserFunction'
+    benchmark(z.grad, {x: data}, wrt=[x], outputs=[z.output])
+
+
+@pytest.mark.parametrize("depth", [10, 100])
+def test_depth_first_search(benchmark, depth):
+    _, z = _deep_model(depth)
+    benchmark.group = 'graph'
+    benchmark(depth_first_search, z, lambda node: True, -1)
+
+
+@pytest.mark.parametrize("depth", [10, 100])
+def test_find_by_name(benchmark, depth):
+    _, z = _deep_model(depth)
+    benchmark.group = 'graph'
+    result = benchmark(find_by_name, z, 'layer0', -1)
+    assert result is not None
@@ -0,0 +1,55 @@
+# Copyright (c) Microsoft. All rights reserved.
+
+# Licensed under the MIT license. See LICENSE.md file in the project root
+# for full license information.
+# ==============================================================================
+
+'''
+Benchmarks for the Python-side minibatch sources.
+'''
+
+import numpy as np
+import pytest
+import scipy.sparse
+import cntk as C
+from cntk.layers.typing import Sequence, tensor
+
+NUM_SAMPLES = 10000
+DIM = 256
+VOCAB = 1000
+MB_SIZE = 64
+SEQ_LEN = 20
+
+
+def _next_minibatch(source, mb_size):
+    mb = source.next_minibatch(mb_size)
+    assert mb
+    return mb
+
+
+@pytest.mark.parametrize("num_workers", [1, 4])
+def test_minibatch_source_from_data_dense(benchmark, num_workers):
+    X = np.random.rand(NUM_SAMPLES, DIM).astype(np.float32)
+    Y = np.random.rand(NUM_SAMPLES, 1).astype(np.float32)
+    source = C.io.MinibatchSourceFromData(dict(x=X, y=Y))
+    benchmark.group = 'MinibatchSourceFromData.next_minibatch'
+    benchmark(source.next_minibatch, MB_SIZE, num_workers, 0)
+
+
+def test_minibatch_source_from_data_sparse(benchmark):
+    indices = np.random.randint(0, VOCAB, NUM_SAMPLES)
+    X = scipy.sparse.csr_matrix((np.ones(NUM_SAMPLES, np.float32),
+                                 (np.arange(NUM_SAMPLES), indices)),
+                                shape=(NUM_SAMPLES, VOCAB))
+    source = C.io.MinibatchSourceFromData(dict(x=X))
+    benchmark.group = 'MinibatchSourceFromData.next_minibatch'
+    benchmark(_next_minibatch, source, MB_SIZE)
+
+
+def test_minibatch_source_from_data_sequences(benchmark):
+    num_sequences = NUM_SAMPLES // SEQ_LEN
+    XX = [np.random.rand(np.random.randint(1, 2 * SEQ_LEN), DIM).astype(np.float32)
+          for _ in range(num_sequences)]
+    source = C.io.MinibatchSourceFromData(dict(xx=(XX, Sequence[tensor])))
+    benchmark.group = 'MinibatchSourceFromData.next_minibatch'
+    benchmark(_next_minibatch, source, MB_SIZE * SEQ_LEN)
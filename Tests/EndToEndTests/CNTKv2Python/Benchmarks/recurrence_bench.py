@@ -0,0 +1,61 @@
+# Copyright (c) Microsoft. All rights reserved.
+
+# Licensed under the MIT license. See LICENSE.md file in the project root
+# for full license information.
+# ==============================================================================
+
+'''
+Benchmarks for the training throughput of recurrent language models built from
+the blocks of cntk.layers (LSTM, GRU, RNNStep inside a Recurrence).
+'''
+
+import numpy as np
+import pytest
+import cntk as C
+from cntk.layers import Embedding, Recurrence, Dense, Sequential, LSTM, GRU, RNNStep
+
+VOCAB = 1000
+EMB_DIM = 128
+HIDDEN_DIM = 256
+NUM_SEQUENCES = 32
+SEQ_LEN = 35
+
+_BLOCKS = {'LSTM': LSTM, 'GRU': GRU, 'RNNStep': RNNStep}
+
+
+def _language_model_trainer(block):
+    x = C.sequence.input_variable(VOCAB, is_sparse=True)
+    y = C.sequence.input_variable(VOCAB, is_sparse=True)
+    z = Sequential([
+        Embedding(EMB_DIM),
+        Recurrence(_BLOCKS[block](HIDDEN_DIM)),
+        Dense(VOCAB)
+    ])(x)
+    ce = C.cross_entropy_with_softmax(z, y)
+    learner = C.sgd(z.parameters, C.learning_rate_schedule(0.01, C.UnitType.sample))
+    return x, y, C.Trainer(z, (ce, None), [learner])
+
+
+def _one_hot_sequences():
+    ids = np.random.randint(0, VOCAB, (NUM_SEQUENCES, SEQ_LEN + 1))
+    features = C.Value.one_hot(ids[:, :-1].tolist(), VOCAB)
+    labels = C.Value.one_hot(ids[:, 1:].tolist(), VOCAB)
+    return features, labels
+
+
+@pytest.mark.parametrize("block", sorted(_BLOCKS))
+def test_language_model_train_minibatch(benchmark, block):
+    x, y, trainer = _language_model_trainer(block)
+    features, labels = _one_hot_sequences()
+    benchmark.group = 'Recurrence.train_minibatch'
+    benchmark.extra_info['words_per_call'] = NUM_SEQUENCES * SEQ_LEN
+    benchmark(trainer.train_minibatch, {x: features, y: labels})
+
+
+@pytest.mark.parametrize("block", sorted(_BLOCKS))
+def test_language_model_eval(benchmark, block):
+    x, y, trainer = _language_model_trainer(block)
+    features, _ = _one_hot_sequences()
+    benchmark.group = 'Recurrence.eval'
+    benchmark.extra_info['words_per_call'] = NUM_SEQUENCES * SEQ_LEN
+    benchmark(trainer.model.eval, {x: features})
@@ -0,0 +1,54 @@
+# Copyright (c) Microsoft. All rights reserved.
+
+# Licensed under the MIT license. See LICENSE.md file in the project root
+# for full license information.
+# ==============================================================================
+
+'''
+Benchmarks for the argument sanitization done on every forward/backward/train
+call.
+'''
+
+import numpy as np
+import pytest
+import cntk as C
+from cntk.internal import sanitize_var_map
+
+DIM = 256
+BATCH_SIZE = 64
+SEQ_LEN = 20
+
+
+def _arguments(num_inputs):
+    return [C.input_variable(DIM, name='x%i' % i) for i in range(num_inputs)]
+
+
+@pytest.mark.parametrize("num_inputs", [1, 8])
+def test_sanitize_var_map_numpy(benchmark, num_inputs):
+    args = _arguments(num_inputs)
+    data = dict((a, np.random.rand(BATCH_SIZE, DIM).astype(np.float32)) for a in args)
+    benchmark.group = 'sanitize_var_map'
+    benchmark(sanitize_var_map, args, data)
+
+
+def test_sanitize_var_map_by_name(benchmark):
+    args = _arguments(8)
+    data = dict((a.name, np.random.rand(BATCH_SIZE, DIM).astype(np.float32)) for a in args)
+    benchmark.group = 'sanitize_var_map'
+    benchmark(sanitize_var_map, args, data)
+
+
+def test_sanitize_var_map_value(benchmark):
+    args = _arguments(8)
+    data = dict((a, C.Value.create(a, np.random.rand(BATCH_SIZE, DIM).astype(np.float32)))
+                for a in args)
+    benchmark.group = 'sanitize_var_map'
+    benchmark(sanitize_var_map, args, data)
+
+
+def test_sanitize_var_map_sequences_with_seq_starts(benchmark):
+    x = C.sequence.input_variable(DIM)
+    data = [np.random.rand(SEQ_LEN, DIM).astype(np.float32) for _ in range(BATCH_SIZE)]
+    seq_starts = [True] * BATCH_SIZE
+    benchmark.group = 'sanitize_var_map'
+    benchmark(sanitize_var_map, [x], {x: (data, seq_starts)})
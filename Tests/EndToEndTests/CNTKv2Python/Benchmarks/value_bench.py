@@ -0,0 +1,85 @@
+# Copyright (c) Microsoft. All rights reserved.
+
+# Licensed under the MIT license. See LICENSE.md file in the project root
+# for full license information.
+# ==============================================================================
+
+'''
+Benchmarks for the conversion of NumPy/SciPy data into CNTK Values and back.
+'''
+
+import numpy as np
+import pytest
+import scipy.sparse
+import cntk as C
+
+DIM = 256
+BATCH_SIZE = 64
+SEQ_LEN = 20
+VOCAB = 10000
+
+
+@pytest.mark.parametrize("batch_size", [1, BATCH_SIZE])
+def test_value_create_dense(benchmark, batch_size):
+    x = C.input_variable(DIM)
+    data = np.random.rand(batch_size, DIM).astype(np.float32)
+    benchmark.group = 'Value.create'
+    benchmark(C.Value.create, x, data)
+
+
+def test_value_create_sparse(benchmark):
+    x = C.input_variable(VOCAB, is_sparse=True)
+    indices = np.random.randint(0, VOCAB, BATCH_SIZE)
+    data = scipy.sparse.csr_matrix((np.ones(BATCH_SIZE, np.float32),
+                                    (np.arange(BATCH_SIZE), indices)),
+                                   shape=(BATCH_SIZE, VOCAB))
+    benchmark.group = 'Value.create'
+    benchmark(C.Value.create, x, data)
+
+
+def test_value_create_dense_sequences(benchmark):
+    x = C.sequence.input_variable(DIM)
+    data = [np.random.rand(np.random.randint(1, 2 * SEQ_LEN), DIM).astype(np.float32)
+            for _ in range(BATCH_SIZE)]
+    benchmark.group = 'Value.create'
+    benchmark(C.Value.create, x, data)
+
+
+def test_value_create_sparse_sequences(benchmark):
+    x = C.sequence.input_variable(VOCAB, is_sparse=True)
+    data = []
+    for _ in range(BATCH_SIZE):
+        length = np.random.randint(1, 2 * SEQ_LEN)
+        indices = np.random.randint(0, VOCAB, length)
+        data.append(scipy.sparse.csr_matrix((np.ones(length, np.float32),
+                                             (np.arange(length), indices)),
+                                            shape=(length, VOCAB)))
+    benchmark.group = 'Value.create'
+    benchmark(C.Value.create, x, data)
+
+
+def test_value_one_hot_sequences(benchmark):
+    data = [list(np.random.randint(0, VOCAB, np.random.randint(1, 2 * SEQ_LEN)))
+            for _ in range(BATCH_SIZE)]
+    benchmark.group = 'Value.create'
+    benchmark(C.Value.one_hot, data, VOCAB)
+
+
+def test_value_as_sequences_unmasked(benchmark):
+    x = C.sequence.input_variable(DIM)
+    data = [np.random.rand(SEQ_LEN, DIM).astype(np.float32)
+            for _ in range(BATCH_SIZE)]
+    value = C.Value.create(x, data)
+    benchmark.group = 'Value.as_sequences'
+    benchmark(value.as_sequences, x)
+
+
+@pytest.mark.parametrize("with_variable", [False, True])
+def test_value_as_sequences_masked(benchmark, with_variable):
+    x = C.sequence.input_variable(DIM)
+    data = [np.random.rand(np.random.randint(1, 2 * SEQ_LEN), DIM).astype(np.float32)
+            for _ in range(BATCH_SIZE)]
+    value = C.Value.create(x, data)
+    benchmark.group = 'Value.as_sequences'
+    result = benchmark(value.as_sequences, x if with_variable else None)
+    assert [len(s) for s in result] == [len(s) for s in data]
@@ -14,7 +14,8 @@ import gym
 # Skip test if not on Linux as Atari Learning Env is not available
 
 
-def test_deep_q_neural_network(device_id):
+@pytest.mark.parametrize("pipelined", [False, True])
+def test_deep_q_neural_network(device_id, pipelined):
     if platform.system() != 'Linux':
         pytest.skip('test only runs on Linux (Gym Atari dependency)')
 
@@ -29,7 +30,8 @@ def test_deep_q_neural_network(device_id):
     env = gym.make(ENV_NAME)
 
     # 2. Make agent
-    agent = dqn.DeepQAgent((4, 84, 84), env.action_space.n, train_after=100, memory_size=1000, monitor=False)
+    agent = dqn.DeepQAgent((4, 84, 84), env.action_space.n, train_after=100, memory_size=1000, monitor=False,
+                           pipelined=pipelined, max_update_lag=10)
 
     # 3. Train
     current_step = 0
@@ -54,4 +56,37 @@ def test_deep_q_neural_network(device_id):
 
         current_step += 1
 
+    agent.close()
     assert len(agent._memory) == 1000
+
+    # The pipelined learner may lag behind by at most max_update_lag updates
+    updates_due = (max_steps - 100) // 4 + 1
+    assert updates_due - 10 <= agent._num_updates <= updates_due
+
+
+def test_replay_memory():
+    abs_path = os.path.dirname(os.path.abspath(__file__))
+    sys.path.append(os.path.join(abs_path, "..", "..", "..", "..", "Examples", "ReinforcementLearning"))
+
+    dqn = __import__("DeepQNeuralNetwork")
+
+    np.random.seed(0)
+    memory = dqn.ReplayMemory(100, (2, 3), 4)
+    for i in range(150):
+        memory.append(np.full((2, 3), i % 256, dtype=np.uint8), i % 3, i, i % 11 == 0)
+    assert len(memory) == 100
+    assert memory._states.dtype == np.uint8
+
+    indexes = memory.sample(20)
+    assert len(set(indexes)) == 20
+    for index in indexes:
+        assert not memory._terminals[index - 4:index].any()
+
+    np.random.seed(1)
+    pre_states, actions, post_states, rewards, dones = memory.minibatch(20)
+    np.random.seed(1)
+    indexes = memory.sample(20)
+    assert pre_states.dtype == np.float32 and pre_states.shape == (20, 4, 2, 3)
+    for i, index in enumerate(indexes):
+        assert np.array_equal(pre_states[i], memory.get_state(index))
+        assert np.array_equal(post_states[i], memory.get_state(index + 1))
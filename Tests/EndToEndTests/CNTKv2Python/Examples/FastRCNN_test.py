@@ -81,3 +81,180 @@ def test_fastrcnn_grocery_training(device_id):
 
     from B3_VisualizeOutputROIs import visualize_output_rois
     assert visualize_output_rois(testing=True)
+
+def test_fastrcnn_vectorized_predictions(tmpdir):
+    import copy
+    import scipy.sparse
+    from easydict import EasyDict
+    from cntk_helpers import svmPredict, nnPredict, softmax, softmax2D, imdbUpdateRoisWithHighGtOverlap
+
+    np.random.seed(0)
+    roiSize, roiDim, featDim = 50, 4, 8
+    feats = np.random.normal(size=(roiSize, featDim)).astype(np.float32)
+    np.savez(str(tmpdir.join('3.dat.npz')), feats)
+    svmWeights = np.random.normal(size=(roiDim, featDim))
+    svmBias = np.random.normal(size=(roiDim, 1))
+    svmFeatScale = np.random.uniform(0.5, 2, size=featDim)
+
+    # the per-roi loops that svmPredict and nnPredict replace
+    def svmPredictLoop(decisionThreshold):
+        labels, maxScores = [], []
+        for feat in feats:
+            scores = np.dot(svmWeights, feat * 1.0 / svmFeatScale) + svmBias.ravel()
+            maxArg = np.argmax(scores[1:]) + 1
+            maxScore = scores[maxArg]
+            if maxScore < decisionThreshold:
+                maxArg = 0
+            labels.append(maxArg)
+            maxScores.append(maxScore)
+        return labels, maxScores
+
+    def nnPredictLoop(decisionThreshold):
+        labels, maxScores = [], []
+        for scores in feats:
+            scores = softmax(scores)
+            maxArg = np.argmax(scores)
+            maxScore = scores[maxArg]
+            if decisionThreshold and maxScore < decisionThreshold:
+                maxArg = 0
+            labels.append(maxArg)
+            maxScores.append(maxScore)
+        return labels, maxScores
+
+    for decisionThreshold in [0, 0.5]:
+        labels, scores = svmPredict(3, str(tmpdir), svmWeights, svmBias, svmFeatScale, roiSize, roiDim, decisionThreshold)
+        expectedLabels, expectedScores = svmPredictLoop(decisionThreshold)
+        assert labels == expectedLabels
+        assert np.allclose(scores, expectedScores)
+    for decisionThreshold in [None, 0, 0.4]:
+        labels, scores = nnPredict(3, str(tmpdir), roiSize, featDim, decisionThreshold)
+        expectedLabels, expectedScores = nnPredictLoop(decisionThreshold)
+        assert labels == expectedLabels
+        assert np.allclose(scores, expectedScores)
+
+    # softmax2D does not overflow for large scores
+    assert np.allclose(softmax2D(feats), [softmax(row) for row in feats])
+    largeScores = softmax2D(feats * 1000.0)
+    assert np.all(np.isfinite(largeScores))
+    assert np.allclose(largeScores.sum(axis=1), 1)
+
+    # the per-roi loop that imdbUpdateRoisWithHighGtOverlap replaces
+    def imdbUpdateRoisLoop(imdb, positivesGtOverlapThreshold):
+        addedPosCounter = 0
+        existingPosCounter = 0
+        for imgIndex in range(imdb.num_images):
+            for boxIndex, gtLabel in enumerate(imdb.roidb[imgIndex]['gt_classes']):
+                if gtLabel > 0:
+                    existingPosCounter += 1
+                else:
+                    overlaps = imdb.roidb[imgIndex]['gt_overlaps'][boxIndex, :].toarray()[0]
+                    maxInd = np.argmax(overlaps)
+                    if overlaps[maxInd] >= positivesGtOverlapThreshold and maxInd > 0:
+                        addedPosCounter += 1
+                        imdb.roidb[imgIndex]['gt_classes'][boxIndex] = maxInd
+        return existingPosCounter, addedPosCounter
+
+    # overlaps from a few values, such that there are ties
+    roidb = []
+    for numBoxes in [7, 0, 12, 5]:
+        overlaps = np.random.choice([0, 0, 0.3, 0.5, 0.7], size=(numBoxes, roiDim))
+        gtClasses = np.where(np.random.random_sample(numBoxes) < 0.3, np.random.randint(1, roiDim, size=numBoxes), 0)
+        roidb.append({'gt_classes': gtClasses.astype(np.int32), 'gt_overlaps': scipy.sparse.csr_matrix(overlaps)})
+    imdb = EasyDict(num_images=len(roidb), roidb=roidb)
+    expectedImdb = copy.deepcopy(imdb)
+    assert imdbUpdateRoisWithHighGtOverlap(imdb, 0.5) == imdbUpdateRoisLoop(expectedImdb, 0.5)
+    for rois, expectedRois in zip(imdb.roidb, expectedImdb.roidb):
+        assert np.array_equal(rois['gt_classes'], expectedRois['gt_classes'])
+
+def test_fastrcnn_selective_search_numpy():
+    from selectivesearch import selectivesearch, selectivesearch_numpy
+
+    np.random.seed(1)
+    images = []
+    for height, width in [(30, 40), (48, 32), (40, 40)]:
+        # a few coloured blocks with noise, such that there are regions of different sizes
+        img = np.zeros((height, width, 3))
+        for _ in range(6):
+            top, left = np.random.randint(0, height - 5), np.random.randint(0, width - 5)
+            img[top:top + np.random.randint(5, 20), left:left + np.random.randint(5, 20)] = np.random.randint(0, 256, 3)
+        images.append(np.clip(img + np.random.normal(0, 20, img.shape), 0, 255).astype(np.uint8))
+    images.append(np.random.randint(0, 256, (24, 24, 3)).astype(np.uint8))
+
+    for img in images:
+        for scale, sigma, minSize in [(1.0, 0.8, 10), (50.0, 1.2, 5)]:
+            _, expectedRegions = selectivesearch.selective_search(img, scale=scale, sigma=sigma, min_size=minSize)
+            _, regions = selectivesearch_numpy.selective_search(img, scale=scale, sigma=sigma, min_size=minSize)
+            assert len(expectedRegions) > 1
+            assert len(regions) == len(expectedRegions)
+            for region, expectedRegion in zip(regions, expectedRegions):
+                assert tuple(region['rect']) == tuple(expectedRegion['rect'])
+                assert region['size'] == expectedRegion['size']
+                assert list(region['labels']) == list(expectedRegion['labels'])
+
+def test_fastrcnn_roi_cache_and_pool(tmpdir):
+    import cv2
+    import functools
+    import multiprocessing
+    from A1_GenerateInputROIs import computeImageRois, getRoiCachePath
+
+    np.random.seed(2)
+    imgPaths = []
+    for imgIndex, (height, width) in enumerate([(60, 80), (90, 50), (70, 70)]):
+        img = np.zeros((height, width, 3))
+        for _ in range(5):
+            top, left = np.random.randint(0, height - 10), np.random.randint(0, width - 10)
+            img[top:top + np.random.randint(10, 40), left:left + np.random.randint(10, 40)] = np.random.randint(0, 256, 3)
+        imgPath = str(tmpdir.join("{}.jpg".format(imgIndex)))
+        cv2.imwrite(imgPath, np.clip(img + np.random.normal(0, 10, img.shape), 0, 255).astype(np.uint8))
+        imgPaths.append(imgPath)
+    roiParams = {
+        'boAddSelectiveSearchROIs': True,
+        'boAddRoisOnGrid': True,
+        'ss_scale': 100,
+        'ss_sigma': 1.2,
+        'ss_minSize': 20,
+        'roi_maxImgDim': 100,
+        'grid_nrScales': 3,
+        'grid_aspectRatios': [1.0, 2.0, 0.5],
+        'roi_minDim': 1,
+        'roi_maxDim': 100,
+        'roi_minNrPixels': 0,
+        'roi_maxNrPixels': 100 * 100,
+        'roi_maxAspectRatio': 4.0}
+
+    # the cache key depends on the image content and on every roi parameter and flag
+    roiCacheDir = str(tmpdir.mkdir("cache"))
+    cachePath = getRoiCachePath(roiCacheDir, imgPaths[0], roiParams)
+    assert cachePath == getRoiCachePath(roiCacheDir, imgPaths[0], dict(roiParams))
+    assert cachePath != getRoiCachePath(roiCacheDir, imgPaths[1], roiParams)
+    for key, value in [('boAddSelectiveSearchROIs', False), ('boAddRoisOnGrid', False), ('ss_scale', 50),
+                       ('roi_maxImgDim', 120), ('grid_nrScales', 2), ('roi_minDim', 5)]:
+        assert cachePath != getRoiCachePath(roiCacheDir, imgPaths[0], dict(roiParams, **{key: value}))
+
+    # the rois are the same when computed without cache, written to the cache, and loaded from the cache
+    expectedRois = [computeImageRois(imgPath, roiParams)[0] for imgPath in imgPaths]
+    for boCached in [False, True]:
+        for imgPath, expected in zip(imgPaths, expectedRois):
+            rois, stats = computeImageRois(imgPath, roiParams, roiCacheDir)
+            assert stats['boCached'] == boCached
+            assert stats['nrSsRois'] > 0
+            assert np.array_equal(rois, expected)
+
+    # the cached selective search rois are not used when selective search is disabled
+    rois, stats = computeImageRois(imgPaths[0], dict(roiParams, boAddSelectiveSearchROIs=False), roiCacheDir)
+    assert not stats['boCached']
+    assert stats['nrSsRois'] == 0
+    assert len(rois) < len(expectedRois[0])
+
+    # the worker processes return the rois in the order of the images, also when several
+    # processes write the cache file of the same image
+    computeRois = functools.partial(computeImageRois, roiParams=roiParams, roiCacheDir=str(tmpdir.mkdir("poolCache")))
+    pool = multiprocessing.Pool(2)
+    try:
+        results = list(pool.imap(computeRois, imgPaths * 2))
+    finally:
+        pool.close()
+        pool.join()
+    assert len(results) == 2 * len(imgPaths)
+    for (rois, stats), expected in zip(results, expectedRois * 2):
+        assert np.array_equal(rois, expected)
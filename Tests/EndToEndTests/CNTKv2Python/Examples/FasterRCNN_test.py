@@ -141,3 +141,99 @@ def test_fasterrcnn_grocery_training_4stage(device_id):
     eval_model = train_faster_rcnn_alternating(model_file, debug_output=False)
     meanAP = eval_faster_rcnn_mAP(eval_model)
     assert meanAP > 0.01
+
+def test_proposal_store_resume(tmpdir):
+    from proposal_store import ProposalStore
+    store_file = os.path.join(str(tmpdir), "buffered_proposals.bin")
+    proposals = np.random.random_sample((3, 5, 4)).astype(np.float32)
+
+    store = ProposalStore(store_file, 4, 5, resume=True, key="model1")
+    store.write(0, proposals)
+    assert store.num_done() == 3 and not store.is_complete()
+    store = None
+
+    # the same rpn model resumes the store
+    store = ProposalStore(store_file, 4, 5, resume=True, key="model1")
+    assert store.num_done() == 3
+    assert np.array_equal(store[2], proposals[2])
+    store = None
+
+    # a retrained rpn model starts over, and so does a store that is not resumed
+    store = ProposalStore(store_file, 4, 5, resume=True, key="model2")
+    assert store.num_done() == 0
+    store.write(0, proposals[:1])
+    store = None
+    store = ProposalStore(store_file, 4, 5, resume=False, key="model2")
+    assert store.num_done() == 0
+
+def _write_od_reader_data(tmpdir, num_images):
+    import cv2
+    rng = np.random.RandomState(0)
+    img_lines = []
+    roi_lines = []
+    for i in range(num_images):
+        width, height = rng.randint(40, 120, size=2)
+        img_name = "img%d.png" % i
+        cv2.imwrite(os.path.join(str(tmpdir), img_name), rng.randint(0, 256, size=(height, width, 3)).astype(np.uint8))
+        img_lines.append("%d\t%s\t0\n" % (i, img_name))
+        roi_lines.append("%d |roiAndLabel 2 3 %d %d %d\n" % (i, width // 2, height // 2, i % 3 + 1))
+    img_map_file = os.path.join(str(tmpdir), "img_map.txt")
+    roi_map_file = os.path.join(str(tmpdir), "roi_map.txt")
+    with open(img_map_file, "w") as f:
+        f.writelines(img_lines)
+    with open(roi_map_file, "w") as f:
+        f.writelines(roi_lines)
+    return img_map_file, roi_map_file
+
+def _read_od_inputs(img_map_file, roi_map_file, num_inputs, **kwargs):
+    from od_reader import ObjectDetectionReader
+    np.random.seed(1)
+    reader = ObjectDetectionReader(img_map_file, roi_map_file, 4, pad_width=64, pad_height=48, pad_value=114,
+                                   randomize=True, use_flipping=True, **kwargs)
+    try:
+        return [reader.get_next_input() for _ in range(num_inputs)]
+    finally:
+        reader.close()
+
+def test_od_reader_workers_and_caches(tmpdir):
+    img_map_file, roi_map_file = _write_od_reader_data(tmpdir, 7)
+    expected = _read_od_inputs(img_map_file, roi_map_file, 3 * 7)
+
+    cache_file = os.path.join(str(tmpdir), "image_cache.bin")
+    for kwargs in [dict(num_workers=3), dict(num_workers=3, cache_size_mb=1), dict(num_workers=2, cache_file=cache_file)]:
+        inputs = _read_od_inputs(img_map_file, roi_map_file, 3 * 7, **kwargs)
+        for (img, rois, dims, _), (expected_img, expected_rois, expected_dims, _) in zip(inputs, expected):
+            assert np.array_equal(img, expected_img)
+            assert np.array_equal(rois, expected_rois)
+            assert dims == expected_dims
+
+    # the cache file is reused by a reader of the same images and padding
+    from od_reader import _MemmapImageCache
+    cache_key = open(cache_file + ".key").read()
+    cache = _MemmapImageCache(cache_file, 7, (3, 48, 64), cache_key)
+    assert all(cache.contains(i) for i in range(7))
+    cache.close()
+    inputs = _read_od_inputs(img_map_file, roi_map_file, 7, cache_file=cache_file)
+    for (img, _, _, _), (expected_img, _, _, _) in zip(inputs, expected):
+        assert np.array_equal(img, expected_img)
+    cache = _MemmapImageCache(cache_file, 7, (3, 48, 64), "other images")
+    assert not any(cache.contains(i) for i in range(7))
+    cache.close()
+
+def test_od_reader_lru_cache():
+    from od_reader import _LRUImageCache
+    images = [np.full((3, 4, 5), i, dtype=np.float32) for i in range(4)]
+    cache = _LRUImageCache(3 * images[0].nbytes)
+    for i in range(3):
+        cache.put(i, images[i], [i])
+    assert cache.get(0)[1] == [0]  # image 1 is now the least recently used one
+    cache.put(3, images[3], [3])
+    assert [cache.contains(i) for i in range(4)] == [True, False, True, True]
+    assert np.array_equal(cache.get(3)[0], images[3])
+    with pytest.raises(ValueError):
+        cache.get(3)[0][0, 0, 0] = 1  # cached images are read-only
+
+    # images larger than the cache are not cached
+    too_large = np.zeros((12, 4, 5), dtype=np.float32)
+    assert cache.put(4, too_large, [4]) is too_large
+    assert not cache.contains(4) and all(cache.contains(i) for i in (0, 2, 3))
@@ -59,3 +59,140 @@ def test_lightrnn(device_id):
     results = results[0]
     assert len(results) == 2
     assert np.allclose([float(results[0]), float(results[1])], [expected_valid_error, expected_test_error], atol=TOLERANCE_ABSOLUTE)
+
+def test_reallocate_table(tmpdir):
+    from reallocate import reallocate_table, allocate_table_numpy
+
+    vocab_size, vocab_base = 90, 10
+    np.random.seed(0)
+    row = np.random.gamma(2.0, size=(vocab_size, vocab_base))
+    col = np.random.gamma(2.0, size=(vocab_size, vocab_base))
+
+    def total_loss(table):
+        rows, cols = np.nonzero(table >= 0)
+        words = table[rows, cols]
+        assert sorted(words.tolist()) == list(range(vocab_size))
+        return row[words, rows].sum() + col[words, cols].sum()
+
+    word_path = str(tmpdir.join('vocab.txt'))
+    with open(word_path, 'w') as f:
+        f.write(''.join('w%d\n' % i for i in range(vocab_size)))
+
+    greedy_loss = total_loss(allocate_table_numpy(row, col, vocab_size, vocab_base))
+    for method in ['greedy', 'queue']:
+        save_path = str(tmpdir.join(method + '.location'))
+        reallocate_table(row, col, vocab_size, vocab_base, save_path, word_path, method=method)
+        with open(save_path) as f:
+            table = np.array([[int(word_id) for word_id in line.split()] for line in f])
+        assert table.shape == (vocab_base, vocab_base)
+        total_loss(table)
+        with open(save_path + '.string') as f:
+            assert f.read().count('<null>') == vocab_base * vocab_base - vocab_size
+
+    pytest.importorskip('scipy')
+    assert total_loss(allocate_table_numpy(row, col, vocab_size, vocab_base, exact=True)) <= greedy_loss
+
+def test_data_source_id_stream(tmpdir):
+    import shutil
+    import cntk as C
+    from data_reader import DataSource
+
+    test_dir = os.path.join(example_dir, '..', 'test')
+    # the id stream is written next to the text file
+    text_path = str(tmpdir.join('train.txt'))
+    shutil.copy(os.path.join(test_dir, 'train.txt'), text_path)
+    vocab_path = os.path.join(test_dir, 'vocab.txt')
+    location_path = os.path.join(test_dir, 'word-0.location')
+
+    vocab_base = 40
+    # the variables to convert the sparse streams, the dense word streams are converted without
+    stream_vars = [C.sequence.input_variable(vocab_base, is_sparse=True) for _ in range(4)] + [None, None]
+
+    def read_sweep(source, num_samples, num_workers, worker_rank):
+        minibatches = []
+        while True:
+            mb = source.next_minibatch(num_samples, num_workers, worker_rank)
+            streams = [mb[si] for si in source.stream_infos()]
+            assert streams[0].num_samples > 0
+            minibatches.append([np.stack([s.toarray() if hasattr(s, 'toarray') else s
+                                          for s in data.as_sequences(var)])
+                                for data, var in zip(streams, stream_vars)])
+            if streams[0].end_of_sweep:
+                return minibatches
+
+    for seqlength in [5, 8]:
+        for num_workers in [1, 3]:
+            for worker_rank in range(num_workers):
+                num_samples = seqlength * 7
+                expected = read_sweep(DataSource(text_path, vocab_path, location_path, seqlength, 7,
+                                                 use_id_stream=False), num_samples, num_workers, worker_rank)
+                result = read_sweep(DataSource(text_path, vocab_path, location_path, seqlength, 7),
+                                    num_samples, num_workers, worker_rank)
+                assert len(result) == len(expected) > 0
+                for streams, expected_streams in zip(result, expected):
+                    for data, expected_data in zip(streams, expected_streams):
+                        assert np.array_equal(data, expected_data)
+
+    # a sweep tail shorter than a sequence (seqlength 8), or with fewer sequences than workers
+    # (seqlength 5 and 3 workers), is added to the last minibatch of the sweep
+    num_pairs = len(DataSource(text_path, vocab_path, location_path, 5, 7).pairs)
+    for seqlength, num_workers in [(8, 1), (5, 3)]:
+        num_samples = seqlength * 7
+        tail = num_pairs % num_samples
+        assert 0 < tail < num_workers * seqlength
+        for use_id_stream in [False, True]:
+            for worker_rank in range(num_workers):
+                source = DataSource(text_path, vocab_path, location_path, seqlength, 7, use_id_stream=use_id_stream)
+                num_seq = [len(streams[0]) for streams in read_sweep(source, num_samples, num_workers, worker_rank)]
+                assert len(num_seq) == num_pairs // num_samples
+                assert num_seq[:-1] == [7 // num_workers] * (len(num_seq) - 1)
+                assert num_seq[-1] == (num_samples + tail) // seqlength // num_workers
+                # the next sweep starts at the beginning
+                assert read_sweep(source, num_samples, num_workers, worker_rank)[0][0].shape[0] == num_seq[0]
+
+    # every worker needs a sequence of the minibatch
+    for use_id_stream in [False, True]:
+        source = DataSource(text_path, vocab_path, location_path, 5, 7, use_id_stream=use_id_stream)
+        with pytest.raises(ValueError):
+            source.next_minibatch(10, 3, 0)
+
+    # words without location are an error in both paths
+    with open(vocab_path) as f:
+        missing_word = [line.strip() for line in f].index('the')
+    with open(location_path) as f:
+        table = [['-1' if int(word) == missing_word else word for word in line.split()] for line in f]
+    missing_location_path = str(tmpdir.join('missing.location'))
+    with open(missing_location_path, 'w') as f:
+        f.writelines(' '.join(row) + '\n' for row in table)
+    for use_id_stream in [False, True]:
+        source = DataSource(text_path, vocab_path, missing_location_path, 5, 7, use_id_stream=use_id_stream)
+        with pytest.raises(KeyError) as error:
+            read_sweep(source, 35, 1, 0)
+        assert error.value.args[0] == missing_word
+
+def test_accumulate_loss():
+    from loss_vector import accumulate_loss
+
+    vocab_size, vocab_base = 30, 6
+    np.random.seed(0)
+    words = np.random.randint(0, vocab_size, size=200)
+    log_prob = np.log(np.random.random_sample((len(words), vocab_base)))
+
+    # the nested loop that accumulate_loss replaces
+    expected = np.zeros((vocab_size, vocab_base))
+    for i in range(len(words)):
+        for j in range(vocab_base):
+            expected[words[i]][j] -= log_prob[i][j]
+
+    loss_vector = np.zeros((vocab_size, vocab_base))
+    accumulate_loss(loss_vector, log_prob, words)
+    assert np.allclose(loss_vector, expected)
+
+def test_tree_reduce():
+    from loss_vector import tree_reduce
+
+    np.random.seed(0)
+    for num_arrays in [1, 2, 5, 8]:
+        arrays = [np.random.random_sample((7, 3)) for _ in range(num_arrays)]
+        expected = np.sum(arrays, axis=0)
+        assert np.allclose(tree_reduce(list(arrays)), expected)
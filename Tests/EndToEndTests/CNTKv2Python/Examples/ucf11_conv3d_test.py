@@ -15,7 +15,7 @@ import pytest
 abs_path = os.path.dirname(os.path.abspath(__file__))
 sys.path.append(abs_path)
 sys.path.append(os.path.join(abs_path, "..", "..", "..", "..", "Examples", "Video", "GettingStarted", "Python"))
-from Conv3D_UCF11 import conv3d_ucf11, VideoReader # Depends on imageio package.
+from Conv3D_UCF11 import conv3d_ucf11, VideoReader, VideoMinibatchSource # Depends on imageio package.
 
 from prepare_test_data import prepare_UCF11_data
 
@@ -48,3 +48,89 @@ def test_ucf11_conv3d_error(device_id):
 
     assert np.allclose(test_error, expected_test_error,
                        atol=TOLERANCE_ABSOLUTE)
+
+@pytest.mark.skipif(sys.platform != 'win32',
+                    reason="does currently run only on Windows")
+def test_ucf11_cached_video_reader(tmpdir):
+    prepare_UCF11_data()
+
+    base_path = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             *"../../../../Examples/Video/DataSets/UCF11".split("/"))
+    map_file = os.path.join(os.path.normpath(base_path), 'test_map.csv')
+
+    # The prefetching and caching reader must return the same clips for the same random seed
+    results = []
+    for num_workers, cache_dir in [(0, None), (2, str(tmpdir)), (0, str(tmpdir))]:
+        np.random.seed(1)
+        reader = VideoReader(map_file, 11, True, 6, num_workers=num_workers, cache_dir=cache_dir, random_crop=True)
+        try:
+            results.append(reader.next_minibatch(6))
+        finally:
+            reader.close()
+
+    for videos, labels, current_minibatch in results[1:]:
+        assert current_minibatch == 6
+        assert np.array_equal(videos, results[0][0])
+        assert np.array_equal(labels, results[0][1])
+
+@pytest.mark.skipif(sys.platform != 'win32',
+                    reason="does currently run only on Windows")
+def test_ucf11_video_minibatch_source_sweeps():
+    prepare_UCF11_data()
+
+    base_path = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             *"../../../../Examples/Video/DataSets/UCF11".split("/"))
+    map_file = os.path.join(os.path.normpath(base_path), 'test_map.csv')
+
+    # sweeps of 5 clips in minibatches of 2, the last minibatch of a sweep has 1 clip and ends the sweep
+    reader = VideoReader(map_file, 11, False, 5, num_workers=2)
+    try:
+        source = VideoMinibatchSource(reader)
+        sweeps = []
+        for sweep in range(2):
+            videos = []
+            for expected_size, expected_sweep_end in [(2, False), (2, False), (1, True)]:
+                mb = source.next_minibatch(2)
+                for si in source.stream_infos():
+                    assert mb[si].num_samples == expected_size
+                    assert mb[si].end_of_sweep == expected_sweep_end
+                videos.append(mb[source.features_si].data.asarray())
+            sweeps.append(np.concatenate(videos))
+    finally:
+        reader.close()
+
+    # the reader is reset at the start of the next sweep, which starts with the same clips
+    assert sweeps[0].shape[0] == 5
+    assert np.array_equal(sweeps[0], sweeps[1])
+
+def test_ucf11_read_frames_with_and_without_cache(tmpdir, monkeypatch):
+    import Conv3D_UCF11
+
+    # a video whose reported number of frames (estimated from the container) differs from the decoded frames
+    class FakeVideoReader(object):
+        def __init__(self, frames, reported_count):
+            self.frames = frames
+            self.reported_count = reported_count
+        def __len__(self):
+            return self.reported_count
+        def __iter__(self):
+            return iter(self.frames)
+        def get_data(self, index):
+            return self.frames[index]
+        def close(self):
+            pass
+
+    np.random.seed(0)
+    frames = list(np.random.randint(0, 256, size=(36, 120, 160, 3)).astype(np.uint8))
+    video_file = str(tmpdir.join('video.avi'))
+    open(video_file, 'w').close()
+
+    for reported_count in [30, 40]:
+        monkeypatch.setattr(Conv3D_UCF11.imageio, 'get_reader',
+                            lambda path, format: FakeVideoReader(frames, reported_count))
+        cache_file = str(tmpdir.join('video_{}.npy'.format(reported_count)))
+        for start_fraction in [None, 0.0, 0.5]:
+            expected = Conv3D_UCF11.read_frames(video_file, None, 16, start_fraction)
+            # the first read decodes the video into the cache, the second one reads the cache
+            for _ in range(2):
+                assert np.array_equal(Conv3D_UCF11.read_frames(video_file, cache_file, 16, start_fraction), expected)
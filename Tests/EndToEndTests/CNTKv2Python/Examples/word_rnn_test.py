@@ -36,6 +36,8 @@ def test_data_reader(device_id):
     try:
         actual_count = get_count_data()
         assert actual_count == expected_count
+        actual_count = get_count_data(bucketed=True)
+        assert actual_count == expected_count
     finally:
         os.chdir(current_path)
 
@@ -60,7 +62,37 @@ def test_ptb_word_rnn(device_id):
     finally:
         os.chdir(current_path)
 
-def test_word_rnn(device_id):
+def test_bucketed_data_reader(tmpdir):
+    from data_reader import DataReader
+
+    dir = os.path.dirname(os.path.abspath(W.__file__))
+    reader = DataReader(os.path.join(dir, 'test/token2id.txt'), '<eos>', cache_dir=str(tmpdir))
+    text_path = os.path.join(dir, 'test/text.txt')
+
+    def sequence_stats(minibatches):
+        num_sequences, num_features, token_count = 0, 0, 0
+        for features, labels, count in minibatches:
+            num_sequences += features.shape[0]
+            num_features += np.count_nonzero(features.mask)
+            token_count += count
+        return num_sequences, num_features, token_count
+
+    expected = sequence_stats(reader.minibatch_generator(text_path, 3, 2))
+    assert sequence_stats(reader.bucketed_minibatch_generator(text_path, 3, 2, batches_per_bucket=4)) == expected
+    assert sequence_stats(reader.bucketed_minibatch_generator(text_path, 3, 2, randomize=True, seed=1, prefetch=0)) == expected
+
+    # each worker gets the same number of minibatches, together they get all complete minibatch groups
+    num_batches = [len(list(reader.bucketed_minibatch_generator(text_path, 3, 2, num_workers=3, worker_rank=rank))) for rank in range(3)]
+    assert num_batches[0] == num_batches[1] == num_batches[2] == 24 // 3
+
+    # randomized workers shuffle with the same seed, such that they get disjoint minibatches
+    with pytest.raises(ValueError):
+        reader.bucketed_minibatch_generator(text_path, 3, 2, randomize=True, num_workers=3, worker_rank=0)
+    worker_stats = [sequence_stats(reader.bucketed_minibatch_generator(text_path, 3, 2, randomize=True, seed=5,
+                                                                       num_workers=3, worker_rank=rank)) for rank in range(3)]
+    assert tuple(np.sum(worker_stats, axis=0)) == expected
+
+def test_word_rnn(device_id, tmpdir):
     try_set_default_device(cntk_device(device_id))
 
     # Just run and verify it does not crash
@@ -86,5 +118,6 @@ def test_word_rnn(device_id):
     W.validation_file_path        = os.path.join(dir, 'test/text.txt')
     W.train_file_path             = os.path.join(dir, 'test/text.txt')
     W.token_frequencies_file_path = os.path.join(dir, 'test/freq.txt')
+    W.token_id_cache_dir          = str(tmpdir)
 
     W.train_lm(testing=True)
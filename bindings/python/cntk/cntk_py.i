@@ -277,6 +277,66 @@ def dynamic_axes(self):
     }
 }
 
+%fragment("NDArrayViewToNumPyView", "header")
+{
+    static void ReleaseNDArrayViewCapsule(PyObject* capsule)
+    {
+        delete reinterpret_cast<CNTK::NDArrayViewPtr*>(PyCapsule_GetPointer(capsule, "cntk.NDArrayView"));
+    }
+
+    // Returns a NumPy array that shares the memory of a dense CPU NDArrayView.
+    // The array keeps the NDArrayView alive through its base object.
+    PyObject* NDArrayViewToNumPyView(CNTK::NDArrayView* self) {
+        if ((*self).GetStorageFormat() != StorageFormat::Dense)
+            throw std::invalid_argument("only dense data can be viewed without copying");
+
+        if ((*self).Device() != DeviceDescriptor::CPUDevice())
+            throw std::invalid_argument("only data residing on the CPU can be viewed without copying");
+
+        // CNTK uses column major, thus we reverse the shape
+        std::vector<size_t> dimensions_cntk = (*self).Shape().Dimensions();
+        std::vector<npy_intp> dimensions(dimensions_cntk.rbegin(), dimensions_cntk.rend());
+
+        bool readOnly = (*self).IsReadOnly();
+        CNTK::DataType cntk_type = (*self).GetDataType();
+
+        int numpy_type;
+        void* buffer;
+
+        if (cntk_type == CNTK::DataType::Float)
+        {
+            numpy_type = NPY_FLOAT;
+            buffer = readOnly ? (void*)(*self).DataBuffer<float>() : (void*)(*self).WritableDataBuffer<float>();
+        }
+        else if (cntk_type == CNTK::DataType::Double)
+        {
+            numpy_type = NPY_DOUBLE;
+            buffer = readOnly ? (void*)(*self).DataBuffer<double>() : (void*)(*self).WritableDataBuffer<double>();
+        }
+        else
+        {
+            throw std::invalid_argument("unknown CNTK data type");
+        }
+
+        int flags = readOnly ? NPY_ARRAY_CARRAY_RO : NPY_ARRAY_CARRAY;
+        PyObject* ndarray = PyArray_New(&PyArray_Type, static_cast<int>(dimensions.size()),
+                                        dimensions.data(), numpy_type, NULL, buffer, 0, flags, NULL);
+        if (ndarray == NULL)
+            return NULL;
+
+        PyObject* capsule = PyCapsule_New(new CNTK::NDArrayViewPtr((*self).shared_from_this()),
+                                          "cntk.NDArrayView", ReleaseNDArrayViewCapsule);
+        if (capsule == NULL || PyArray_SetBaseObject((PyArrayObject*)ndarray, capsule) != 0)
+        {
+            Py_XDECREF(capsule);
+            Py_DECREF(ndarray);
+            return NULL;
+        }
+
+        return ndarray;
+    }
+}
+
 %fragment("pydict_insert", "header")
 {
      template<typename T> bool pydict_insert(PyObject* dictionary, const T& key, swig_type_info *swig_type, PyObject* item) {
@@ -1905,8 +1965,15 @@ extern "C" CNTKPYTHON_API bool CreateDeserializer(DataDeserializerPtr& deseriali
         PyObject *NDArrayViewToNumPy(const CNTK::NDArrayView*);
         return NDArrayViewToNumPy(self);
     }
+
+    PyObject* to_ndarray_view() {
+        PyObject *NDArrayViewToNumPyView(CNTK::NDArrayView*);
+        return NDArrayViewToNumPyView(self);
+    }
 }
 
+%fragment("NDArrayViewToNumPyView");
+
 // end of NDArrayView
 %template(NDArrayViewFloat) CNTK::NDArrayView::NDArrayView<float>;
 %template(NDArrayViewDouble) CNTK::NDArrayView::NDArrayView<double>;
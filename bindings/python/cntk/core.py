@@ -240,6 +240,30 @@ class NDArrayView(cntk_py.NDArrayView):
         '''
         return data_type_to_dtype(self.get_data_type())
 
+    def as_numpy_view(self):
+        '''
+        Returns a NumPy array that shares the memory of this instance, i.e.
+        no data is copied. Writing to the array modifies this instance,
+        unless it is read-only, in which case the array is read-only as well.
+
+        Only dense data residing on the CPU can be viewed this way. Use
+        :meth:`asarray` to obtain a copy otherwise.
+
+        Example:
+            >>> data = np.asarray([[1, 2], [3, 4]], dtype=np.float32)
+            >>> nd = NDArrayView.from_dense(data, device=C.cpu())
+            >>> view = nd.as_numpy_view()
+            >>> view[0, 0] = 10
+            >>> nd.asarray()
+            array([[ 10.,   2.],
+                   [  3.,   4.]], dtype=float32)
+
+        Returns:
+            `numpy.ndarray` that is only valid as long as the memory of this
+            instance is not reused by CNTK
+        '''
+        return super(NDArrayView, self).to_ndarray_view()
+
 
 class Value(cntk_py.Value):
     '''
@@ -6,6 +6,8 @@
 import sys
 from collections import defaultdict
 
+import numpy as np
+
 from cntk import cntk_py, user_function, output_variable, CloneMethod
 
 from cntk.ops.functions import UserFunction
@@ -378,14 +380,156 @@ class _DebugNode(UserFunction):
         return "_DebugNode(after=%s)" % str(self.after)
 
 
-def _nodes_to_debug(model):
-    from cntk.logging.graph import depth_first_search
+class _SamplingDebugNode(_DebugNode):
+    '''
+    A debug node that passes its input through without copying it to NumPy,
+    and only drops into the command line interface of :class:`_DebugNode` if
+    it has been triggered. It is triggered either every ``every`` forward
+    passes (optionally only if ``condition`` holds), or if ``on_nan_or_inf``
+    is set and a sentinel computed inside the graph signals a NaN or Inf in
+    the node's output.
+
+    In order to use it, call :func:`debug_model` with ``every`` or
+    ``on_nan_or_inf``.
+
+    Args:
+       arg (graph node): the node in the graph after which this Debug Node is to
+        be inserted
+      debug_state (:class:`_DebugState`): state that is shared among all debug
+       nodes
+      every (int or None): check every ``every``-th forward pass
+      condition (callable or None): callable taking the input as NumPy array
+       and the node, which is evaluated on the sampled forward passes. If it
+       is None, every sampled pass triggers.
+      on_nan_or_inf (bool): whether to trigger on NaN or Inf values
+      in_stream (object behaving like sys.stdin): `readline()` will be called on it
+       to obtain user input
+      out_stream (object behaving like sys.stdout): `write()` and `flush()` will
+       be called on it to output debug info to the user
+      exit_func (callable): callable that takes an exit code and is called,
+       when the user exits the debugging process
+      name (str): name of the node
+    '''
+
+    SENTINEL_NAME = '_debug_sentinel'
+
+    def __init__(self, arg, debug_state, every=None, condition=None,
+                 on_nan_or_inf=False,
+                 in_stream=sys.stdin, out_stream=sys.stdout,
+                 exit_func=sys.exit,
+                 name='D'):
+        if hasattr(arg, 'is_composite') and arg.is_composite:
+            arg = arg.root_function
+
+        arg_uid_parts = arg.uid.split('_')
+        if len(arg_uid_parts)>2 and arg_uid_parts[-2] == 'Output':
+            del arg_uid_parts[-2]
+        name += '_%s' % '_'.join(arg_uid_parts)
+
+        # Sparse data cannot contain NaN/Inf in a way we could detect cheaply,
+        # so the sentinel is only computed for dense nodes.
+        var = arg
+        if isinstance(arg, cntk_py.Function):
+            var = arg.outputs[0]
 
-    def node_filter(x):
-        if hasattr(x, 'op_name') and x.op_name in ['NoOp']:
-            return False
+        inputs = [arg]
+        if on_nan_or_inf and not var.is_sparse:
+            inputs.append(_SamplingDebugNode._sentinel(var))
+
+        # We skip _DebugNode.__init__, because the data must not be converted
+        # to NumPy on every call.
+        UserFunction.__init__(self, inputs, as_numpy=False, name=name)
+        self.after = arg
+        self.debug_state = debug_state
+        self.every = every
+        self.condition = condition
+        self.on_nan_or_inf = on_nan_or_inf
+        self.forward_count = 0
+
+        self._in, self._out = in_stream, out_stream
+        self._exit = exit_func
+
+    @staticmethod
+    def _sentinel(arg):
+        '''
+        Creates a small function that is NaN wherever ``arg`` contains a NaN
+        or Inf (since 0*Inf is NaN), with one scalar per sequence.
+        '''
+        from cntk import ops, Axis
+        from cntk.ops import sequence
+        name = _SamplingDebugNode.SENTINEL_NAME
+        zero = ops.constant(0, dtype=arg.dtype, name=name)
+        sentinel = ops.element_times(arg, zero, name=name)
+        sentinel = ops.reduce_sum(sentinel, axis=Axis.all_static_axes(),
+                                  name=name)
+        if len(arg.dynamic_axes) > 1:
+            sentinel = sequence.reduce_sum(sentinel, name=name)
+        return ops.stop_gradient(sentinel, name=name)
+
+    def clone(self, cloned_inputs):
+        arg = cloned_inputs[0]
+        map_if_possible(arg)
+        return _SamplingDebugNode(arg, self.debug_state, self.every,
+                                  self.condition, self.on_nan_or_inf,
+                                  self._in, self._out, self._exit)
+
+    def _is_triggered(self, value, sentinel):
+        from cntk.internal import _value_as_sequence_or_array
+        if sentinel is not None:
+            sentinel = np.asarray(_value_as_sequence_or_array(sentinel,
+                                                              self.inputs[1]))
+            if not np.all(np.isfinite(sentinel)):
+                return True
+
+        if self.every and self.forward_count % self.every == 0:
+            if self.condition is None:
+                return True
+            argument = _value_as_sequence_or_array(value, self.inputs[0])
+            return bool(self.condition(argument, self.after))
+
+        return False
+
+    def forward(self, arguments, device=None, outputs_to_retain=None):
+        if len(self.inputs) > 1:
+            value, sentinel = arguments
         else:
-            return True
+            value, sentinel = arguments, None
+
+        self.forward_count += 1
+
+        triggered = self._is_triggered(value, sentinel)
+        if triggered:
+            from cntk.internal import _value_as_sequence_or_array
+            # 'c' only continues until the next time a node is triggered
+            if self.debug_state.commands == ['c']:
+                self.debug_state.commands = []
+            argument = _value_as_sequence_or_array(value, self.inputs[0])
+            super(_SamplingDebugNode, self).forward(argument, device,
+                                                    outputs_to_retain)
+
+        # The input is passed through as is, so that no copies are made.
+        return (True if triggered else None), value
+
+    def backward(self, state, root_gradients, variables=None):
+        if state:
+            from cntk.internal import _value_as_sequence_or_array
+            gradients = _value_as_sequence_or_array(root_gradients,
+                                                    self.outputs[0])
+            super(_SamplingDebugNode, self).backward(None, gradients)
+
+        if variables is None:
+            return root_gradients
+
+        # The sentinel does not receive a gradient.
+        if self.inputs[0] in variables:
+            variables[self.inputs[0]] = root_gradients
+
+    def __str__(self):
+        return "_SamplingDebugNode(after=%s)" % str(self.after)
+
+
+def _nodes_to_debug(model, node_filter=None):
+    from cntk.logging.graph import depth_first_search
 
     nodes = set(depth_first_search(model, lambda x: True))
 
@@ -396,17 +540,51 @@ def _nodes_to_debug(model):
                        n.inputs[0] for n in uf_nodes]
     to_remove = [n.uid for n in (already_covered + uf_nodes)]
 
-    return [n for n in nodes if n.uid not in to_remove]
+    # the NaN/Inf sentinels of _SamplingDebugNode are not debugged themselves
+    return [n for n in nodes if n.uid not in to_remove and
+            n.name != _SamplingDebugNode.SENTINEL_NAME and
+            (node_filter is None or node_filter(n))]
+
+
+def _sanitize_node_filter(nodes):
+    if nodes is None or callable(nodes):
+        return nodes
+
+    if isinstance(nodes, str):
+        nodes = [nodes]
+
+    names = set(n if isinstance(n, str) else n.name for n in nodes)
+    return lambda n: n.name in names
 
 
 def debug_model(model, in_stream=sys.stdin, out_stream=sys.stdout,
-                exit_func=sys.exit):
+                exit_func=sys.exit, nodes=None, every=None, condition=None,
+                on_nan_or_inf=False):
     '''
-    debug_model(model, in_stream=sys.stdin, out_stream=sys.stdout, exit_func=sys.exit)
+    debug_model(model, in_stream=sys.stdin, out_stream=sys.stdout, exit_func=sys.exit, nodes=None, every=None, condition=None, on_nan_or_inf=False)
 
     Returns a cloned model that has debug nodes inserted everywhere. When the
     graph is evaluated or trained, those nodes will allow to inspect the graph.
 
+    By default, every node stops on every forward and backward pass, which
+    requires copying all data to NumPy. For production-size models, use
+    ``nodes`` to instrument only a subset of the nodes, and ``every`` and/or
+    ``on_nan_or_inf`` to switch to the sampling mode. In that mode, the debug
+    nodes pass the data through without copying, and only stop if
+    triggered, i.e. every ``every``-th forward pass (if ``condition`` is
+    given, only if it holds), or when the output of the node contains a NaN
+    or Inf. The latter is detected by a small reduction computed inside the
+    graph, so that only one scalar per sequence needs to be copied.
+
+    Example:
+      >>> x = C.input_variable(2, name='x')
+      >>> z = C.log(x, name='log')
+      >>> # stop at 'log' if it produces NaN/Inf, or every 100th pass if its
+      >>> # input has a negative value
+      >>> z = debug_model(z, nodes=['log'], every=100,
+      ...                 condition=lambda arg, node: np.any(arg < 0),
+      ...                 on_nan_or_inf=True)
+
     Args:
       model (root node): root node until which the nodes are to be debugged
       in_stream (object behaving like sys.stdin, default stdin): `readline()`
@@ -415,22 +593,46 @@ def debug_model(model, in_stream=sys.stdin, out_stream=sys.stdout,
        and `flush()` will be called on it to output debug info to the user
       exit_func (callable, default sys.exit): callable that takes an exit code and is called,
        when the user exits the debugging process
+      nodes (list of str or nodes, or callable, default None): names (or
+       nodes, whose names are taken) of the nodes to debug, or a callable
+       taking a node and returning whether it is to be debugged. If None,
+       all nodes are debugged.
+      every (int, default None): sampling mode: stop every ``every``-th forward
+       pass
+      condition (callable, default None): sampling mode: callable taking the
+       input of a node (as NumPy array) and the node, which is evaluated
+       every ``every``-th forward pass to decide whether to stop. Like the
+       ``u <lambda>`` command, e.g. ``lambda arg, node: np.var(arg) > 1``.
+      on_nan_or_inf (bool, default False): sampling mode: stop when the
+       output of a node contains a NaN or Inf
 
     Returns:
       a clone of the model that has debugging enabled
     '''
-    nodes = _nodes_to_debug(model)
+    if condition is not None and not every:
+        raise ValueError('condition requires every to be set')
+
+    node_filter = _sanitize_node_filter(nodes)
+    nodes = _nodes_to_debug(model, node_filter)
     dbg_state = _DebugState(nodes)
 
+    sampling = bool(every) or on_nan_or_inf
+
+    def create_debug_node(n):
+        if sampling:
+            return _SamplingDebugNode(n, dbg_state, every, condition,
+                                      on_nan_or_inf, in_stream, out_stream,
+                                      exit_func)
+        else:
+            return _DebugNode(n, dbg_state, in_stream, out_stream, exit_func)
+
     orig_node_count = len(nodes)
     mod_counter = 0
 
     # We cannot add the DebugNodes in one clone because the replacements will
     # hide parent nodes.
     while len(nodes) > 0:
-        modifications = {n: user_function(_DebugNode(n, dbg_state,
-                                                     in_stream, out_stream,
-                                                     exit_func))
+        modifications = {n: user_function(create_debug_node(n))
                          for n in nodes}
 
         model = model.clone(CloneMethod.share, modifications)
@@ -440,6 +642,6 @@ def debug_model(model, in_stream=sys.stdin, out_stream=sys.stdout,
         if mod_counter > orig_node_count:
             raise ValueError('cannot debug this graph')
 
-        nodes = _nodes_to_debug(model)
+        nodes = _nodes_to_debug(model, node_filter)
 
     return model
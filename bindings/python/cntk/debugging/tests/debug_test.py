@@ -4,6 +4,7 @@
 # ==============================================================================
 
 import numpy as np
+import pytest
 import cntk as C
 from cntk import sgd, Trainer, learning_rate_schedule, parameter, \
                  times, cross_entropy_with_softmax, \
@@ -167,3 +168,105 @@ def test_debug_multi_output():
     assert line_6.startswith(v_p) and line_7.startswith(v_i) or \
            line_6.startswith(v_i) and line_7.startswith(v_p)
 
+
+
+def _debug_lines(outs, prefix):
+    return [l for l in outs.written if l.startswith(prefix)]
+
+
+def test_debug_subset_of_nodes():
+    input_dim = 2
+    num_output_classes = 2
+
+    f_input = C.input_variable(input_dim, np.float32, needs_gradient=True, name='features')
+    p = parameter(shape=(input_dim,), init=10, name='p')
+
+    ins = InStream(['n'])
+    outs = OutStream()
+
+    z = times(f_input, p, name='z')
+    z = debug_model(z, ins, outs, nodes=['p'])
+
+    l_input = C.input_variable(num_output_classes, np.float32, name='labels')
+    loss = cross_entropy_with_softmax(z, l_input)
+    eval_error = classification_error(z, l_input)
+
+    _train(z, loss, eval_error,
+           loss.find_by_name('features'),
+           loss.find_by_name('labels'),
+           num_output_classes, 1)
+
+    assert len(outs.written) == 4
+    assert len(_debug_lines(outs, "Parameter('p', ")) == 2
+    assert not _debug_lines(outs, "Input('features'")
+    assert not _debug_lines(outs, 'z: Times(')
+
+
+def test_debug_every():
+    input_dim = 2
+    num_output_classes = 2
+
+    f_input = C.input_variable(input_dim, np.float32, needs_gradient=True, name='features')
+    p = parameter(shape=(input_dim,), init=10, name='p')
+
+    ins = InStream([])
+    outs = OutStream()
+
+    z = times(f_input, p, name='z')
+    z = debug_model(z, ins, outs, nodes=['p'], every=2)
+
+    l_input = C.input_variable(num_output_classes, np.float32, name='labels')
+    loss = cross_entropy_with_softmax(z, l_input)
+    eval_error = classification_error(z, l_input)
+
+    _train(z, loss, eval_error,
+           loss.find_by_name('features'),
+           loss.find_by_name('labels'),
+           num_output_classes, 5)
+
+    # stops in forward and backward of the 2nd and 4th minibatch
+    assert len(_debug_lines(outs, "Parameter('p', ")) == 4
+
+
+def test_debug_every_with_condition():
+    f_input = C.input_variable(2, np.float32, name='features')
+    z = C.negate(f_input, name='neg')
+
+    ins = InStream([])
+    outs = OutStream()
+
+    z = debug_model(z, ins, outs, nodes=['neg'], every=1,
+                    condition=lambda arg, node: np.any(arg < 0))
+
+    result = z.eval({z.arguments[0]: np.asarray([[-1, -2]], dtype=np.float32)})
+    assert np.allclose(result, [[1, 2]])
+    assert not outs.written
+
+    result = z.eval({z.arguments[0]: np.asarray([[1, -2]], dtype=np.float32)})
+    assert np.allclose(result, [[-1, 2]])
+    assert len(_debug_lines(outs, 'neg: Negate(')) == 1
+
+
+def test_debug_on_nan_or_inf():
+    f_input = C.input_variable(2, np.float32, name='features')
+    z = C.log(f_input, name='log')
+
+    ins = InStream([])
+    outs = OutStream()
+
+    z = debug_model(z, ins, outs, nodes=['log'], on_nan_or_inf=True)
+
+    result = z.eval({z.arguments[0]: np.asarray([[1, 2]], dtype=np.float32)})
+    assert np.allclose(result, np.log([[1, 2]]))
+    assert not outs.written
+
+    z.eval({z.arguments[0]: np.asarray([[-1, 2]], dtype=np.float32)})
+    assert len(_debug_lines(outs, 'log: Log(')) == 1
+
+
+def test_debug_condition_requires_every():
+    f_input = C.input_variable(2, np.float32, name='features')
+    z = C.log(f_input, name='log')
+
+    with pytest.raises(ValueError):
+        debug_model(z, condition=lambda arg, node: True)
@@ -77,6 +77,17 @@ class MySgdFast(UserLearner):
         return True
 
 
+class MySgdFlat(UserLearner):
+
+    def __init__(self, parameters, lr_schedule):
+        super(MySgdFlat, self).__init__(parameters, lr_schedule, flat=True)
+
+    def update_flat(self, parameter_values, gradient_values, training_sample_count, sweep_end):
+        eta = self.learning_rate() / training_sample_count
+        parameter_values -= eta * gradient_values
+        return True
+
+
 def ffnet(optimizer, num_minibatches_to_train):
     inputs = 2
     outputs = 2
@@ -134,9 +145,26 @@ def test_user_learner():
     np.random.seed(SEED)
     p3 = sorted([p.value for p in ffnet(MySgdFast, num_minibatches_to_train)], key=lambda x: x.shape)
 
-    for a, b, c in zip(p1, p2, p3):
+    np.random.seed(SEED)
+    p4 = sorted([p.value for p in ffnet(MySgdFlat, num_minibatches_to_train)], key=lambda x: x.shape)
+
+    for a, b, c, d in zip(p1, p2, p3, p4):
         assert np.allclose(a, b)
         assert np.allclose(a, c)
+        assert np.allclose(a, d)
+
+
+def test_user_learner_flat_slice():
+    x = C.input_variable(2)
+    z = Dense(3)(x)
+    learner = MySgdFlat(z.parameters, learning_rate_schedule(0.1, UnitType.minibatch))
+
+    assert learner.flat_parameters.shape == (2 * 3 + 3,)
+    assert learner.flat_gradients.shape == learner.flat_parameters.shape
+
+    slices = sorted([learner.flat_slice(p) for p in z.parameters], key=lambda s: s.start)
+    assert [s.stop - s.start for s in slices] == sorted([p.value.size for p in z.parameters])
+    assert slices[0].start == 0 and slices[0].stop == slices[1].start
 
 
 if __name__ == '__main__':
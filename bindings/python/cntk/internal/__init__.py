@@ -24,6 +24,31 @@ def _value_as_sequence_or_array(val, var):
         map_if_possible(val)
         return val.asarray()
 
+def _is_viewable(val):
+    '''
+    Whether ``val`` can be viewed as a NumPy array without copying, i.e.
+    whether it is dense, resides on the CPU, and has no mask.
+    '''
+    from cntk.device import DeviceKind
+    return not cntk_py.Value.is_sparse(val) and \
+        cntk_py.Value.device(val).type() == DeviceKind.CPU and \
+        cntk_py.Value.mask(val) is None
+
+def _value_as_numpy_view(val, var):
+    '''
+    Like :func:`_value_as_sequence_or_array`, but returns NumPy arrays that
+    share the memory of ``val`` if possible. Falls back to copying if ``val``
+    is sparse, not on the CPU, or has a mask.
+    '''
+    if not _is_viewable(val):
+        return _value_as_sequence_or_array(val, var)
+
+    arr = cntk_py.NDArrayView.to_ndarray_view(cntk_py.Value.data(val))
+    if len(var.dynamic_axes) > 1:
+        return list(arr)
+    else:
+        return arr
+
 _serialization_version = 1
 
 def _serialize(udf):
@@ -12,7 +12,7 @@ CNTK IO utilities.
 import warnings
 from cntk import cntk_py, Value
 from cntk.tensor import ArrayMixin
-from cntk.internal import typemap, sanitize_dtype_cntk, is_string
+from cntk.internal import typemap, sanitize_dtype_cntk, sanitize_precision, is_string
 from cntk.device import use_default_device
 from cntk.logging import TraceLevel, get_trace_level
 from cntk.variables import Record
@@ -765,6 +765,147 @@ class MinibatchSourceFromData(UserMinibatchSource):
         self._total_num_samples = checkpoint['total_num_samples']
 
 
+class BucketingMinibatchSource(UserMinibatchSource):
+    '''
+    BucketingMinibatchSource(minibatch_source, window_in_sequences=1000, length_stream=None, randomize=False, seed=0)
+
+    This wraps a MinibatchSource of sequences such that each minibatch consists of sequences of similar length.
+
+    The sequences of a minibatch are padded to the length of the longest one. The padded positions
+    are masked out, but they are computed nevertheless, such that minibatches of sequences of very
+    different lengths waste much of the compute.
+
+    A `BucketingMinibatchSource` reads windows of ``window_in_sequences`` sequences from the wrapped
+    source, sorts the sequences of a window by length, and cuts them into minibatches of the requested
+    number of samples, where each sequence counts with the maximum length over all streams. The minibatches
+    of a window are returned in the order of increasing length, which is deterministic (e.g. for evaluation).
+    With ``randomize``, the order of the minibatches of each window is shuffled (e.g. for training).
+    All minibatches of a window are cut with the minibatch size of the call that reads the window.
+
+    A window does not span across sweeps of the wrapped source. The last minibatch of a window that
+    ends a sweep marks the end of the sweep. The sequences are copied into NumPy arrays (SciPy CSR
+    matrices if sparse) and back, so bucketing pays off if the sequences differ considerably in length.
+    Checkpointing the position of the wrapped source is not supported.
+
+    Example:
+     >>> X = [np.full((n, 1), n, np.float32) for n in [1, 5, 2, 4, 1, 5]]
+     >>> s = C.io.BucketingMinibatchSource(C.io.MinibatchSourceFromData(
+     ...     dict(x=(X, C.layers.typing.Sequence[C.layers.typing.tensor])), max_samples=len(X)*5))
+     >>> mb = s.next_minibatch(4)
+     >>> [len(seq) for seq in mb[s.streams['x']].as_sequences()]
+     [1, 1, 2]
+
+    Args:
+        minibatch_source (:class:`MinibatchSource` or :class:`UserMinibatchSource`): the source of the sequences.
+          It must have a limited number of samples or sweeps, or return sweep ends.
+        window_in_sequences (`int`, defaults to 1000): number of sequences that are grouped by length
+        length_stream (`str`, defaults to `None`): name of the stream whose sequence lengths are sorted first.
+          The lengths of the other streams break ties. If `None`, the maximum length over all streams is used.
+        randomize (`bool`, defaults to `False`): whether to shuffle the order of the minibatches of each window
+        seed (`int`, defaults to 0): random seed for shuffling the minibatches
+
+    Returns:
+     An implementation of a :class:`cntk.io.MinibatchSource` that will iterate through the data.
+    '''
+    def __init__(self, minibatch_source, window_in_sequences=1000, length_stream=None, randomize=False, seed=0):
+        if window_in_sequences < 1:
+            raise ValueError('window_in_sequences must be positive')
+        self._source = minibatch_source
+        self._source_stream_infos = list(minibatch_source.stream_infos())
+        self._names = [si.m_name for si in self._source_stream_infos]
+        if length_stream is not None and length_stream not in self._names:
+            raise ValueError('the wrapped minibatch source has no stream "%s"' % length_stream)
+        self._window_in_sequences = window_in_sequences
+        self._length_stream = length_stream
+        self._randomize = randomize
+        self._rng = np.random.RandomState(seed)
+        self._vars = {}             # [name] -> Variable used to convert the sequences
+        self._sequences = {}        # [name] -> list of the sequences of the current window
+        self._lengths = None        # (num_streams, num_sequences) array of the sequence lengths of the window
+        self._batches = []          # index arrays of the minibatches of the window that are still to be returned
+        self._sweep_end = False     # whether the window ends a sweep of the wrapped source
+
+        super(BucketingMinibatchSource, self).__init__()
+
+    def stream_infos(self):
+        return [StreamInformation(si.m_name, si.m_id,
+                                  'dense' if si.m_storage_format == cntk_py.StorageFormat_Dense else 'sparse',
+                                  sanitize_precision(si.m_element_type),
+                                  si.m_sample_layout.dimensions())
+                for si in self._source_stream_infos]
+
+    def is_infinite(self):
+        return self._source.is_infinite()
+
+    def next_minibatch(self, num_samples, number_of_workers=1, worker_rank=0, device=None):
+        if not self._batches:
+            self._read_window(num_samples, number_of_workers, worker_rank)
+            if not self._batches:
+                return {}
+
+        batch = self._batches.pop(0)
+        sweep_end = self._sweep_end and not self._batches
+
+        result = {}  # [stream_info] -> MinibatchData
+        for name, lengths in zip(self._names, self._lengths):
+            sequences = [self._sequences[name][i] for i in batch]
+            value = Value.create(self._get_var(name), sequences, device=device)
+            result[self.streams[name]] = MinibatchData(value, num_sequences=len(batch),
+                                                       num_samples=int(lengths[batch].sum()), sweep_end=sweep_end)
+        return result
+
+    def _get_var(self, name):
+        # the variable that describes the sequences of the stream, for the conversion to and from Values
+        if name not in self._vars:
+            from cntk.ops.sequence import input_variable
+            si = self.streams[name]
+            self._vars[name] = input_variable(si.sample_shape, is_sparse=si.storage_format == 'sparse',
+                                              dtype=sanitize_precision(si.m_element_type))
+        return self._vars[name]
+
+    def _read_window(self, num_samples, number_of_workers, worker_rank):
+        # reads the next window of sequences and cuts it into minibatches of similar length
+        from cntk.device import cpu
+        sequences = {name: [] for name in self._names}
+        self._sweep_end = False
+        while len(sequences[self._names[0]]) < self._window_in_sequences and not self._sweep_end:
+            if isinstance(self._source, UserMinibatchSource):
+                mb = self._source.next_minibatch(num_samples, number_of_workers, worker_rank, device=cpu())
+            else:
+                mb = self._source.next_minibatch(num_samples, device=cpu(), num_data_partitions=number_of_workers,
+                                                 partition_index=worker_rank)
+            if not mb:
+                break
+            for si, name in zip(self._source_stream_infos, self._names):
+                sequences[name].extend(mb[si].as_sequences(self._get_var(name)))
+            self._sweep_end = any(mb[si].end_of_sweep for si in self._source_stream_infos)
+
+        self._sequences = sequences
+        self._lengths = np.array([[seq.shape[0] for seq in sequences[name]] for name in self._names], dtype=np.int64)
+        num_sequences = self._lengths.shape[1]
+        if num_sequences == 0:
+            self._batches = []
+            return
+
+        # sort by the length of the length stream (the last key), ties are broken by the other streams
+        sample_counts = self._lengths.max(axis=0)
+        primary = sample_counts if self._length_stream is None else self._lengths[self._names.index(self._length_stream)]
+        order = np.lexsort(tuple(self._lengths) + (primary,))
+
+        # cut into minibatches of up to num_samples samples, but at least one sequence
+        batches = []
+        begin = 0
+        cumulative_counts = np.cumsum(sample_counts[order])
+        while begin < num_sequences:
+            offset = cumulative_counts[begin - 1] if begin > 0 else 0
+            end = max(begin + 1, int(np.searchsorted(cumulative_counts, offset + num_samples, side='right')))
+            batches.append(order[begin:end])
+            begin = end
+        if self._randomize:
+            batches = [batches[i] for i in self._rng.permutation(len(batches))]
+        self._batches = batches
+
+
 def HTKFeatureDeserializer(streams):
     '''
     Configures the HTK feature reader that reads speech data from scp files.
@@ -15,7 +15,7 @@ from cntk.io import MinibatchSource, CTFDeserializer, CBFDeserializer, \
     FULL_DATA_SWEEP, INFINITELY_REPEAT, \
     DEFAULT_RANDOMIZATION_WINDOW_IN_CHUNKS, \
     sequence_to_cntk_text_format, UserMinibatchSource, StreamInformation, \
-    MinibatchData, UserDeserializer
+    MinibatchData, UserDeserializer, BucketingMinibatchSource
 from cntk.ops.tests.ops_test_utils import cntk_device
 from cntk.logging import TraceLevel
 import cntk.io.transforms as xforms
@@ -929,6 +929,92 @@ def test_usermbsource_training(tmpdir, with_checkpoint_impl):
         assert mbs_cv._restore_from_checkpoint_calls == 1
 
 
+def test_bucketing_minibatch_source(tmpdir):
+    # 40 sequences of 1 to 12 words with a label per word, the features are the sequence index
+    lengths = np.random.RandomState(0).randint(1, 13, size=40)
+    lines = []
+    for i, length in enumerate(lengths):
+        lines.extend('%d\t|x %d:1\t|y %d:1' % (i, i, (i + j) % 5) for j in range(length))
+    tmpfile = _write_data(tmpdir, '\n'.join(lines))
+
+    def create_source():
+        return MinibatchSource(CTFDeserializer(tmpfile, StreamDefs(
+            features=StreamDef(field='x', shape=40, is_sparse=True),
+            labels=StreamDef(field='y', shape=5, is_sparse=True)
+        )), randomize=False, max_sweeps=1)
+
+    def padding(mb_data):
+        mask = mb_data.mask
+        return mask.size - np.count_nonzero(mask)
+
+    from cntk import sequence
+    features = sequence.input_variable(40, is_sparse=True)
+    mb_source = BucketingMinibatchSource(create_source(), window_in_sequences=25)
+    seen = []
+    num_padded = 0
+    num_sweep_ends = 0
+    while True:
+        mb = mb_source.next_minibatch(30)
+        if not mb:
+            break
+        mb_features = mb[mb_source.streams.features]
+        sequences = mb_features.as_sequences(features)
+        assert mb_features.num_sequences == len(sequences) == mb[mb_source.streams.labels].num_sequences
+        assert mb_features.num_samples == sum(seq.shape[0] for seq in sequences)
+        assert mb_features.num_samples <= 30 or len(sequences) == 1
+        assert all(np.all(seq.toarray().argmax(axis=1) == seq[0].toarray().argmax()) for seq in sequences)
+        seen.extend(seq[0].toarray().argmax() for seq in sequences)
+        num_padded += padding(mb_features)
+        num_sweep_ends += mb_features.end_of_sweep
+
+    assert sorted(seen) == list(range(40))
+    assert num_sweep_ends == 1
+
+    source = create_source()
+    num_padded_unbucketed = 0
+    while True:
+        mb = source.next_minibatch(30)
+        if not mb:
+            break
+        num_padded_unbucketed += padding(mb[source.streams.features])
+    assert num_padded < num_padded_unbucketed
+
+    # the evaluation does not depend on the order of the sequences
+    from cntk import parameter, times, cross_entropy_with_softmax, classification_error
+    labels = sequence.input_variable(5, is_sparse=True)
+    z = times(features, parameter((40, 5), init=C.glorot_uniform(seed=1)))
+    criterion = C.combine([cross_entropy_with_softmax(z, labels), classification_error(z, labels)])
+    source = create_source()
+    expected = criterion.test(source, minibatch_size=30,
+                              model_inputs_to_streams={features: source.streams.features, labels: source.streams.labels})
+    source = BucketingMinibatchSource(create_source(), window_in_sequences=25, randomize=True)
+    result = criterion.test(source, minibatch_size=30,
+                            model_inputs_to_streams={features: source.streams.features, labels: source.streams.labels})
+    assert result.samples == expected.samples
+    assert np.isclose(result.metric, expected.metric)
+
+
+def test_bucketing_minibatch_source_rank2():
+    # sequences of (2, 3) samples, the values encode the sequence index
+    lengths = [3, 1, 4, 2, 5, 1]
+    X = [np.arange(n * 6, dtype=np.float32).reshape(n, 2, 3) + 100 * i for i, n in enumerate(lengths)]
+    from cntk.layers.typing import Sequence, tensor
+    mb_source = BucketingMinibatchSource(C.io.MinibatchSourceFromData(
+        dict(x=(X, Sequence[tensor])), max_samples=sum(lengths)))
+    assert mb_source.streams.x.sample_shape == (2, 3)
+
+    seen = []
+    while True:
+        mb = mb_source.next_minibatch(6)
+        if not mb:
+            break
+        for seq in mb[mb_source.streams.x].as_sequences():
+            i = int(seq[0, 0, 0]) // 100
+            assert np.array_equal(seq, X[i])
+            seen.append(i)
+    assert sorted(seen) == list(range(len(X)))
+
+
 def test_minibatch_defined_by_labels(tmpdir):
 
     input_dim = 1000
@@ -247,6 +247,12 @@ def _RecurrentBlock(type, shape, cell_shape, activation, use_peepholes,
     Sct = Stabilizer(enable_self_stabilization=enable_self_stabilization, name='c_stabilizer')
     Sht = Stabilizer(enable_self_stabilization=enable_self_stabilization, name='P_stabilizer')
 
+    # The contribution of the input, x @ W + b, does not depend on the previous state. When the block is used
+    # inside a Recurrence(), the network analysis therefore leaves it outside the recurrent loop, and it is
+    # computed for all time steps at once as one large matrix product. Only the terms that depend on the previous
+    # state (dh @ H and the gates) are computed step by step. To keep it that way, the bias must be added to
+    # the input projection before anything that depends on the state.
+
     # define the model function itself
     # general interface for Recurrence():
     #   (all previous outputs delayed, input) --> (outputs and state)
@@ -337,7 +343,7 @@ def _RecurrentBlock(type, shape, cell_shape, activation, use_peepholes,
 
     def rnn_step(dh, x):
         dhs = Sdh(dh)  # previous value, stabilized
-        ht = activation (times(x, W) + times(dhs, H) + b)
+        ht = activation (b + times(x, W) + times(dhs, H))
         h = times(Sht(ht), Wmr) if has_projection else \
             ht
         #return Function.NamedOutput(h=h)
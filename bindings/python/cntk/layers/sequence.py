@@ -622,3 +622,291 @@ def UnfoldFrom(generator_function, until_predicate=None, length_increase=1, name
         return output
 
     return _inject_name(unfold_from, name)
+
+
+def BeamUnfoldFrom(generator_function, until_predicate=None, length_increase=1, beam_width=5, length_normalization=1.0):
+    '''
+    BeamUnfoldFrom(generator_function, until_predicate=None, length_increase=1, beam_width=5, length_normalization=1.0)
+
+    Creates a beam-search decoder, the beam-search counterpart of the greedy decoding
+    ``UnfoldFrom(lambda history: generator_function(history, input) >> hardmax, until_predicate)``.
+
+    For each input sequence, the decoder keeps the ``beam_width`` best partial outputs (hypotheses).
+    The hypotheses of all input sequences are evaluated as one batch, i.e. ``generator_function`` is
+    evaluated once per output step. Selecting the best extensions of all hypotheses and tracking their
+    histories is done with NumPy array operations.
+
+    Unlike ``UnfoldFrom()``, the decoder is not a CNTK Function, but drives ``generator_function`` from Python.
+    The part of ``generator_function`` that only depends on the inputs (e.g. the encoder) is evaluated once
+    per input sequence. The part that depends on the history is evaluated one word at a time with the
+    recurrent state of each hypothesis (see :meth:`~cntk.ops.functions.Function.step_state`),
+    which is reordered along with the hypotheses, such that decoding is linear in the output length.
+    The history part must hence be causal, i.e. only recur by past values with a time step of 1
+    (e.g. ``Recurrence()`` or ``RecurrenceFrom()``), and it can only take values of the inputs that
+    have no sequence axis (e.g. the result of a ``Fold()``, or a ``PastValueWindow()`` for attention),
+    except for the initial state of ``RecurrenceFrom()``, of which the last item is used.
+
+    A hypothesis ends when its last word satisfies ``until_predicate``, or when the maximum length is reached.
+    The decoding of an input sequence stops as soon as ``beam_width`` hypotheses have ended.
+    The result is the ended hypothesis with the highest log probability divided by ``length ** length_normalization``.
+
+    Example:
+     >>> # decoder for a sequence-to-sequence model s2smodel :: (history*, input*) -> word_logp*
+     >>> #   @Function
+     >>> #   @Signature(LabelSequence[Tensor[vocab_dim]], InputSequence[Tensor[vocab_dim]])
+     >>> #   def model_scores(history, input):
+     >>> #       return s2smodel(history, input)
+     >>> #   decode = BeamUnfoldFrom(model_scores, until_predicate=lambda w: w[...,sentence_end_index],
+     >>> #                           length_increase=1.5, beam_width=5)
+     >>> #   output = decode(sentence_start_one_hot, input_sequences)
+
+    Args:
+     generator_function (:class:`~cntk.ops.functions.Function`): a Function with typed arguments,
+      whose first argument is the history (the one-hot words emitted so far, starting with the initial state),
+      and whose other arguments are the inputs the decoding is conditioned on.
+      Its output is a sequence of unnormalized log probabilities (e.g. the output of a ``Dense`` layer without softmax).
+     until_predicate (:class:`~cntk.ops.functions.Function` or equivalent Python function):
+      A function that takes a one-hot word and returns 1 if it is the last word of the sequence,
+      and 0 otherwise, e.g. ``lambda w: w[...,sentence_end_index]``.
+      If it is not provided, the output length will be equal to the maximum length.
+     length_increase (float, defaults to 1): the maximum number of output items is equal to the
+      number of items of the first input sequence, multiplied by this factor (and rounded).
+     beam_width (int, defaults to 5): number of hypotheses that are kept per input sequence.
+      A ``beam_width`` of 1 corresponds to greedy decoding.
+     length_normalization (float, defaults to 1.0): exponent of the length by which the log probability
+      of a hypothesis is divided to compare hypotheses of different length. 0 disables length normalization.
+
+    Returns:
+        A Python function ``decode(initial_state, *inputs)`` that accepts the initial state (a one-hot
+        NumPy array or constant) and the data for the inputs of ``generator_function`` (lists of sequences,
+        each a NumPy array or SciPy CSR matrix), and returns the list of one-hot output sequences
+        (excluding the initial state).
+    '''
+
+    generator_function = _sanitize_function(generator_function)
+    until_predicate    = _sanitize_function(until_predicate)
+
+    if len(generator_function.arguments) < 2:
+        raise TypeError('generator_function should take the history and at least one input as arguments')
+    if beam_width < 1:
+        raise ValueError('beam_width must be at least 1')
+
+    history_arg = generator_function.arguments[0]
+    input_args = generator_function.arguments[1:]
+    word_shape = history_arg.shape
+    vocab_dim = int(np.prod(word_shape))
+    one_hot = np.eye(vocab_dim, dtype=history_arg.dtype)
+
+    # the predicate only depends on the emitted word, so it is evaluated once for all words
+    end_mask = np.zeros(vocab_dim, dtype=np.bool_)
+    if until_predicate is not None:
+        from cntk import input_variable
+        word = input_variable(word_shape, dtype=history_arg.dtype)
+        ends = until_predicate(word).eval({word: one_hot.reshape((vocab_dim,) + word_shape)})
+        end_mask = np.reshape(ends, (vocab_dim, -1))[:, 0] > 0
+
+    from cntk.ops.functions import _StepFunction, StepState
+    encoder, decoder, encoded_args = _split_generator(generator_function, history_arg)
+    step_function = _StepFunction(decoder, require_recurrence=False)
+
+    def decode(initial_state, *inputs):
+        if len(inputs) != len(input_args):
+            raise TypeError('decode() expects data for {} inputs, got {}'.format(len(input_args), len(inputs)))
+        initial_state = np.reshape(getattr(initial_state, 'value', initial_state), word_shape).astype(history_arg.dtype)
+        num_sequences = len(inputs[0])
+        max_lengths = [max(1, int(np.floor(seq.shape[0] * length_increase + 0.5))) for seq in inputs[0]]
+
+        # the values the history part takes from the inputs, computed once per input sequence
+        encoded = []
+        if encoder is not None:
+            arguments = dict((arg, data) for arg, data in zip(input_args, inputs)
+                             if any(arg.uid == encoder_arg.uid for encoder_arg in encoder.arguments))
+            results = encoder.eval(arguments)
+            if not isinstance(results, dict):
+                results = {encoder.outputs[0]: results}
+            encoded = [np.asarray(results[var]) for var in encoder.outputs]
+        encoded_uids = [var.uid for var in encoded_args]
+
+        # the hypotheses of the active sequences are the streams of the step state, beams of a sequence are adjacent
+        previous = {}
+        def step_log_probs(active, beams, words):
+            sequences = np.repeat(active, beam_width)
+            if beams is None:
+                initial_states = []
+                for i, var in enumerate(step_function.initial_states):
+                    if var.uid in encoded_uids:
+                        initial_states.append(encoded[encoded_uids.index(var.uid)][sequences])
+                    else:
+                        initial_states.append(step_function.initial_value(i, len(sequences)))
+                state = StepState(step_function, len(sequences), initial_states)
+                words = np.tile(initial_state, (len(sequences),) + (1,) * len(word_shape))
+            else:
+                # continue each hypothesis from the state of the hypothesis it extends
+                parents = np.searchsorted(previous['active'], active)[:, np.newaxis] * beam_width + beams
+                state = previous['state'].fork(parents.reshape(-1))
+                words = words.reshape(-1)
+            arguments = {history_arg: words}
+            for var, values in zip(encoded_args, encoded):
+                arguments[var] = values[sequences]
+            scores = state.step(arguments)
+            previous['active'], previous['state'] = active, state
+            scores = np.reshape(scores, (len(active), beam_width, vocab_dim)).astype(np.float64)
+            # log softmax
+            scores -= scores.max(axis=-1, keepdims=True)
+            scores -= np.log(np.exp(scores).sum(axis=-1, keepdims=True))
+            return scores
+
+        best = _beam_search(step_log_probs, num_sequences, max_lengths, end_mask, beam_width, length_normalization)
+        return [one_hot[tokens].reshape((len(tokens),) + word_shape) for tokens, _ in best]
+
+    return decode
+
+
+def _split_generator(generator_function, history_arg):
+    '''
+    Splits generator_function into the part that only depends on its inputs (all arguments
+    but the history), e.g. an encoder, and the part that depends on the history.
+
+    Returns:
+        a tuple (encoder, decoder, encoded_args). The encoder is the combination of the values of the
+        input part that the history part uses, or None if there are none. The decoder is generator_function
+        with these values replaced by the new arguments encoded_args, in the order of the encoder outputs.
+    '''
+    from cntk import input_variable
+    from cntk.logging import graph
+    from cntk.ops.functions import CloneMethod
+
+    functions = graph.depth_first_search(generator_function, lambda f: isinstance(f, Function))
+    input_uids = set(arg.uid for arg in generator_function.arguments if arg.uid != history_arg.uid)
+
+    def dependent_functions(source_uids):
+        # the functions that depend on the given arguments, a fixed point since recurrences are cycles
+        dependent = set()
+        changed = True
+        while changed:
+            changed = False
+            for f in functions:
+                if f.uid not in dependent and any(var.uid in source_uids or (var.is_output and var.owner.uid in dependent)
+                                                  for var in f.inputs):
+                    dependent.add(f.uid)
+                    changed = True
+        return dependent
+
+    history_dependent = dependent_functions(set([history_arg.uid]))
+    input_dependent = dependent_functions(input_uids)
+
+    # the values of the input part that are used by the history part, and whether they are only used
+    # as initial state of a delay, which takes the last item of a sequence
+    encoded = []
+    only_initial_state = []
+    for f in functions:
+        if f.uid not in history_dependent:
+            continue
+        for index, var in enumerate(f.inputs):
+            if var.uid in input_uids or (var.is_output and var.owner.uid in input_dependent and
+                                         var.owner.uid not in history_dependent):
+                is_initial_state = f.op_name == 'PastValue' and index == 1
+                uids = [v.uid for v in encoded]
+                if var.uid in uids:
+                    only_initial_state[uids.index(var.uid)] &= is_initial_state
+                else:
+                    encoded.append(var)
+                    only_initial_state.append(is_initial_state)
+
+    encoder_outputs = []
+    encoded_args = []
+    for var, initial_state in zip(encoded, only_initial_state):
+        batch_axes = [axis for axis in var.dynamic_axes if not axis.is_sequence_axis]
+        if len(batch_axes) != len(var.dynamic_axes):
+            if not initial_state:
+                raise ValueError('the history part of generator_function can only take values of the inputs '
+                                 'without sequence axis (e.g. of a Fold() or PastValueWindow()), not ' + str(var))
+            var = sequence.last(var)
+        encoder_outputs.append(var)
+        encoded_args.append(input_variable(var.shape, dtype=var.dtype, dynamic_axes=batch_axes, name=var.name))
+
+    if not encoded:
+        return None, generator_function, []
+    decoder = generator_function.clone(CloneMethod.share, dict(zip(encoded, encoded_args)))
+    return combine(encoder_outputs), decoder, encoded_args
+
+
+def _beam_search(step_log_probs, num_sequences, max_lengths, end_mask, beam_width, length_normalization):
+    '''
+    Batched beam search over the hypotheses of num_sequences sequences.
+
+    Args:
+     step_log_probs: function (active, beams, words) -> log probabilities of shape (len(active), beam_width, vocab_dim)
+      of the next word, where active are the indices of the sequences that are still decoded. beams and words
+      of shape (len(active), beam_width) are the hypotheses of the previous call that the current hypotheses
+      extend, and the words they are extended with. Both are None in the first call.
+     max_lengths: maximum output length of each sequence
+     end_mask: boolean array of shape (vocab_dim,) of the words that end a hypothesis
+     beam_width: number of hypotheses per sequence
+     length_normalization: exponent of the length for normalizing the log probabilities
+
+    Returns:
+        a list with the best hypothesis of each sequence as tuple (list of words, normalized log probability)
+    '''
+    max_lengths = np.asarray(max_lengths, dtype=np.int64)
+    num_end_words = int(np.count_nonzero(end_mask))
+
+    # the hypotheses of a sequence start identical, hence only the first one is extended in the first step
+    scores = np.full((num_sequences, beam_width), -np.inf)
+    scores[:, 0] = 0
+    tokens = np.zeros((num_sequences, beam_width, 0), dtype=np.int64)
+    finished = [[] for _ in range(num_sequences)]
+    active = np.arange(num_sequences)
+
+    # the hypotheses of the previous step that the hypotheses extend, and the words they are extended with
+    last_beams = np.zeros((num_sequences, beam_width), dtype=np.int64)
+    last_words = np.zeros((num_sequences, beam_width), dtype=np.int64)
+    length = 0
+    while len(active) > 0:
+        if length == 0:
+            log_probs = step_log_probs(active, None, None)
+        else:
+            log_probs = step_log_probs(active, last_beams[active], last_words[active])
+        num_active, _, vocab_dim = log_probs.shape
+
+        # the best extensions: each hypothesis can end with each end word, such that at least
+        # beam_width of the candidates do not end
+        candidates = (scores[active][:, :, np.newaxis] + log_probs).reshape((num_active, -1))
+        num_candidates = min(beam_width * (num_end_words + 1), candidates.shape[1])
+        rows = np.arange(num_active)[:, np.newaxis]
+        top = np.argpartition(-candidates, num_candidates - 1, axis=1)[:, :num_candidates]
+        top = top[rows, np.argsort(-candidates[rows, top], axis=1, kind='mergesort')]
+        top_scores = candidates[rows, top]
+        beams, words = top // vocab_dim, top % vocab_dim
+        length += 1
+
+        # candidates among the best beam_width end the hypothesis, at the maximum length all of them
+        ends = end_mask[words] | (length >= max_lengths[active])[:, np.newaxis]
+        ended = ends & np.isfinite(top_scores)
+        ended[:, beam_width:] = False
+        normalized_scores = top_scores / float(length) ** length_normalization
+        for i, c in zip(*np.nonzero(ended)):
+            s = active[i]
+            finished[s].append((tokens[s, beams[i, c]].tolist() + [int(words[i, c])], float(normalized_scores[i, c])))
+
+        # the next hypotheses are the best candidates that did not end
+        continues = ~ends
+        continues &= np.cumsum(continues, axis=1) <= beam_width
+        selected = np.argsort(~continues, axis=1, kind='mergesort')[:, :beam_width]
+        selected_beams = beams[rows, selected]
+        selected_words = words[rows, selected]
+        selected_scores = np.where(continues[rows, selected], top_scores[rows, selected], -np.inf)
+
+        # follow the back pointers to the histories of the selected hypotheses
+        tokens = np.concatenate((tokens, np.zeros((num_sequences, beam_width, 1), dtype=np.int64)), axis=2)
+        parents = tokens[active[:, np.newaxis], selected_beams, :-1]
+        tokens[active] = np.concatenate((parents, selected_words[:, :, np.newaxis]), axis=2)
+        scores[active] = selected_scores
+        last_beams[active] = selected_beams
+        last_words[active] = selected_words
+
+        # stop decoding sequences with beam_width ended hypotheses or at their maximum length
+        num_finished = np.array([len(finished[s]) for s in active])
+        active = active[(num_finished < beam_width) & (length < max_lengths[active]) & np.isfinite(selected_scores).any(axis=1)]
+
+    return [max(hypotheses, key=lambda h: h[1]) for hypotheses in finished]
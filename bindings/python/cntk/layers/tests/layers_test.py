@@ -230,6 +230,81 @@ def test_unfold():
 
     assert_list_of_arrays_equal(r, exp, err_msg='Error in UnfoldFrom(..., until_predicate, length_increase, ...) forward')
 
+####################################
+# BeamUnfoldFrom()
+####################################
+
+def test_beam_unfold():
+    from cntk.layers import BeamUnfoldFrom
+
+    # words are <s>, a, </s>; the scores of the next word only depend on the previous word
+    log_probs = np.log(np.array([[1e-6, 0.6,  0.4 ],
+                                 [1e-6, 0.55, 0.45],
+                                 [1e-6, 0.5,  0.5 ]], dtype=np.float32))
+    @Function
+    @Signature(SequenceOver[Axis('history')][Tensor[3]], SequenceOver[Axis('input')][Tensor[1]])
+    def next_word_scores(history, input):
+        return C.times(history, log_probs) + C.sequence.broadcast_as(C.sequence.reduce_sum(input), history)
+
+    start = np.array([1, 0, 0], dtype=np.float32)
+    x = [np.zeros((3, 1), dtype=np.float32), np.zeros((2, 1), dtype=np.float32)]
+    until_end = lambda w: w[...,2]
+
+    # beam width 1 is greedy decoding, which runs until the maximum length
+    decode = BeamUnfoldFrom(next_word_scores, until_predicate=until_end, beam_width=1)
+    r = [np.argmax(seq, axis=-1).tolist() for seq in decode(start, x)]
+    assert r == [[1, 1, 1], [1, 1]]
+
+    # the most probable output is ending immediately (p=0.4 vs. p=0.6*0.45 and p=0.6*0.55*0.55)
+    decode = BeamUnfoldFrom(next_word_scores, until_predicate=until_end, beam_width=2, length_normalization=0)
+    r = [np.argmax(seq, axis=-1).tolist() for seq in decode(start, x)]
+    assert r == [[2], [2]]
+
+    # with length normalization, longer outputs are preferred. The first search stops once 2 hypotheses
+    # ended (</s> and a </s>), the second one at the maximum length (a a is more probable than a </s>)
+    decode = BeamUnfoldFrom(next_word_scores, until_predicate=until_end, beam_width=2, length_normalization=1)
+    r = [np.argmax(seq, axis=-1).tolist() for seq in decode(start, x)]
+    assert r == [[1, 2], [1, 1]]
+
+def test_beam_unfold_recurrent():
+    from cntk.layers import BeamUnfoldFrom
+    from cntk.layers.sequence import _beam_search
+
+    # the scores depend on all words so far by a recurrence that starts from the last input item
+    np.random.seed(0)
+    weights = np.random.normal(size=(4, 4)).astype(np.float32)
+    @Function
+    @Signature(SequenceOver[Axis('history')][Tensor[4]], SequenceOver[Axis('input')][Tensor[4]])
+    def next_word_scores(history, input):
+        h = RecurrenceFrom(lambda h, x: C.tanh(h + x))(input, history)
+        return C.times(h, weights) + C.sequence.broadcast_as(C.sequence.reduce_sum(input), history)
+
+    history_arg, input_arg = next_word_scores.arguments
+    start = np.array([1, 0, 0, 0], dtype=np.float32)
+    x = [np.random.normal(size=(n, 4)).astype(np.float32) for n in [3, 5, 4]]
+    end_mask = np.array([False, False, False, True])
+
+    # the reference evaluates the complete histories of all hypotheses in every step
+    def full_history_log_probs(active, beams, words):
+        if beams is None:
+            histories.update((s, [[]] * beam_width) for s in active)
+        else:
+            for s, s_beams, s_words in zip(active, beams, words):
+                histories[s] = [histories[s][b] + [w] for b, w in zip(s_beams, s_words)]
+        scores = next_word_scores.eval({
+            history_arg: [np.eye(4, dtype=np.float32)[[0] + h] for s in active for h in histories[s]],
+            input_arg: [x[s] for s in active for _ in range(beam_width)]})
+        scores = np.stack([seq[-1] for seq in scores]).astype(np.float64).reshape((len(active), beam_width, 4))
+        return scores - np.log(np.exp(scores).sum(axis=-1, keepdims=True))
+
+    for beam_width in [1, 3]:
+        histories = {}
+        expected = [tokens for tokens, _ in _beam_search(full_history_log_probs, len(x), [len(seq) for seq in x],
+                                                         end_mask, beam_width, 1.0)]
+        decode = BeamUnfoldFrom(next_word_scores, until_predicate=lambda w: w[...,3], beam_width=beam_width)
+        r = [np.argmax(seq, axis=-1).tolist() for seq in decode(start, x)]
+        assert r == expected
+
 ####################################
 # Test LSTM recurrence
 ####################################
@@ -175,13 +175,111 @@ class UserLearner(cntk_py.Learner):
 
     Certain optimizers (such as AdaGrad) require additional storage.
     This can be allocated and initialized during construction.
+
+    If ``flat`` is True, all parameters and gradients are kept in two
+    contiguous NumPy buffers, :attr:`flat_parameters` and
+    :attr:`flat_gradients`, and :meth:`update_flat` has to be overridden
+    instead of :meth:`update`. This allows to update all parameters at once
+    with vectorized NumPy operations instead of looping over them. Additional
+    state can be allocated with the same layout, e.g. by
+    ``np.zeros_like(self.flat_parameters)``, and :meth:`flat_slice` tells
+    which part of the buffers belongs to which parameter. Flat buffers
+    require all parameters to have the same data type.
+
+    Args:
+        parameters (list of parameters): list of network parameters to tune.
+        lr_schedule (output of :func:`learning_rate_schedule`): learning rate schedule.
+        as_numpy (bool, optional): whether the gradients are passed to
+         :meth:`update` as NumPy arrays (default) or as
+         :class:`~cntk.core.NDArrayView` instances.
+        flat (bool, optional): whether to use flat buffers and
+         :meth:`update_flat` (requires ``as_numpy=True``). Defaults to False.
     '''
 
-    def __init__(self, parameters, lr_schedule, as_numpy=True):
+    def __init__(self, parameters, lr_schedule, as_numpy=True, flat=False):
+        if flat and not as_numpy:
+            raise ValueError('flat requires as_numpy=True')
+
         super(UserLearner, self).__init__(parameters, lr_schedule)
         self.as_numpy = as_numpy
+        self.flat = flat
+        if flat:
+            self._init_flat_buffers(parameters)
         self.__disown__()
 
+    def _init_flat_buffers(self, parameters):
+        parameters = list(parameters)
+        dtypes = set(np.dtype(p.dtype) for p in parameters)
+        if len(dtypes) > 1:
+            raise ValueError('flat buffers require all parameters to have '
+                             'the same data type, but got %s' %
+                             ', '.join(str(d) for d in dtypes))
+        dtype = dtypes.pop() if dtypes else np.float32
+
+        sizes = [int(np.prod(p.shape)) for p in parameters]
+        offsets = np.cumsum([0] + sizes)
+
+        self.flat_parameters = np.zeros(offsets[-1], dtype=dtype)
+        self.flat_gradients = np.zeros(offsets[-1], dtype=dtype)
+
+        # [parameter uid] -> (parameter, slice, parameter view, gradient view)
+        self._flat_layout = {}
+        for p, begin, end in zip(parameters, offsets[:-1], offsets[1:]):
+            s = slice(int(begin), int(end))
+            self._flat_layout[p.uid] = (p, s,
+                                        self.flat_parameters[s].reshape(p.shape),
+                                        self.flat_gradients[s].reshape(p.shape))
+
+    def flat_slice(self, parameter):
+        '''
+        Returns the slice of :attr:`flat_parameters` and :attr:`flat_gradients`
+        that holds the (flattened) data of ``parameter``.
+
+        Args:
+            parameter (:class:`~cntk.variables.Parameter`): parameter of this
+             learner
+
+        Returns:
+            `slice` into the flat buffers
+        '''
+        if not self.flat:
+            raise ValueError('flat_slice requires a learner with flat=True')
+
+        return self._flat_layout[parameter.uid][1]
+
+    @staticmethod
+    def _copy_to(dst, ndav):
+        from cntk.device import DeviceKind
+        if cntk_py.NDArrayView.device(ndav).type() == DeviceKind.CPU and \
+                not cntk_py.NDArrayView.is_sparse(ndav):
+            np.copyto(dst, cntk_py.NDArrayView.to_ndarray_view(ndav))
+        else:
+            map_if_possible(ndav)
+            np.copyto(dst, asarray(ndav))
+
+    def _update_flat(self, gradient_values, training_sample_count, sweep_end):
+        from cntk.device import cpu
+        gradients = dict((var.uid, val) for var, val in gradient_values.items())
+        for uid, (p, _, p_view, g_view) in self._flat_layout.items():
+            # the parameters might have been changed outside of the learner
+            # (e.g. when restoring a checkpoint), so we always read them
+            UserLearner._copy_to(p_view, cntk_py.Parameter.value(p))
+            if uid in gradients:
+                UserLearner._copy_to(g_view, gradients[uid])
+            else:
+                g_view.fill(0)
+
+        result = self.update_flat(self.flat_parameters, self.flat_gradients,
+                                  training_sample_count, sweep_end)
+
+        # The views are borrowed without copying, so that every parameter is
+        # written with a single copy from the flat buffer.
+        for p, _, p_view, _ in self._flat_layout.values():
+            cntk_py.Parameter.set_value(p, NDArrayView.from_dense(p_view, cpu(),
+                                                                  borrow=True))
+
+        return result
+
     def _update(self, gradient_values, training_sample_count, sweep_end):
         '''
         Update the parameters and related state associated with this learner.
@@ -200,13 +298,17 @@ class UserLearner(cntk_py.Learner):
         '''
         map_if_possible(gradient_values)
 
+        if self.flat:
+            return self._update_flat(gradient_values, training_sample_count,
+                                     sweep_end)
+
         if self.as_numpy:
             var_nd_map = {var: asarray(gradient_values[var]) \
                           for var, val in gradient_values.items()}
         else:
             var_nd_map = gradient_values
 
-        return self.update(gradient_values, training_sample_count, sweep_end)
+        return self.update(var_nd_map, training_sample_count, sweep_end)
 
     def update(self, gradient_values, training_sample_count, sweep_end):
         '''
@@ -224,7 +326,30 @@ class UserLearner(cntk_py.Learner):
             bool: `False` to indicate that learning has stopped for all of the
             parameters associated with this learner
         '''
-        raise NotImplementedError('UserLearner.update must be overriden')
+        raise NotImplementedError('UserLearner.update must be overridden')
+
+    def update_flat(self, parameter_values, gradient_values,
+                    training_sample_count, sweep_end):
+        '''
+        Update the parameters associated with this learner in place, if it was
+        created with ``flat=True``. The updated parameter values are written
+        back to the model after this method returns.
+
+        Args:
+            parameter_values (`numpy.ndarray`): one-dimensional array holding
+             the current values of all parameters, to be modified in place
+            gradient_values (`numpy.ndarray`): one-dimensional array with the
+             same layout holding the gradients of all parameters
+            training_sample_count (int): number of samples in the minibatch
+            sweep_end (bool): if the data is fed by a conforming reader, this indicates
+             whether a full pass over the dataset has just occurred.
+
+        Returns:
+            bool: `False` to indicate that learning has stopped for all of the
+            parameters associated with this learner
+        '''
+        raise NotImplementedError('UserLearner.update_flat must be overridden '
+                                  'when using flat=True')
 
 
 @typemap
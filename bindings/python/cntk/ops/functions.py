@@ -8,16 +8,18 @@ from enum import Enum, unique
 import sys
 import warnings
 import collections
+import numpy as np
 
 import cntk
 from cntk import cntk_py, Value
-from cntk.device import DeviceDescriptor, cpu
+from cntk.device import DeviceDescriptor, DeviceKind, cpu
 from cntk.internal import map_if_possible, typemap, sanitize_var_map,\
                           sanitize_batch, sanitize_dtype_cntk, _as_tuple,\
                           sanitize_variable_value_dict,\
                           sanitize_Function_attributes,\
                           sanitize_variables_or_functions,\
-                          _value_as_sequence_or_array
+                          _value_as_sequence_or_array, _value_as_numpy_view,\
+                          _is_viewable
 from cntk.internal.utils import get_python_function_arguments, \
                                 map_function_arguments, _py_dict_to_cntk_dict, \
                                 _to_cntk_dict_value
@@ -631,6 +633,48 @@ class Function(cntk_py.Function):
         _, output_map = self.forward(arguments, outputs, device=device, as_numpy=as_numpy)
         return sanitize_variable_value_dict(output_map)
 
+    def step_state(self, num_streams=1, initial_states=None, device=None):
+        '''
+        Creates an explicit recurrent state for evaluating this Function one step
+        at a time for ``num_streams`` independent streams, e.g. to generate
+        sequences item by item. The Function must be recurrent over its inputs
+        by means of :func:`~cntk.layers.sequence.Recurrence`,
+        :func:`~cntk.layers.sequence.RecurrenceFrom` or
+        :func:`~cntk.layers.sequence.Fold` (or any other use of
+        :func:`~cntk.ops.sequence.past_value` with a time step of 1).
+
+        Unlike evaluating the Function on sequences that are marked as
+        continuations of the previous minibatch, the state is held by the
+        returned :class:`StepState` and can be advanced, forked, reset or
+        dropped per stream.
+
+        Example:
+            >>> from cntk.layers import Recurrence
+            >>> x = C.sequence.input_variable(1)
+            >>> running_sum = Recurrence(C.plus)(x)
+            >>> state = running_sum.step_state(num_streams=2)
+            >>> state.step(np.array([[1], [10]], dtype=np.float32))
+            array([[  1.],
+                   [ 10.]], dtype=float32)
+            >>> state.step(np.array([[2], [20]], dtype=np.float32))
+            array([[  3.],
+                   [ 30.]], dtype=float32)
+
+        Args:
+            num_streams (int, default 1): number of independent streams
+            initial_states (list of NumPy arrays, optional): the initial value of
+             each state variable for all streams, with shape ``(num_streams,) + shape``.
+             Required if an initial state of the Function is not a constant, e.g. for
+             :func:`~cntk.layers.sequence.RecurrenceFrom`.
+            device (:class:`~cntk.device.DeviceDescriptor`): the device descriptor that
+             contains the type and id of the device on which the computation is
+             to be performed.
+
+        Returns:
+            :class:`StepState`: the state of all streams before the first step
+        '''
+        return StepState(_StepFunction(self), num_streams, initial_states, device)
+
     @typemap
     def forward(self, arguments, outputs=None, keep_for_backward=None, device=None, as_numpy=True):
         '''
@@ -1550,6 +1594,226 @@ class Function(cntk_py.Function):
             return f
         return decorator
 
+class _StepFunction(object):
+    '''
+    The step function of a recurrent Function, in which each delay (past value
+    with time step 1) is replaced by an input that provides the previous state,
+    and whose outputs are the outputs of the Function followed by the new
+    values of the states. Used by :class:`StepState`.
+    '''
+
+    def __init__(self, function, require_recurrence=True):
+        from cntk import combine, input_variable
+        from cntk.logging import graph
+
+        if graph.depth_first_search(function, lambda f: isinstance(f, Function) and f.op_name == 'FutureValue'):
+            raise ValueError('cannot evaluate a Function with future values (e.g. go_backwards=True) step by step')
+        delays = graph.depth_first_search(function, lambda f: isinstance(f, Function) and f.op_name == 'PastValue')
+        if not delays and require_recurrence:
+            raise ValueError('the Function has no recurrence that can be evaluated step by step')
+        for delay in delays:
+            if delay.attributes.get('offset', 1) != 1:
+                raise ValueError('cannot evaluate past values with a time step other than 1 step by step')
+
+        self.outputs = function.outputs
+        self.num_outputs = len(function.outputs)
+        self.state_inputs = [input_variable(delay.output.shape, dtype=delay.output.dtype,
+                                            dynamic_axes=delay.output.dynamic_axes,
+                                            name='step_state_' + delay.uid) for delay in delays]
+        self.initial_states = [delay.inputs[1] for delay in delays]
+
+        # the same variable can be an output and a state, or several states
+        output_vars = []
+        output_uids = []
+        self.output_indices = []
+        for var in list(function.outputs) + [delay.inputs[0] for delay in delays]:
+            if var.uid not in output_uids:
+                output_uids.append(var.uid)
+                output_vars.append(var)
+            self.output_indices.append(output_uids.index(var.uid))
+
+        substitutions = dict((delay.output, state_input) for delay, state_input in zip(delays, self.state_inputs))
+        self.function = combine(output_vars).clone(CloneMethod.share, substitutions)
+
+        # arguments that only provide initial states (e.g. for RecurrenceFrom) are not needed anymore
+        step_argument_uids = set(arg.uid for arg in self.function.arguments)
+        self.arguments = [arg for arg in function.arguments if arg.uid in step_argument_uids]
+
+    def initial_value(self, index, num_streams):
+        '''
+        The initial value of state ``index`` for ``num_streams`` streams, if it is constant.
+        '''
+        initial_state = self.initial_states[index]
+        if initial_state.is_constant:
+            value = initial_state.as_constant().value
+        elif initial_state.is_parameter:
+            value = initial_state.as_parameter().value
+        else:
+            raise ValueError('the initial state of the Function is not a constant and must be passed explicitly')
+        state_input = self.state_inputs[index]
+        return np.array(np.broadcast_to(value, (num_streams,) + state_input.shape), dtype=state_input.dtype)
+
+
+class StepState(object):
+    '''
+    The recurrent state of several independent streams that are evaluated
+    step by step with the same recurrent Function. Created by
+    :meth:`Function.step_state`.
+
+    Each call of :meth:`step` evaluates the Function for one item of every
+    stream in a single batch and advances the state of all streams. Streams
+    are identified by their index, i.e. their position in the batch.
+    '''
+
+    def __init__(self, step_function, num_streams, initial_states=None, device=None):
+        self._step_function = step_function
+        self._device = device
+        self._states = [None] * len(step_function.state_inputs)
+        self._num_streams = num_streams
+        self.reset(initial_states=initial_states)
+
+    @property
+    def num_streams(self):
+        '''
+        The number of streams.
+        '''
+        return self._num_streams
+
+    @property
+    def states(self):
+        '''
+        The current value of each state variable as NumPy array of shape ``(num_streams,) + shape``.
+        '''
+        return list(self._states)
+
+    def _stream_indices(self, streams):
+        if streams is None:
+            return np.arange(self._num_streams)
+        return np.asarray(streams, dtype=np.int64).reshape(-1)
+
+    def reset(self, streams=None, initial_states=None):
+        '''
+        Resets streams to their initial state.
+
+        Args:
+            streams (list of int, optional): the streams to reset. All streams if not given.
+            initial_states (list of NumPy arrays, optional): the initial value of each
+             state variable for the reset streams, with shape ``(len(streams),) + shape``.
+             If not given, the initial states of the Function are used.
+        '''
+        indices = self._stream_indices(streams)
+        for i, state_input in enumerate(self._step_function.state_inputs):
+            if initial_states is not None:
+                value = initial_states[i]
+            else:
+                value = self._step_function.initial_value(i, len(indices))
+            value = np.reshape(np.asarray(value, dtype=state_input.dtype), (len(indices),) + state_input.shape)
+            if self._states[i] is None:
+                self._states[i] = np.zeros((self._num_streams,) + state_input.shape, dtype=state_input.dtype)
+            self._states[i][indices] = value
+
+    def fork(self, streams):
+        '''
+        Creates a new :class:`StepState` from the given streams of this state, e.g.
+        to continue several hypotheses from the same stream in a beam search.
+
+        Args:
+            streams (list of int): the streams of this state that become the
+             streams of the new state. A stream can be repeated.
+
+        Returns:
+            :class:`StepState`: the new state; this state is not changed
+        '''
+        indices = self._stream_indices(streams)
+        forked = StepState.__new__(StepState)
+        forked._step_function = self._step_function
+        forked._device = self._device
+        forked._states = [state[indices] for state in self._states]
+        forked._num_streams = len(indices)
+        return forked
+
+    def drop(self, streams):
+        '''
+        Removes streams. The remaining streams keep their order, and their indices
+        are shifted accordingly.
+
+        Args:
+            streams (list of int): the streams to remove
+        '''
+        keep = np.ones(self._num_streams, dtype=np.bool_)
+        keep[self._stream_indices(streams)] = False
+        self._states = [state[keep] for state in self._states]
+        self._num_streams = int(keep.sum())
+
+    def step(self, arguments, as_dict=False):
+        '''
+        Evaluates the Function for the next item of every stream and advances the
+        state of all streams.
+
+        Args:
+            arguments: maps the arguments of the Function to the next item of each
+             stream, i.e. to a NumPy array of shape ``(num_streams,) + shape``.
+             If the Function has a single argument, the array can be passed directly.
+             Instead of one-hot vectors, an integer array of shape ``(num_streams,)``
+             with the indices of the one-hot entries can be passed. For sparse inputs,
+             it is converted into a sparse one-hot batch without creating dense vectors.
+             Arguments without a sequence axis take an array with one value per stream,
+             which is not advanced.
+            as_dict (bool, default False): whether to always return a dict that maps
+             the outputs to their values
+
+        Returns:
+            the values of the outputs of the Function with shape ``(num_streams,) + shape``,
+            as a dict if the Function has several outputs or ``as_dict`` is ``True``
+        '''
+        step_function = self._step_function
+        if not isinstance(arguments, dict):
+            if len(step_function.arguments) != 1:
+                raise ValueError('arguments must be a dict for a Function with more than one argument')
+            arguments = {step_function.arguments[0]: arguments}
+
+        batch = {}
+        for var, data in arguments.items():
+            if isinstance(var, str):
+                matches = [arg for arg in step_function.arguments if arg.name == var]
+            else:
+                matches = [arg for arg in step_function.arguments if arg.uid == var.uid]
+            if matches: # data for arguments that only provide initial states is ignored
+                batch[matches[0]] = self._as_step_batch(matches[0], data)
+        for state_input, state in zip(step_function.state_inputs, self._states):
+            batch[state_input] = state.reshape((self._num_streams, 1) + state_input.shape)
+
+        results = step_function.function.eval(batch, device=self._device)
+        if not isinstance(results, dict):
+            results = {step_function.function.outputs[0]: results}
+        values = [np.reshape(np.asarray(results[var]), (self._num_streams,) + var.shape)
+                  for var in step_function.function.outputs]
+        values = [values[i] for i in step_function.output_indices]
+
+        num_outputs = step_function.num_outputs
+        self._states = [np.array(value) for value in values[num_outputs:]]
+        outputs = values[:num_outputs]
+        if num_outputs == 1 and not as_dict:
+            return outputs[0]
+        return dict(zip(step_function.outputs, outputs))
+
+    def _as_step_batch(self, var, data):
+        '''
+        Converts the next item of every stream into a batch of sequences of length 1.
+        Arguments without sequence axis get one value per stream.
+        '''
+        if not any(axis.is_sequence_axis for axis in var.dynamic_axes):
+            return np.reshape(np.asarray(data, dtype=var.dtype), (self._num_streams,) + var.shape)
+        if isinstance(data, np.ndarray) and np.issubdtype(data.dtype, np.integer) and \
+                data.shape == (self._num_streams,) and var.shape != ():
+            if var.is_sparse:
+                return Value.one_hot([[int(i)] for i in data], var.shape, dtype=var.dtype, device=self._device)
+            one_hot = np.zeros((self._num_streams, 1, int(np.prod(var.shape))), dtype=var.dtype)
+            one_hot[np.arange(self._num_streams), 0, data] = 1
+            return one_hot.reshape((self._num_streams, 1) + var.shape)
+        return np.reshape(np.asarray(data, dtype=var.dtype), (self._num_streams, 1) + var.shape)
+
+
 def BlockFunction(op_name, name):
     '''
     Decorator for defining a @Function as a BlockFunction. Same as @Function, but wrap the content into an :func:`~cntk.ops.as_block`.
@@ -1619,9 +1883,29 @@ class UserFunction(Function):
          converted from and to NumPy. Defaults to True. Specifying this as
          `False` passes the data as CNTK Value objects.
         name (str): name of this function
+        zero_copy (bool, optional): whether the NumPy data should be
+         exchanged without copying (requires ``as_numpy=True``). Defaults to
+         False. If True, dense data on the CPU is passed to :meth:`forward`
+         and :meth:`backward` as NumPy arrays sharing the memory of the CNTK
+         values, and the results are written in place into preallocated
+         buffers. Data that cannot be shared (sparse, masked or residing on
+         the GPU) is converted by copying as usual. In this mode, the
+         signatures are ``forward(self, arguments, outputs, device=None,
+         outputs_to_retain=None)``, which returns only the state, and
+         ``backward(self, state, root_gradients, variables)``, for any number
+         of inputs and outputs. ``outputs`` and ``variables`` map to writable
+         NumPy arrays that are to be filled in (e.g. ``outputs[var][...] =
+         result``), or to `None` if no buffer could be preallocated, in which
+         case the result has to be assigned instead. The arrays passed in are
+         only valid during the call. Anything that is needed later, e.g. in
+         :meth:`backward`, has to be copied.
     '''
 
-    def __init__(self, inputs, as_numpy=True, attributes=None, name=''):
+    def __init__(self, inputs, as_numpy=True, attributes=None, name='',
+                 zero_copy=False):
+        if zero_copy and not as_numpy:
+            raise ValueError('zero_copy requires as_numpy=True')
+
         if  attributes is None:
             super(UserFunction, self).__init__(inputs, name)
         else:
@@ -1629,6 +1913,7 @@ class UserFunction(Function):
             super(UserFunction, self).__init__(inputs, attributes, name)
         self.set_native(False)
         self.as_numpy = as_numpy
+        self.zero_copy = zero_copy
 
         # Since the state will frequently not be used, we cache the None-state
         # to speed up.
@@ -1664,6 +1949,10 @@ class UserFunction(Function):
         Returns:
              A BackPropState instance, which is used by :func:`backward`.
         '''
+        if self.zero_copy:
+            return self._forward_zero_copy(arguments, outputs, device,
+                                           outputs_to_retain)
+
         if self.as_numpy:
             inputs = self.inputs
             arguments = tuple(_value_as_sequence_or_array(v, inputs[i]) for i, v in enumerate(arguments))
@@ -1680,6 +1969,19 @@ class UserFunction(Function):
         else:
             state = self.forward(args, outputs, device, outputs_to_retain)
 
+        state = self._wrap_state(state, device)
+
+        if self.as_numpy:
+            for k,v in outputs.items():
+                if v is None:
+                    raise ValueError('not all outputs have been provided')
+
+                # FIXME: seq_starts
+                outputs[k] = sanitize_batch(k, v, None, device)
+
+        return state, outputs
+
+    def _wrap_state(self, state, device):
         if isinstance(state, cntk_py.BackPropState):
             self._state_wrapped = False
         else:
@@ -1689,13 +1991,81 @@ class UserFunction(Function):
             else:
                 state = cntk_py.UserBackPropState.create(self, device, state)
 
-        if self.as_numpy:
-            for k,v in outputs.items():
-                if v is None:
-                    raise ValueError('not all outputs have been provided')
+        return state
+
+    @staticmethod
+    def _allocate_buffers(variables, templates, device):
+        '''
+        Preallocates CPU buffers for ``variables``. The batch dimensions are
+        taken from the first value in ``templates`` (list of variable/value
+        pairs) with the same dynamic axes that can be shared with NumPy.
+
+        Returns:
+            dict mapping the variables to tuples of the preallocated
+            :class:`~cntk.core.Value` and its NumPy view, or to `None` if no
+            buffer could be preallocated
+        '''
+        from cntk.core import NDArrayView
+        buffers = {}
+        for var in variables:
+            buffers[var] = None
+            if device is not None and device.type() != DeviceKind.CPU:
+                continue
+            if var.is_sparse or any(d < 0 for d in var.shape):
+                continue
+
+            dynamic_axes = var.dynamic_axes
+            if not dynamic_axes:
+                batch_shape = ()
+            else:
+                batch_shape = None
+                for template_var, template in templates:
+                    if template_var.dynamic_axes == dynamic_axes and \
+                            _is_viewable(template):
+                        shape = cntk_py.Value.shape(template).dimensions()
+                        batch_shape = shape[:len(shape) - len(template_var.shape)]
+                        break
+                if batch_shape is None:
+                    continue
+
+            ndav = NDArrayView(batch_shape + var.shape, var.dtype, cpu())
+            buffers[var] = (Value(ndav), ndav.as_numpy_view())
 
+        return buffers
+
+    @staticmethod
+    def _collect_buffers(results, buffers, device, allow_missing=False):
+        for k, v in results.items():
+            if v is None:
+                if allow_missing:
+                    continue
+                raise ValueError('not all outputs have been provided')
+
+            if buffers.get(k) is not None and v is buffers[k][1]:
+                results[k] = buffers[k][0]
+            else:
                 # FIXME: seq_starts
-                outputs[k] = sanitize_batch(k, v, None, device)
+                results[k] = sanitize_batch(k, v, None, device)
+
+    def _forward_zero_copy(self, arguments, outputs, device, outputs_to_retain):
+        inputs = self.inputs
+        templates = list(zip(inputs, arguments))
+        np_args = tuple(_value_as_numpy_view(v, inputs[i])
+                        for i, v in enumerate(arguments))
+        args = np_args if len(np_args) > 1 else np_args[0]
+
+        map_if_possible(outputs)
+        map_if_possible(outputs_to_retain)
+
+        buffers = UserFunction._allocate_buffers(list(outputs.keys()), templates,
+                                                 device)
+        for k in outputs:
+            outputs[k] = buffers[k][1] if buffers[k] is not None else None
+
+        state = self.forward(args, outputs, device, outputs_to_retain)
+        state = self._wrap_state(state, device)
+
+        UserFunction._collect_buffers(outputs, buffers, device)
 
         return state, outputs
 
@@ -1723,6 +2093,10 @@ class UserFunction(Function):
         '''
         device = state.device()
 
+        if self.zero_copy:
+            return self._backward_zero_copy(state, root_gradients, variables,
+                                            device)
+
         if self.as_numpy:
             map_if_possible(root_gradients)
             for v in root_gradients:
@@ -1754,6 +2128,36 @@ class UserFunction(Function):
                 if v is not None:
                     variables[k] = sanitize_batch(k, v, None, device)
 
+    def _backward_zero_copy(self, state, root_gradients, variables, device):
+        if not isinstance(state, cntk_py.BackPropState):
+            raise ValueError('state must be of type BackPropState')
+
+        if self._state_wrapped:
+            state = cntk_py.UserBackPropState.data(state)
+
+        map_if_possible(root_gradients)
+        map_if_possible(variables)
+
+        templates = list(root_gradients.items())
+        for v in root_gradients:
+            if v.needs_gradient:
+                root_gradients[v] = _value_as_numpy_view(root_gradients[v], v)
+
+        if len(root_gradients) == 1:
+            for rg in root_gradients.values():
+                break
+            root_gradients = rg
+
+        buffers = UserFunction._allocate_buffers(list(variables.keys()), templates,
+                                                 device)
+        for k in variables:
+            variables[k] = buffers[k][1] if buffers[k] is not None else None
+
+        self.backward(state, root_gradients, variables)
+
+        UserFunction._collect_buffers(variables, buffers, device,
+                                      allow_missing=True)
+
     def _infer_outputs(self, outputs):
         outputs.extend(self.infer_outputs())
 
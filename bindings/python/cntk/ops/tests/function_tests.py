@@ -540,3 +540,44 @@ def test_clone_with_different_dynamic_axes():
 
     rnn = C.layers.Recurrence(C.layers.LSTM(5))(question_input)
     rnn_cloned = rnn.clone(C.CloneMethod.share, {question_input:answer_input})
+
+
+def test_step_state():
+    from cntk.layers import Recurrence, RNNStep, Embedding
+
+    x = C.sequence.input_variable(1)
+    running_sum = Recurrence(C.plus)(x)
+
+    state = running_sum.step_state(num_streams=2)
+    assert state.num_streams == 2
+    assert np.array_equal(state.step(np.array([[1], [10]], dtype=np.float32)), [[1], [10]])
+    assert np.array_equal(state.step(np.array([[2], [20]], dtype=np.float32)), [[3], [30]])
+
+    # forking copies the state of streams, the original state is not changed
+    forked = state.fork([1, 1, 0])
+    assert forked.num_streams == 3
+    assert np.array_equal(forked.step(np.array([[1], [2], [3]], dtype=np.float32)), [[31], [32], [6]])
+    assert np.array_equal(state.step(np.array([[0], [0]], dtype=np.float32)), [[3], [30]])
+
+    # reset and drop streams
+    state.reset([1])
+    assert np.array_equal(state.step(np.array([[1], [1]], dtype=np.float32)), [[4], [1]])
+    state.drop([0])
+    assert state.num_streams == 1
+    assert np.array_equal(state.step(np.array([[5]], dtype=np.float32)), [[6]])
+
+    # stepping through sequences gives the same result as evaluating the sequences,
+    # one-hot inputs can be passed as indices
+    vocab_dim = 5
+    w = C.sequence.input_variable(vocab_dim, is_sparse=True)
+    rnn = Recurrence(RNNStep(3, init=C.glorot_uniform(seed=1)))(Embedding(4, init=C.glorot_uniform(seed=2))(w))
+    indices = np.array([[0, 3, 1, 4], [2, 2, 0, 1]])
+    expected = rnn.eval({w: C.Value.one_hot(indices.tolist(), vocab_dim)})
+    state = rnn.step_state(num_streams=2)
+    for t in range(indices.shape[1]):
+        out = state.step(indices[:, t])
+        for s in range(2):
+            assert np.allclose(out[s], expected[s][t], atol=1e-6)
+
+    with pytest.raises(ValueError):
+        Recurrence(C.plus, go_backwards=True)(x).step_state()
@@ -703,4 +703,105 @@ def test_no_deadlock_init_outputs():
     x = C.input_variable((3, C.FreeDimension, 2), name='x')
     from cntk import user_function
     with pytest.raises(RuntimeError):
-        s = user_function(FaultyUserFunc(x))
\ No newline at end of file
+        s = user_function(FaultyUserFunc(x))
+
+class ZeroCopyScaledSum(UserFunction):
+    def __init__(self, arg1, arg2, name='f1'):
+        super(ZeroCopyScaledSum, self).__init__([arg1, arg2], zero_copy=True, name=name)
+        self.forward_args_are_views = None
+
+    def infer_outputs(self):
+        return [C.output_variable(self.inputs[0].shape, self.inputs[0].dtype, self.inputs[0].dynamic_axes)]
+
+    def forward(self, arguments, outputs, device=None, outputs_to_retain=None):
+        a0, a1 = arguments
+        self.forward_args_are_views = a0.base is not None and a1.base is not None
+        if outputs[self.output] is None:
+            # no preallocated buffer, e.g. on GPU
+            outputs[self.output] = a0 + 2 * a1
+        else:
+            np.multiply(a1, 2, out=outputs[self.output])
+            outputs[self.output] += a0
+        return None
+
+    def backward(self, state, root_gradients, variables):
+        for var, scale in zip(self.inputs, [1, 2]):
+            if var in variables:
+                if variables[var] is None:
+                    variables[var] = scale * root_gradients
+                else:
+                    np.multiply(root_gradients, scale, out=variables[var])
+
+
+def test_udf_zero_copy(device_id):
+    from .ops_test_utils import cntk_device
+    dev = cntk_device(device_id)
+
+    dim = 3
+    x = C.input_variable(dim, needs_gradient=True, name='x')
+    y = C.input_variable(dim, needs_gradient=True, name='y')
+    udf = ZeroCopyScaledSum(x, y)
+    op = C.user_function(udf)
+
+    x_data = AA([[1., 2., 3.], [4., 5., 6.]], dtype=np.float32)
+    y_data = AA([[1., 1., 1.], [2., 2., 2.]], dtype=np.float32)
+    gradients, result = op.grad({x: x_data, y: y_data}, op.arguments, [op.output], device=dev)
+
+    assert np.allclose(result, x_data + 2 * y_data)
+    assert np.allclose(gradients[x], np.ones_like(x_data))
+    assert np.allclose(gradients[y], 2 * np.ones_like(y_data))
+    if dev.type() == C.device.DeviceKind.CPU:
+        assert udf.forward_args_are_views
+
+
+def test_udf_zero_copy_requires_as_numpy():
+    x = C.input_variable(1)
+    with pytest.raises(ValueError):
+        UserFunction([x], as_numpy=False, zero_copy=True)
+
+
+class ZeroCopyColumnSum(UserFunction):
+    # the output has a lower rank than the input
+    def __init__(self, arg, name='f1'):
+        super(ZeroCopyColumnSum, self).__init__([arg], zero_copy=True, name=name)
+        self.preallocated = []
+
+    def infer_outputs(self):
+        return [C.output_variable(self.inputs[0].shape[1:], self.inputs[0].dtype, self.inputs[0].dynamic_axes)]
+
+    def forward(self, argument, outputs, device=None, outputs_to_retain=None):
+        self.preallocated.append(outputs[self.output] is not None)
+        if outputs[self.output] is None:
+            outputs[self.output] = argument.sum(axis=-2)
+        else:
+            np.sum(argument, axis=-2, out=outputs[self.output])
+        return None
+
+    def backward(self, state, root_gradients, variables):
+        arg = self.inputs[0]
+        self.preallocated.append(variables[arg] is not None)
+        gradient = np.expand_dims(root_gradients, axis=-2)
+        if variables[arg] is None:
+            variables[arg] = np.repeat(gradient, arg.shape[0], axis=-2)
+        else:
+            variables[arg][...] = gradient
+
+
+def test_udf_zero_copy_output_rank_differs(device_id):
+    from .ops_test_utils import cntk_device
+    dev = cntk_device(device_id)
+
+    x = C.input_variable((2, 3), needs_gradient=True, name='x')
+    udf = ZeroCopyColumnSum(x)
+    op = C.user_function(udf)
+
+    x_data = np.arange(24, dtype=np.float32).reshape(4, 2, 3)
+    gradients, result = op.grad({x: x_data}, [x], [op.output], device=dev)
+
+    assert result.shape == (4, 3)
+    assert np.allclose(result, x_data.sum(axis=1))
+    assert gradients.shape == (4, 2, 3)
+    assert np.allclose(gradients, np.ones_like(x_data))
+    if dev.type() == C.device.DeviceKind.CPU:
+        # both the output and the input gradient were written into preallocated buffers
+        assert udf.preallocated == [True, True]